@@ -6,9 +6,19 @@ from flask_cors import CORS  # Import CORS
 import os
 import click  # Import click for CLI commands
 from app.utils.logger import init_app as init_logger
+from app.utils.db_pool import init_app as init_db_pool
+from app.utils.replica import RoutingSession
+from app.utils.audit import AuditWriter
+from app.utils.revocation import RevocationCache, prune_expired_tokens
+from app.utils.sweeper import Sweeper
+from app.utils.idempotency import IdempotencyStore, purge_expired_idempotency_keys
+from app.utils.table_versions import init_app as init_table_versions
+from app.utils.catalogue import CatalogueCache
+from app.utils.stock_events import StockEventQueue
+from app.utils.request_metrics import RequestMetrics
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})  # Reads can go to a replica
 jwt = JWTManager()
 migrate = Migrate()
 cors = CORS()  # Initialize CORS
@@ -29,8 +39,15 @@ def create_app(config_class=None):
     app.config.from_object(config_class)
 
     # Initialize extensions
+    init_db_pool(app)  # Pool sizing and checkout metrics, before the engine is built
     db.init_app(app)
     init_logger(app)  # Initialize logging
+    RequestMetrics(app)  # Per-endpoint latency and SQL cost for /metrics
+    AuditWriter(app)  # Background writer for log_action rows
+    IdempotencyStore(app)  # Stored responses for Idempotency-Key retries
+    init_table_versions(app)  # Per-table change counters kept on commit
+    CatalogueCache(app)  # Cached product and category lists
+    StockEventQueue(app)  # Reorder-level crossings for pollers
     jwt.init_app(app)
     migrate.init_app(app, db)
     cors.init_app(app, resources={r"/*": {"origins": "http://localhost:3000"}})  # Enable CORS for frontend
@@ -43,6 +60,7 @@ def create_app(config_class=None):
     from app.routes.logs import logs_bp
     from app.routes.products import products_bp
     from app.routes.category import category_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(carts_bp)
@@ -50,10 +68,21 @@ def create_app(config_class=None):
     app.register_blueprint(logs_bp)
     app.register_blueprint(products_bp)
     app.register_blueprint(category_bp)
+    app.register_blueprint(metrics_bp)
     # Automatically create tables if they don't exist
     with app.app_context():
         db.create_all()
 
+    # Load revoked token ids and hook them into JWT verification
+    RevocationCache(app)
+    from app.extensions import check_if_token_is_blacklisted  # noqa: F401
+
+    # Optional periodic cleanup of expired rows
+    sweeper = Sweeper(app)
+    sweeper.add_job('prune-tokens', lambda: prune_expired_tokens(app.config.get('SWEEP_BATCH_SIZE', 1000)))
+    sweeper.add_job('purge-idempotency-keys',
+                    lambda: purge_expired_idempotency_keys(app.config.get('SWEEP_BATCH_SIZE', 1000)))
+
     # Register CLI commands
     register_cli_commands(app)
 
@@ -90,3 +119,96 @@ def register_cli_commands(app):
             db.session.add(admin)
             db.session.commit()
             print(f"Admin user '{username}' created successfully!")
+
+
+    @app.cli.command("prune-tokens")
+    @click.option("--batch-size", default=1000, show_default=True, help="Rows deleted per transaction.")
+    def prune_tokens(batch_size):
+        """Delete blacklisted tokens that have already expired."""
+        removed, elapsed = prune_expired_tokens(batch_size)
+        print(f"Removed {removed} expired blacklisted tokens in {elapsed:.3f}s")
+
+
+    @app.cli.command("purge-idempotency-keys")
+    @click.option("--batch-size", default=1000, show_default=True, help="Rows deleted per transaction.")
+    def purge_idempotency_keys(batch_size):
+        """Delete idempotency keys past their expiry."""
+        removed, elapsed = purge_expired_idempotency_keys(batch_size)
+        print(f"Removed {removed} expired idempotency keys in {elapsed:.3f}s")
+
+
+    @app.cli.command("import-products")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["json", "ndjson", "csv"]), default=None,
+                  help="Input format (default: guessed from the file extension).")
+    @click.option("--user", "username", default=None, help="Username recorded as added_by (default: first admin).")
+    def import_products(path, fmt, username):
+        """Create or update products by name from a JSON, NDJSON or CSV catalogue."""
+        from app.models import User, Product
+        from app.utils.logger import log_action
+        from app.utils.product_import import detect_format, parse_products, validate_products
+
+        user = User.query.filter_by(username=username).first() if username else \
+            User.query.filter_by(is_admin=True).order_by(User.id).first()
+        if not user:
+            print("User not found.")
+            return
+
+        with open(path, encoding='utf-8-sig') as f:
+            records = parse_products(f.read(), fmt or detect_format(None, path))
+
+        groups, errors = validate_products(records, Product.category_lookup())
+        if errors:
+            for error in errors:
+                print(f"Row {error['row']}: {error['error']}")
+            print("Nothing imported.")
+            return
+
+        created, updated = Product.bulk_upsert(user.id, groups)
+        db.session.commit()
+        log_action(
+            user.id,
+            'BULK_IMPORT_PRODUCTS',
+            f'Imported {created + updated} products ({created} created, {updated} updated)',
+            additional_data={'received': len(records), 'created': created, 'updated': updated, 'source': path},
+            affected_name='Product Inventory'
+        )
+        print(f"Imported {created + updated} products: {created} created, {updated} updated")
+
+
+    @app.cli.command("sync-replica")
+    def sync_replica():
+        """Copy the SQLite primary over the SQLite replica (for trying out replica reads locally)."""
+        from app.utils.replica import has_replica, sync_sqlite_replica
+
+        if not has_replica():
+            print("No replica configured (set DATABASE_REPLICA_URL).")
+            return
+        sync_sqlite_replica()
+        print("Replica synced from the primary.")
+
+
+    @app.cli.command("snapshot-stock")
+    @click.option("--settle-seconds", default=60, show_default=True,
+                  help="Snapshot as of this long ago, so in-flight transactions are included.")
+    def snapshot_stock(settle_seconds):
+        """Record every product's stock level in stock_snapshots (run periodically, e.g. nightly)."""
+        from app.models import StockSnapshot
+
+        rows, taken_at = StockSnapshot.take(settle_seconds)
+        if rows:
+            print(f"Snapshot of {rows} products taken at {taken_at.isoformat()}")
+        else:
+            print(f"Latest snapshot ({taken_at.isoformat()}) is still current, nothing written")
+
+
+    @app.cli.command("backfill-daily-sales")
+    @click.option("--days", type=int, default=None, help="Only rebuild this many recent days (default: everything).")
+    def backfill_daily_sales(days):
+        """Rebuild the daily_sales rollup from invoices."""
+        from datetime import datetime, timedelta
+        from app.models import DailySales
+
+        start_day = datetime.utcnow().date() - timedelta(days=days - 1) if days else None
+        rows = DailySales.rebuild(start_day)
+        print(f"Rebuilt daily_sales: {rows} rows" + (f" since {start_day}" if start_day else ""))
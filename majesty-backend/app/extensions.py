@@ -1,13 +1,7 @@
-from flask_jwt_extended import JWTManager
-from flask_sqlalchemy import SQLAlchemy
-
-db = SQLAlchemy()
-jwt = JWTManager()
+from app import db, jwt
+from app.utils.revocation import get_revocation_cache
 
 # Token Blacklisting Logic
 @jwt.token_in_blocklist_loader
 def check_if_token_is_blacklisted(jwt_header, jwt_payload):
-    jti = jwt_payload['jti']
-    from app.models.models import BlacklistedToken
-    token = BlacklistedToken.query.filter_by(jti=jti).first()
-    return token is not None
\ No newline at end of file
+    return get_revocation_cache().is_revoked(jwt_payload['jti'], jwt_payload.get('exp'))
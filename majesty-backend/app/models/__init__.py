@@ -1 +1 @@
-from .models import User, Role, Invoice, InvoiceItem, Cart, logEntry, BlacklistedToken, Category, Product
\ No newline at end of file
+from .models import User, Role, Invoice, InvoiceItem, Cart, logEntry, BlacklistedToken, Category, Product, DailySales, IdempotencyKey, StockMovement, StockSnapshot, TableVersion
\ No newline at end of file
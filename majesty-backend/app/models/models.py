@@ -1,15 +1,64 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from sqlalchemy.dialects.postgresql import UUID, JSON
 from werkzeug.security import check_password_hash, generate_password_hash
 from uuid import UUID, uuid4
-from sqlalchemy import func, and_, String
+from sqlalchemy import func, and_, case, String, event, text
+from sqlalchemy.exc import DBAPIError
+import logging
+from decimal import Decimal
+from app.utils.upsert import upsert
 
 
 
 # Initialize SQLAlchemy
 from app import db
 
+def sum_by_periods(value_column, time_column, periods):
+    """
+    Sum value_column separately for each (start, end) period of time_column,
+    inclusive, using one conditional-aggregation query over the whole span.
+    """
+    if not periods:
+        return []
+    sums = [
+        func.sum(case((and_(time_column >= start, time_column <= end), value_column), else_=0))
+        for start, end in periods
+    ]
+    row = db.session.query(*sums).filter(
+        time_column >= min(start for start, _ in periods),
+        time_column <= max(end for _, end in periods)
+    ).one()
+    return [total or 0 for total in row]
+
+
+def consecutive_periods(end, period_length, count):
+    """
+    `count` back-to-back (start, end) periods of period_length ending at end, oldest first.
+    For dates, periods are whole days with inclusive ends.
+    """
+    step = timedelta(days=1) if isinstance(end, date) and not isinstance(end, datetime) else timedelta(microseconds=1)
+    periods = []
+    for _ in range(count):
+        start = end - period_length + step
+        periods.append((start, end))
+        end = start - step
+    return list(reversed(periods))
+
+
+def month_periods(end_day, count):
+    """
+    `count` calendar-month (first_day, last_day) periods ending with end_day's month, oldest first.
+    The last period stops at end_day.
+    """
+    periods = []
+    month_end = end_day
+    for _ in range(count):
+        month_start = month_end.replace(day=1)
+        periods.append((month_start, month_end))
+        month_end = month_start - timedelta(days=1)
+    return list(reversed(periods))
+
 # Join table for many-to-many relationship between Users and Roles
 user_roles = db.Table(
     'user_roles',
@@ -128,8 +177,8 @@ class User(db.Model):
         Track the total sales (invoices) for a particular user.
         """
         user_sales = db.session.query(
-            func.sum(Invoice.total_amount).label('total_sales')
-        ).filter(Invoice.user_id == self.id).scalar()
+            func.sum(DailySales.revenue).label('total_sales')
+        ).filter(DailySales.user_id == self.id).scalar()
 
         return user_sales or 0
 
@@ -164,10 +213,26 @@ class Product(db.Model):
     # category = db.Column(db.Enum("Red", "White", "Rosé", "Sparkling", "Dessert", "Fortified", name="wine_category"), nullable=False)
     bottle_size = db.Column(db.Integer, nullable=False)  # Bottle size in ml
     in_stock = db.Column(db.Integer, default=0, nullable=False)  # Number of bottles available
+    reorder_level = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Low at or below this
     image_url = db.Column(db.String(500), nullable=True)  # URL for product image
     added_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('idx_product_category_name', 'category_id', 'name'),
+        db.Index('idx_product_price', 'price'),
+        db.Index('idx_product_in_stock', 'in_stock'),
+        # Only products at or below their reorder level, so listing them
+        # costs in proportion to the result
+        db.Index('idx_product_low_stock', 'category_id',
+                 postgresql_where=text('in_stock <= reorder_level'),
+                 sqlite_where=text('in_stock <= reorder_level')),
+    )
+
+    # Sort keys accepted by search(), mapped to the column pages are keyed on
+    SEARCH_SORTS = {'name': 'name', 'price': 'price', 'bottle_size': 'bottle_size',
+                    'in_stock': 'in_stock', 'newest': 'id'}
+
     def to_dict(self):
         return{
             "id": self.id,
@@ -206,6 +271,169 @@ class Product(db.Model):
             Category.name,
             func.sum(Product.in_stock * func.cast(Product.price, db.Numeric))
         ).join(Product).group_by(Category.name).all()
+
+    @staticmethod
+    def category_lookup():
+        """
+        Map every category id and lower-cased category name to its id, for
+        validating imports with one query.
+        """
+        lookup = {}
+        for category_id, name in db.session.query(Category.id, Category.name):
+            lookup[category_id] = category_id
+            lookup[name.lower()] = category_id
+        return lookup
+
+    @staticmethod
+    def bulk_upsert(user_id, groups, chunk_size=500):
+        """
+        Insert or update products by name, chunk_size rows per statement.
+        groups maps the columns each row gave to the rows, as returned by
+        product_import.validate_products; existing products only have those
+        columns (and category_id) overwritten. Does not commit.
+        Returns (created, updated).
+        """
+        now = datetime.utcnow()
+        created = updated = 0
+
+        for columns, rows in groups.items():
+            update_columns = [column for column in columns if column != 'name'] + ['category_id']
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                names = [row['name'] for row in chunk]
+                existing = dict(db.session.query(Product.name, Product.in_stock).filter(Product.name.in_(names)))
+                updated += len(existing)
+                created += len(chunk) - len(existing)
+
+                upsert(
+                    db.session, Product.__table__,
+                    [dict(row, added_by=user_id, added_at=now) for row in chunk],
+                    index_elements=['name'],
+                    update=lambda table, excluded: {
+                        column: getattr(excluded, column) for column in update_columns
+                    }
+                )
+
+                # Stock set by the import goes into the ledger like any other change
+                if 'in_stock' in columns or len(existing) < len(chunk):
+                    ids = dict(db.session.query(Product.name, Product.id).filter(Product.name.in_(names)))
+                    movements = []
+                    for row in chunk:
+                        if row['name'] not in existing:
+                            movements.append({'product_id': ids[row['name']], 'delta': row['in_stock'], 'reason': 'initial'})
+                        elif 'in_stock' in columns:
+                            movements.append({'product_id': ids[row['name']],
+                                              'delta': row['in_stock'] - existing[row['name']], 'reason': 'import'})
+                    StockMovement.record(movements, user_id)
+        return created, updated
+
+    @staticmethod
+    def low_stock(category_id=None):
+        """
+        Query for products at or below their reorder level (with their
+        category loaded), largest shortfall first. Served by the partial
+        index idx_product_low_stock.
+        """
+        from sqlalchemy.orm import contains_eager
+
+        query = Product.query.join(Category, Product.category_id == Category.id).options(
+            contains_eager(Product.category)
+        ).filter(Product.in_stock <= Product.reorder_level)
+        if category_id is not None:
+            query = query.filter(Product.category_id == category_id)
+        return query.order_by((Product.reorder_level - Product.in_stock).desc(), Product.id)
+
+    @staticmethod
+    def search(q=None, match='substring', category_id=None, ranges=None, in_stock_only=False):
+        """
+        Query for products (with their category loaded) matching the filters.
+        q matches the name case-insensitively, as a prefix or substring.
+        ranges maps 'price', 'abv', 'bottle_size' or 'in_stock' to a
+        (minimum, maximum) pair, either end of which may be None.
+        """
+        from sqlalchemy.orm import contains_eager
+
+        query = Product.query.join(Category, Product.category_id == Category.id).options(
+            contains_eager(Product.category)
+        )
+
+        if q:
+            escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            pattern = f'{escaped}%' if match == 'prefix' else f'%{escaped}%'
+            query = query.filter(Product.name.ilike(pattern, escape='\\'))
+            # On SQLite the LIKE above scans; narrow it down with the FTS5
+            # trigram index first (trigrams need at least three characters)
+            if len(q) >= 3 and has_product_name_fts():
+                query = query.filter(Product.id.in_(
+                    text('SELECT rowid FROM products_fts WHERE products_fts MATCH :fts_query')
+                    .bindparams(fts_query='"' + q.replace('"', '""') + '"')
+                    .columns(db.column('rowid', db.Integer))
+                ))
+
+        if category_id is not None:
+            query = query.filter(Product.category_id == category_id)
+        for column, (minimum, maximum) in (ranges or {}).items():
+            if minimum is not None:
+                query = query.filter(getattr(Product, column) >= minimum)
+            if maximum is not None:
+                query = query.filter(getattr(Product, column) <= maximum)
+        if in_stock_only:
+            query = query.filter(Product.in_stock > 0)
+        return query
+
+
+# Name search indexes: a pg_trgm GIN index on PostgreSQL and an FTS5 trigram
+# table kept in sync by triggers on SQLite. Both serve prefix and substring
+# matches without reading every product. The migration add_product_search
+# creates them for existing databases.
+PRODUCT_NAME_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS idx_product_name_trgm ON products USING gin (name gin_trgm_ops)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+        "name, content='products', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); END",
+    ],
+}
+
+_product_name_fts = {}  # engine url -> whether products_fts exists
+
+
+@event.listens_for(Product.__table__, 'after_create')
+def create_product_name_search(target, connection, **kw):
+    statements = PRODUCT_NAME_SEARCH_DDL.get(connection.dialect.name, [])
+    try:
+        with connection.begin_nested():
+            for statement in statements:
+                connection.execute(text(statement))
+    except DBAPIError as e:
+        # e.g. SQLite built without FTS5, or no permission to add pg_trgm:
+        # search still works, just without the index
+        logging.getLogger('wine_inventory').warning(f"Product name search index not created: {str(e)}")
+    _product_name_fts.pop(str(connection.engine.url), None)
+
+
+def has_product_name_fts():
+    """Whether the current database has the SQLite products_fts table."""
+    bind = db.session.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return False
+    key = str(bind.url)
+    if key not in _product_name_fts:
+        _product_name_fts[key] = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        )).first() is not None
+    return _product_name_fts[key]
+
+
 class Cart(db.Model):
     __tablename__ = 'cart_items'
 
@@ -251,14 +479,56 @@ class Invoice(db.Model):
         ).scalar()
         return total_revenue or 0
 
+    @staticmethod
+    def revenue_by_periods(periods):
+        """
+        Total revenue for each (start, end) period, inclusive, in one query.
+        """
+        return sum_by_periods(Invoice.total_amount, Invoice.created_at, periods)
+
+    @staticmethod
+    def compare_periods(period1_start, period1_end, period2_start, period2_end):
+        """
+        Compare revenue of period 1 against the earlier period 2 in one query.
+        """
+        revenue_period1, revenue_period2 = Invoice.revenue_by_periods([
+            (period1_start, period1_end),
+            (period2_start, period2_end)
+        ])
+        return {
+            'revenue_period1': revenue_period1,
+            'revenue_period2': revenue_period2,
+            'growth_factor': Invoice.growth_factor(revenue_period1, revenue_period2),
+            'percentage_change': Invoice.percentage_change(revenue_period1, revenue_period2)
+        }
+
+    @staticmethod
+    def revenue_series(end_date, period_length, count):
+        """
+        Revenue for `count` consecutive periods of `period_length` (a timedelta)
+        ending at end_date, oldest first, in one query.
+        """
+        periods = consecutive_periods(end_date, period_length, count)
+        revenues = Invoice.revenue_by_periods(periods)
+        return [
+            {'start': start, 'end': end, 'revenue': revenue}
+            for (start, end), revenue in zip(periods, revenues)
+        ]
+
     @staticmethod
     def compare_sales_periods(period1_start, period1_end, period2_start, period2_end):
         """
         Compare revenue between two time periods and calculate the percentage increase or decrease.
         """
-        revenue_period1 = Invoice.calculate_revenue(period1_start, period1_end)
-        revenue_period2 = Invoice.calculate_revenue(period2_start, period2_end)
+        return Invoice.compare_periods(
+            period1_start, period1_end, period2_start, period2_end
+        )['percentage_change']
 
+    @staticmethod
+    def percentage_change(revenue_period1, revenue_period2):
+        """
+        Percentage change from revenue_period2 (the earlier period) to revenue_period1.
+        """
         # Handle zero revenue case for the previous period
         if revenue_period2 == 0:
             if revenue_period1 > 0:
@@ -274,24 +544,15 @@ class Invoice(db.Model):
         """
         Compare revenue between two periods and calculate the growth factor.
         """
-        revenue_period1 = db.session.query(func.sum(Invoice.total_amount)).filter(
-            and_(
-                Invoice.created_at >= period1_start,
-                Invoice.created_at <= period1_end
-            )
-        ).scalar() or 0
-
-        revenue_period2 = db.session.query(func.sum(Invoice.total_amount)).filter(
-            and_(
-                Invoice.created_at >= period2_start,
-                Invoice.created_at <= period2_end
-            )
-        ).scalar() or 0
-
-        # Log the revenues for debugging
-        print(f"Revenue for Period 1 ({period1_start} to {period1_end}): {revenue_period1}")
-        print(f"Revenue for Period 2 ({period2_start} to {period2_end}): {revenue_period2}")
+        return Invoice.compare_periods(
+            period1_start, period1_end, period2_start, period2_end
+        )['growth_factor']
 
+    @staticmethod
+    def growth_factor(revenue_period1, revenue_period2):
+        """
+        Ratio of revenue_period1 to revenue_period2 (the earlier period).
+        """
         # Handle zero revenue cases
         if revenue_period2 == 0:
             if revenue_period1 == 0:
@@ -301,20 +562,70 @@ class Invoice(db.Model):
 
         growth_factor = revenue_period1 / revenue_period2
         return round(growth_factor, 2)  # Round to 2 decimal places
+    @staticmethod
+    def load_items(invoice_ids, chunk_size=500):
+        """
+        Fetch the items of many invoices, with product and category names, as
+        plain dicts grouped by invoice id. One query per chunk_size invoices.
+        """
+        items = {invoice_id: [] for invoice_id in invoice_ids}
+        invoice_ids = list(items)
+        for i in range(0, len(invoice_ids), chunk_size):
+            rows = db.session.query(
+                InvoiceItem.id,
+                InvoiceItem.invoice_id,
+                InvoiceItem.product_id,
+                InvoiceItem.quantity,
+                InvoiceItem.price,
+                Product.name,
+                Category.name
+            ).outerjoin(Product, Product.id == InvoiceItem.product_id) \
+             .outerjoin(Category, Category.id == Product.category_id) \
+             .filter(InvoiceItem.invoice_id.in_(invoice_ids[i:i + chunk_size])) \
+             .order_by(InvoiceItem.id).all()
+            for item_id, invoice_id, product_id, quantity, price, product_name, category_name in rows:
+                items[invoice_id].append({
+                    'id': item_id,
+                    'invoice_id': invoice_id,
+                    'product_id': product_id,
+                    'product_name': product_name,
+                    'category_name': category_name,
+                    'quantity': quantity,
+                    'price': price
+                })
+        return items
+
+    @staticmethod
+    def to_dicts(invoices):
+        """
+        Batched Invoice.to_dict for a list of invoices.
+        """
+        items = Invoice.load_items([invoice.id for invoice in invoices])
+        return [{
+            'id': invoice.id,
+            'invoice_number': str(invoice.invoice_number),
+            'user_id': invoice.user_id,
+            'total_amount': str(invoice.total_amount),
+            'created_at': invoice.created_at.isoformat(),
+            'status': invoice.status,
+            'notes': invoice.notes,
+            'items': [{
+                'id': item['id'],
+                'invoice_id': item['invoice_id'],
+                'product': {
+                    'id': item['product_id'],
+                    'name': item['product_name']
+                },
+                'quantity': item['quantity'],
+                'price': str(item['price'])
+            } for item in items[invoice.id]]
+        } for invoice in invoices]
+
     def to_dict(self):
         """
         Convert the Invoice object to a dictionary, including its items.
         """
-        return {
-            'id': self.id,
-            'invoice_number': str(self.invoice_number),
-            'user_id': self.user_id,
-            'total_amount': str(self.total_amount),
-            'created_at': self.created_at.isoformat(),
-            'status': self.status,
-            'notes': self.notes,
-            'items': [item.to_dict() for item in self.items]
-        }
+        return Invoice.to_dicts([self])[0]
 
 class InvoiceItem(db.Model):
     __tablename__ = 'invoice_items'
@@ -330,11 +641,13 @@ class InvoiceItem(db.Model):
         db.Index('idx_invoice_item_product', 'product_id')
     )
 
+    product = db.relationship('Product')
+
     def to_dict(self):
         """
         Convert the InvoiceItem object to a dictionary, including product details.
         """
-        product = Product.query.get(self.product_id)
+        product = self.product
         return {
             'id': self.id,
             'invoice_id': self.invoice_id,
@@ -346,6 +659,321 @@ class InvoiceItem(db.Model):
             'price': str(self.price)
         }
 
+class DailySales(db.Model):
+    """
+    Per-day sales rollup keyed by (day, product_id, user_id).
+
+    Maintained in the same transaction as checkout and invoice edits/deletes
+    so dashboard queries scan days x products instead of invoice rows.
+    invoice_count is the number of invoices for that key, so it must not be
+    summed across products to count invoices.
+    """
+    __tablename__ = 'daily_sales'
+
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_daily_sales_product_day', 'product_id', 'day'),
+        db.Index('idx_daily_sales_user_day', 'user_id', 'day'),
+    )
+
+    @staticmethod
+    def apply_invoice(user_id, created_at, items, sign=1):
+        """
+        Add (sign=1) or remove (sign=-1) an invoice's items from the rollup.
+        items is an iterable of (product_id, quantity, price). Does not commit.
+        """
+        totals = {}
+        for product_id, quantity, price in items:
+            line = totals.setdefault(int(product_id), [0, Decimal('0')])
+            line[0] += quantity
+            line[1] += Decimal(str(price)) * quantity
+
+        rows = [{
+            'day': created_at.date(),
+            'product_id': product_id,
+            'user_id': int(user_id),
+            'quantity': sign * quantity,
+            'revenue': sign * revenue,
+            'invoice_count': sign,
+        } for product_id, (quantity, revenue) in totals.items()]
+
+        upsert(
+            db.session, DailySales.__table__, rows,
+            index_elements=['day', 'product_id', 'user_id'],
+            update=lambda table, excluded: {
+                'quantity': table.c.quantity + excluded.quantity,
+                'revenue': table.c.revenue + excluded.revenue,
+                'invoice_count': table.c.invoice_count + excluded.invoice_count,
+            }
+        )
+
+    @staticmethod
+    def revenue_between(start_day, end_day, user_id=None):
+        """
+        Total revenue for the days from start_day to end_day inclusive.
+        """
+        query = db.session.query(func.sum(DailySales.revenue)).filter(
+            DailySales.day >= start_day, DailySales.day <= end_day
+        )
+        if user_id is not None:
+            query = query.filter(DailySales.user_id == user_id)
+        return query.scalar() or 0
+
+    @staticmethod
+    def revenue_in_window(start, end):
+        """
+        Total revenue for invoices created from start to end (datetimes),
+        inclusive. Whole days in between come from the rollup, the partial
+        days at either end from the invoices themselves.
+        """
+        first_day, last_day = start.date() + timedelta(days=1), end.date()
+        if first_day > last_day:
+            return Invoice.calculate_revenue(start, end)
+        first_midnight = datetime.combine(first_day, datetime.min.time())
+        last_midnight = datetime.combine(last_day, datetime.min.time())
+        return (
+            Invoice.calculate_revenue(start, first_midnight - timedelta(microseconds=1))
+            + DailySales.revenue_between(first_day, last_day - timedelta(days=1))
+            + Invoice.calculate_revenue(last_midnight, end)
+        )
+
+    @staticmethod
+    def revenue_by_periods(periods):
+        """
+        Total revenue for each (start_day, end_day) period, inclusive, in one query.
+        """
+        return sum_by_periods(DailySales.revenue, DailySales.day, periods)
+
+    @staticmethod
+    def compare_periods(period1_start, period1_end, period2_start, period2_end):
+        """
+        Same as Invoice.compare_periods, computed from the rollup by whole days.
+        """
+        revenue_period1, revenue_period2 = DailySales.revenue_by_periods([
+            (period1_start, period1_end),
+            (period2_start, period2_end)
+        ])
+        return {
+            'revenue_period1': revenue_period1,
+            'revenue_period2': revenue_period2,
+            'growth_factor': Invoice.growth_factor(revenue_period1, revenue_period2),
+            'percentage_change': Invoice.percentage_change(revenue_period1, revenue_period2)
+        }
+
+    @staticmethod
+    def revenue_series(periods):
+        """
+        Revenue for each (start_day, end_day) period, as dicts, in one query.
+        """
+        revenues = DailySales.revenue_by_periods(periods)
+        return [
+            {'start': start, 'end': end, 'revenue': revenue}
+            for (start, end), revenue in zip(periods, revenues)
+        ]
+
+    @staticmethod
+    def rebuild(start_day=None):
+        """
+        Recompute the rollup from invoices and invoice_items, either entirely
+        or from start_day onwards. Returns the number of rollup rows written.
+        """
+        day = func.date(Invoice.created_at)
+        delete = DailySales.query
+        source = db.session.query(
+            day,
+            InvoiceItem.product_id,
+            Invoice.user_id,
+            func.sum(InvoiceItem.quantity),
+            func.sum(InvoiceItem.quantity * InvoiceItem.price),
+            func.count(func.distinct(Invoice.id))
+        ).join(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        if start_day is not None:
+            delete = delete.filter(DailySales.day >= start_day)
+            source = source.filter(Invoice.created_at >= datetime.combine(start_day, datetime.min.time()))
+        source = source.group_by(day, InvoiceItem.product_id, Invoice.user_id)
+
+        delete.delete(synchronize_session=False)
+        result = db.session.execute(
+            DailySales.__table__.insert().from_select(
+                ['day', 'product_id', 'user_id', 'quantity', 'revenue', 'invoice_count'],
+                source.statement
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+class StockMovement(db.Model):
+    """
+    Append-only ledger of every change to Product.in_stock, written in the
+    same transaction as the change. delta is signed; reason is 'sale',
+    'invoice_update', 'invoice_delete', 'initial', 'product_update',
+    'import', 'stocktake', 'adjustment' or a free-text adjustment reason.
+    """
+    __tablename__ = 'stock_movements'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(255), nullable=False)
+    invoice_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_stock_movement_product_created', 'product_id', 'created_at'),
+        db.Index('idx_stock_movement_created', 'created_at'),
+    )
+
+    @staticmethod
+    def record(movements, user_id=None, track_events=True):
+        """
+        Insert movements, an iterable of dicts with product_id, delta, reason
+        and optionally invoice_id, in one executemany. Zero deltas are
+        skipped. Call after in_stock has been changed: products that crossed
+        their reorder level are queued as stock events, unless track_events
+        is False because the caller queues them itself. Does not commit.
+        """
+        now = datetime.utcnow()
+        rows = [{
+            'product_id': int(movement['product_id']),
+            'delta': movement['delta'],
+            'reason': movement['reason'],
+            'invoice_id': movement.get('invoice_id'),
+            'user_id': int(user_id) if user_id is not None else None,
+            'created_at': now,
+        } for movement in movements if movement['delta']]
+        if rows:
+            db.session.execute(StockMovement.__table__.insert(), rows)
+            if not track_events:
+                return
+
+            from app.utils.stock_events import track_stock_deltas
+            net = {}
+            for row in rows:
+                net[row['product_id']] = net.get(row['product_id'], 0) + row['delta']
+            track_stock_deltas(net)
+
+    @staticmethod
+    def net_between(start=None, end=None, product_id=None):
+        """
+        Subquery of (product_id, delta) summing movements with
+        start < created_at <= end; either bound may be None.
+        """
+        query = db.session.query(
+            StockMovement.product_id.label('product_id'),
+            func.sum(StockMovement.delta).label('delta')
+        )
+        if product_id is not None:
+            query = query.filter(StockMovement.product_id == product_id)
+        if start is not None:
+            query = query.filter(StockMovement.created_at > start)
+        if end is not None:
+            query = query.filter(StockMovement.created_at <= end)
+        return query.group_by(StockMovement.product_id).subquery()
+
+
+class StockSnapshot(db.Model):
+    """
+    Stock level of every product at taken_at. Point-in-time stock is the
+    nearest snapshot plus (or minus) the movements between it and the time
+    asked for, so lookups only scan a bounded tail of stock_movements.
+    """
+    __tablename__ = 'stock_snapshots'
+
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    in_stock = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_stock_snapshot_product_taken', 'product_id', 'taken_at'),
+    )
+
+    @staticmethod
+    def take(settle_seconds=60):
+        """
+        Write a snapshot row for every product and commit. The first
+        snapshot copies products.in_stock; later ones roll the previous
+        snapshot forward by the movements since, up to settle_seconds ago so
+        transactions still in flight are not missed.
+        Returns (rows_written, taken_at); rows_written is 0 if the previous
+        snapshot is newer than that.
+        """
+        now = datetime.utcnow()
+        previous = db.session.query(func.max(StockSnapshot.taken_at)).scalar()
+
+        if previous is None:
+            taken_at = now
+            source = db.session.query(
+                db.literal(taken_at, db.DateTime), Product.id, Product.in_stock
+            )
+        else:
+            taken_at = now - timedelta(seconds=settle_seconds)
+            if taken_at <= previous:
+                return 0, previous
+            moved = StockMovement.net_between(previous, taken_at)
+            source = db.session.query(
+                db.literal(taken_at, db.DateTime),
+                Product.id,
+                func.coalesce(StockSnapshot.in_stock, 0) + func.coalesce(moved.c.delta, 0)
+            ).outerjoin(StockSnapshot, and_(
+                StockSnapshot.product_id == Product.id, StockSnapshot.taken_at == previous
+            )).outerjoin(
+                moved, moved.c.product_id == Product.id
+            ).filter(db.or_(Product.added_at.is_(None), Product.added_at <= taken_at))
+
+        result = db.session.execute(
+            StockSnapshot.__table__.insert().from_select(
+                ['taken_at', 'product_id', 'in_stock'], source.statement
+            )
+        )
+        db.session.commit()
+        return result.rowcount, taken_at
+
+    @staticmethod
+    def stock_at(at, product_id=None, category_id=None):
+        """
+        Stock of each product at `at`, optionally for one product or category.
+        Uses the latest snapshot at or before `at` plus the movements after
+        it, or failing that the earliest later snapshot minus the movements
+        in between. Returns (snapshot_taken_at, [(product_id, name, in_stock)]).
+        """
+        base = db.session.query(func.max(StockSnapshot.taken_at)).filter(StockSnapshot.taken_at <= at).scalar()
+        sign = 1
+        if base is not None:
+            moved = StockMovement.net_between(base, at, product_id)
+        else:
+            base = db.session.query(func.min(StockSnapshot.taken_at)).filter(StockSnapshot.taken_at > at).scalar()
+            if base is not None:
+                sign = -1
+                moved = StockMovement.net_between(at, base, product_id)
+            else:
+                moved = StockMovement.net_between(None, at, product_id)
+
+        level = func.coalesce(moved.c.delta, 0) * sign
+        query = db.session.query(Product.id, Product.name)
+        if base is not None:
+            query = query.add_columns(func.coalesce(StockSnapshot.in_stock, 0) + level).outerjoin(
+                StockSnapshot, and_(StockSnapshot.product_id == Product.id, StockSnapshot.taken_at == base)
+            )
+        else:
+            query = query.add_columns(level)
+        query = query.outerjoin(moved, moved.c.product_id == Product.id).filter(
+            db.or_(Product.added_at.is_(None), Product.added_at <= at)
+        )
+
+        if product_id is not None:
+            query = query.filter(Product.id == product_id)
+        if category_id is not None:
+            query = query.filter(Product.category_id == category_id)
+        return base, query.order_by(Product.id).all()
+
+
 class logEntry(db.Model):
     # Table name
     __tablename__ = 'log_entries'
@@ -362,12 +990,16 @@ class logEntry(db.Model):
     additional_data = db.Column(db.Text, nullable=True)
     acting_username = db.Column(db.String(100), nullable=True)
     affected_name = db.Column(db.String(255), nullable=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id', ondelete='SET NULL'), nullable=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='SET NULL'), nullable=True)
 
     # Table indexing
     __table_args__ = (
         db.Index('idx_log_timestamp', timestamp),
         db.Index('idx_log_user_id', user_id),
         db.Index('idx_log_action', action),
+        db.Index('idx_log_invoice_id', invoice_id),
+        db.Index('idx_log_product_id', product_id),
     )
     def to_dict(self):
         """Convert log entry to a dictionary for JSON responses."""
@@ -385,6 +1017,8 @@ class logEntry(db.Model):
             "status_code": self.status_code,
             "acting_username": self.acting_username,
             "affected_name": self.affected_name,
+            "invoice_id": self.invoice_id,
+            "product_id": self.product_id,
         }
     
 class BlacklistedToken(db.Model):
@@ -393,6 +1027,57 @@ class BlacklistedToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, unique=True)  # JWT ID
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=True)  # Token's own exp; row can be pruned after this
+
+    __table_args__ = (
+        db.Index('idx_blacklisted_token_expires_at', 'expires_at'),
+    )
 
     def __repr__(self):
         return f"<BlacklistedToken {self.jti}>"
+
+class IdempotencyKey(db.Model):
+    """
+    Stored outcome of a request sent with an Idempotency-Key header.
+    status_code is null while the first request is still being processed;
+    claimed_at is when that request started (or took over the claim).
+    """
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claimed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_user_key'),
+        db.Index('idx_idempotency_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key}>"
+
+
+class TableVersion(db.Model):
+    """
+    Per-table change counter, bumped in the same transaction as every write
+    to the table (see app/utils/table_versions.py). Used to build cheap
+    validators for conditional GETs. Each counter is spread over up to
+    TABLE_VERSION_SHARDS rows so concurrent writers to one table rarely
+    wait on the same row; the table's version is the sum of its shards.
+    """
+    __tablename__ = 'table_versions'
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, default=0)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TableVersion {self.table_name}#{self.shard} {self.version}>"
+
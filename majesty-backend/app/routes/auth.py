@@ -8,6 +8,7 @@ from app.models.models import BlacklistedToken
 from app.extensions import jwt
 from functools import wraps
 from app.utils.decorators import token_required
+from app.utils.revocation import get_revocation_cache
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 @auth_bp.route('/create_admin', methods=['POST'])
@@ -174,10 +175,16 @@ def logout():
             affected_name=f'User ID {current_user_id}'
         )
 
-    jti = get_jwt()['jti']
-    blacklisted_token = BlacklistedToken(jti=jti, created_at=datetime.utcnow())
+    jwt_payload = get_jwt()
+    jti = jwt_payload['jti']
+    blacklisted_token = BlacklistedToken(
+        jti=jti,
+        created_at=datetime.utcnow(),
+        expires_at=datetime.utcfromtimestamp(jwt_payload['exp']) if jwt_payload.get('exp') else None
+    )
     db.session.add(blacklisted_token)
     db.session.commit()
+    get_revocation_cache().revoke(jti, jwt_payload.get('exp'))
 
     return jsonify({'message': 'Successfully logged out'}), 200
 
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models.models import Category, User, db
+from app.utils.catalogue import catalogue_response, all_categories
+from app.utils.decorators import conditional
 
 category_bp = Blueprint('category', __name__, url_prefix='/categories')
 
@@ -33,9 +35,10 @@ def create_category():
         'category': category.to_dict()
     }), 201
 @category_bp.route('/get', methods=['GET'])
+@jwt_required(optional=True)
+@conditional('categories')
 def get_categories():
-    categories = Category.query.all()
-    return jsonify([c.to_dict() for c in categories]), 200
+    return catalogue_response('categories', all_categories)
 #delete category
 from sqlalchemy.exc import IntegrityError
 
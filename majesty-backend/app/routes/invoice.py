@@ -1,49 +1,78 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import Invoice, InvoiceItem, User, Product
+from app.models import Invoice, User
 from app import db
 from app.utils.logger import log_action
-from app.utils.decorators import token_required
+from app.utils.decorators import token_required, idempotent, conditional
+from app.utils.pagination import keyset_paginate, cursor_args
+from app.utils.inventory import create_invoice, checkout_cart, update_invoice, delete_invoice, StockError
 
 invoices_bp = Blueprint('invoices', __name__, url_prefix='/invoices')
 
+def serialize_invoices(invoices):
+    """
+    Serialize invoices for the invoice endpoints, loading all of their items,
+    products and categories in one query instead of one per item.
+    """
+    items = Invoice.load_items([invoice.id for invoice in invoices])
+    return [{
+        'invoice_id': invoice.id,
+        'user_id': invoice.user_id,
+        'items': [{
+            'item': {'name': item['product_name'], 'id': item['product_id'], 'category': item['category_name']},
+            'number_sold': item['quantity'],
+            'price': str(item['price'])
+        } for item in items[invoice.id]],
+        'total_amount': str(invoice.total_amount)
+    } for invoice in invoices]
+
 @invoices_bp.route('/', methods=['GET', 'POST'])
 @jwt_required()
 @token_required
+@idempotent
+@conditional('invoices', 'invoice_items', 'products', 'categories')
 def manage_invoices():
     """
-    Handle GET (retrieve all invoices for the user) and POST (create a new invoice with items).
+    Handle GET (retrieve the user's invoices) and POST (create a new invoice with items).
+
+    Without `limit` or `cursor` GET returns all of the user's invoices as
+    before. With either, a keyset-paginated page is returned instead:
+        - limit: Invoices per page (default: 50, max: 200)
+        - cursor: next_cursor from the previous page
+        - include_total: Add an approximate_total of the user's invoices (default: false)
     """
     current_user_id = get_jwt_identity()
     current_user = User.query.get(current_user_id)
 
     if request.method == 'GET':
-        # Retrieve all invoices for the current user
+        # Retrieve the current user's invoices, all of them or a page (newest first)
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        if paginated:
+            try:
+                limit, cursor, include_total = cursor_args(request.args)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
         try:
-            invoices = Invoice.query.filter_by(user_id=current_user_id).all()
-            result = []
-            for invoice in invoices:
-                items = []
-                for item in invoice.items:
-                    products = Product.query.get(item.product_id)
-                    items.append({
-                        'item': {'name': products.name, 'id': products.id, 'category': products.category.name},
-                        'number_sold': item.quantity,
-                        'price': str(item.price)
-                    })
-                result.append({
-                    'invoice_id': invoice.id,
-                    'user_id': invoice.user_id,
-                    'items': items,
-                    'total_amount': str(invoice.total_amount)
-                })
+            query = Invoice.query.filter_by(user_id=current_user_id)
+            if paginated:
+                page = keyset_paginate(query, Invoice.created_at, Invoice.id, cursor, limit, with_total=include_total)
+                invoices = page.items
+            else:
+                invoices = query.order_by(Invoice.id).all()
+            result = serialize_invoices(invoices)
             log_action(
                 current_user_id, 
                 'GET_INVOICES_SUCCESS', 
                 'Retrieved all invoices',
                 affected_name=f'User ID {current_user_id}'  # Affected user
             )
-            return jsonify({'invoices': result}), 200
+            response = {'invoices': result}
+            if paginated:
+                response['next_cursor'] = page.next_cursor
+                if include_total:
+                    response['approximate_total'] = page.approximate_total
+            return jsonify(response), 200
         except Exception as e:
             log_action(
                 current_user_id, 
@@ -57,41 +86,35 @@ def manage_invoices():
     elif request.method == 'POST':
         # Create a new invoice with items
         data = request.get_json()
-        if not data or not data.get('items') or not data.get('total_amount'):
+        if not data or not data.get('items'):
             log_action(
                 current_user_id, 
                 'CREATE_INVOICE_INVALID', 
                 'Missing required fields for invoice creation',
                 affected_name=f'User ID {current_user_id}'
             )
-            return jsonify({'message': 'items and total_amount are required'}), 400
+            return jsonify({'message': 'items are required'}), 400
 
         try:
-            new_invoice = Invoice(
-                user_id=current_user_id,
-                total_amount=data['total_amount']
-            )
-            db.session.add(new_invoice)
-            db.session.commit()
-
-            # Add stock validation before creating invoice
-            for item_data in data['items']:
-                product = Product.query.get(item_data['product_id'])  
-                if not product:
-                    return jsonify({'message': f'Product {item_data["product_id"]} not found'}), 404
-                if product.in_stock < item_data['quantity']:
-                    return jsonify({'message': f'Not enough stock for {product.name}'}), 400
-                product.in_stock -= item_data['quantity']  # Update stock
-                db.session.add(product)
-            db.session.commit()
+            # Stock, invoice, items and ledger are written in one transaction; the
+            # total is the sum of the lines, whatever total_amount the client sent
+            lines = [(item_data['product_id'], item_data['quantity']) for item_data in data['items']]
+            new_invoice = create_invoice(current_user_id, lines)
 
             log_action(
                 current_user_id, 
                 'CREATE_INVOICE_SUCCESS', 
                 f'Created invoice {new_invoice.id}',
-                affected_name=f'Invoice ID {new_invoice.id}'  # Affected invoice
+                affected_name=f'Invoice ID {new_invoice.id}',  # Affected invoice
+                invoice_id=new_invoice.id
             )
             return jsonify({'message': 'Invoice created successfully', 'invoice_id': new_invoice.id}), 201
+        except StockError as e:
+            if e.status_code == 404:
+                return jsonify({'message': f'Product {e.product_id} not found'}), 404
+            return jsonify({'message': str(e)}), e.status_code
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'message': f'Invalid invoice items: {str(e)}'}), 400
         except Exception as e:
             db.session.rollback()
             log_action(
@@ -129,32 +152,21 @@ def manage_single_invoice(invoice_id):
                 current_user_id, 
                 'INVOICE_UNAUTHORIZED', 
                 f'Unauthorized access for invoice {invoice_id}',
-                affected_name=f'Invoice ID {invoice_id}'
+                affected_name=f'Invoice ID {invoice_id}',
+                invoice_id=invoice.id
             )
             return jsonify({'message': 'Unauthorized'}), 403
 
         if request.method == 'GET':
             # Retrieve a single invoice with its items
-            items = []
-            for item in invoice.items:
-                product = Product.query.get(item.product_id)
-                items.append({
-                    'item': {'name': product.name, 'id': product.id, 'category': product.category.name},
-                    'number_sold': item.quantity,
-                    'price': str(item.price)
-                })
             log_action(
                 current_user_id, 
                 'GET_INVOICE_SUCCESS', 
                 f'Retrieved invoice {invoice_id}',
-                affected_name=f'Invoice ID {invoice_id}'
+                affected_name=f'Invoice ID {invoice_id}',
+                invoice_id=invoice.id
             )
-            return jsonify({
-                'invoice_id': invoice.id,
-                'user_id': invoice.user_id,
-                'items': items,
-                'total_amount': str(invoice.total_amount)
-            }), 200
+            return jsonify(serialize_invoices([invoice])[0]), 200
 
         elif request.method == 'PUT':
             # Update an invoice and its items
@@ -164,38 +176,33 @@ def manage_single_invoice(invoice_id):
                     current_user_id, 
                     'UPDATE_INVOICE_INVALID', 
                     'No data provided for invoice update',
-                    affected_name=f'Invoice ID {invoice_id}'
+                    affected_name=f'Invoice ID {invoice_id}',
+                    invoice_id=invoice.id
                 )
                 return jsonify({'message': 'No data provided'}), 400
 
-            if 'total_amount' in data:
-                invoice.total_amount = data['total_amount']
-
-            if 'items' in data:
-                # Delete existing items and add new ones
-                InvoiceItem.query.filter_by(invoice_id=invoice_id).delete()
-                for item_data in data['items']:
-                    new_item = InvoiceItem(
-                        invoice_id=invoice_id,
-                        product_id=item_data['product_id'],
-                        quantity=item_data['quantity'],
-                        price=item_data['price']
-                    )
-                    db.session.add(new_item)
-
-            db.session.commit()
+            fields = {column: data[column] for column in ('notes', 'status') if column in data}
+
+            # Only changed lines touch stock, items and the rollup; the total is recomputed
+            try:
+                update_invoice(invoice, data.get('items'), current_user_id, fields)
+            except StockError as e:
+                return jsonify({'message': str(e)}), e.status_code
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({'message': f'Invalid invoice items: {str(e)}'}), 400
+
             log_action(
                 current_user_id, 
                 'UPDATE_INVOICE_SUCCESS', 
                 f'Updated invoice {invoice_id}',
-                affected_name=f'Invoice ID {invoice_id}'
+                affected_name=f'Invoice ID {invoice_id}',
+                invoice_id=invoice.id
             )
             return jsonify({'message': 'Invoice updated successfully'}), 200
 
         elif request.method == 'DELETE':
-            # Delete an invoice and its associated items
-            db.session.delete(invoice)
-            db.session.commit()
+            # Delete an invoice and its items, returning the units to stock
+            delete_invoice(invoice, current_user_id)
             log_action(
                 current_user_id, 
                 'DELETE_INVOICE_SUCCESS', 
@@ -218,6 +225,7 @@ def manage_single_invoice(invoice_id):
 @invoices_bp.route('/checkout', methods=['POST'])
 @jwt_required()
 @token_required
+@idempotent
 def checkout():
     """
     Handle the checkout process.
@@ -226,72 +234,108 @@ def checkout():
     current_user = User.query.get(current_user_id)
 
     data = request.get_json()
-    if not data or not data.get('items') or not data.get('total_amount'):
+    if not data or not data.get('items'):
         log_action(
             current_user_id, 
             'CHECKOUT_INVALID', 
             'Missing required fields for checkout',
             affected_name=f'User ID {current_user_id}'
         )
-        return jsonify({'message': 'items and total_amount are required'}), 400
+        return jsonify({'message': 'items are required'}), 400
 
     try:
-        # Update the stock of each item in the cart
-        for item_data in data['items']:
-            product = Product.query.get(item_data['item']['id'])
-            if not product:
-                log_action(
-                    current_user_id, 
-                    'CHECKOUT_ERROR', 
-                    f'product {item_data["item"]["id"]} not found', 
-                    level='error',
-                    affected_name=f'product ID {item_data["item"]["id"]}'
-                )
-                return jsonify({'message': f'product {item_data["item"]["id"]} not found'}), 404
+        lines = [(item_data['item']['id'], item_data['number_sold']) for item_data in data['items']]
+        new_invoice = create_invoice(current_user_id, lines)
 
-            if product.in_stock < item_data['number_sold']:
-                log_action(
-                    current_user_id, 
-                    'CHECKOUT_ERROR', 
-                    f'Not enough stock for product {product.name}', 
-                    level='error',
-                    affected_name=f'Product ID {product.id}'
-                )
-                return jsonify({'message': f'Not enough stock for product {product.name}'}), 400
+        log_action(
+            current_user_id, 
+            'CHECKOUT_SUCCESS', 
+            f'Checkout completed for invoice {new_invoice.id}',
+            affected_name=f'Invoice ID {new_invoice.id}',
+            invoice_id=new_invoice.id
+        )
+        return jsonify({'message': 'Checkout completed successfully', 'invoice_id': new_invoice.id}), 201
 
-            product.in_stock -= item_data['number_sold']
-            db.session.add(product)
+    except StockError as e:
+        log_action(
+            current_user_id, 
+            'CHECKOUT_ERROR', 
+            str(e), 
+            level='error',
+            affected_name=f'Product ID {e.product_id}' if e.product_id is not None else f'User ID {current_user_id}',
+            product_id=e.product_id if e.status_code != 404 else None
+        )
+        return jsonify({'message': str(e)}), e.status_code
 
-        # Create the invoice
-        new_invoice = Invoice(
-            user_id=current_user_id,
-            total_amount=data['total_amount']
+    except (KeyError, TypeError, ValueError) as e:
+        log_action(
+            current_user_id, 
+            'CHECKOUT_INVALID', 
+            f'Invalid checkout items: {str(e)}',
+            affected_name=f'User ID {current_user_id}'
         )
-        db.session.add(new_invoice)
-        db.session.commit()
-
-        # Create invoice items
-        for item_data in data['items']:
-            new_item = InvoiceItem(
-                invoice_id=new_invoice.id,
-                product_id=item_data['item']['id'],
-                quantity=item_data['number_sold'],
-                price=Product.query.get(item_data['item']['id']).price
-            )
-            db.session.add(new_item)
+        return jsonify({'message': 'Invalid checkout items'}), 400
 
-        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        log_action(
+            current_user_id, 
+            'CHECKOUT_ERROR', 
+            f'Error during checkout: {str(e)}', 
+            level='error',
+            affected_name=f'User ID {current_user_id}'
+        )
+        return jsonify({'message': 'An error occurred during checkout'}), 500
+
+@invoices_bp.route('/checkout-cart', methods=['POST'])
+@jwt_required()
+@token_required
+@idempotent
+def checkout_from_cart():
+    """
+    Check out the current user's cart. Prices and the total come from the
+    products table, and the cart is emptied in the same transaction.
+    """
+    current_user_id = get_jwt_identity()
+
+    try:
+        new_invoice = checkout_cart(current_user_id)
+        invoice_id, total_amount = new_invoice.id, new_invoice.total_amount
 
         log_action(
             current_user_id, 
             'CHECKOUT_SUCCESS', 
-            f'Checkout completed for invoice {new_invoice.id}',
-            affected_name=f'Invoice ID {new_invoice.id}'
+            f'Checkout completed for invoice {invoice_id}',
+            affected_name=f'Invoice ID {invoice_id}',
+            invoice_id=invoice_id
         )
-        return jsonify({'message': 'Checkout completed successfully', 'invoice_id': new_invoice.id}), 201
+        return jsonify({
+            'message': 'Checkout completed successfully',
+            'invoice_id': invoice_id,
+            'total_amount': str(total_amount)
+        }), 201
+
+    except StockError as e:
+        log_action(
+            current_user_id, 
+            'CHECKOUT_ERROR', 
+            str(e), 
+            level='error',
+            affected_name=f'Product ID {e.product_id}' if e.product_id is not None else f'User ID {current_user_id}',
+            product_id=e.product_id if e.status_code != 404 else None
+        )
+        return jsonify({'message': str(e)}), e.status_code
+
+    except ValueError as e:
+        log_action(
+            current_user_id, 
+            'CHECKOUT_INVALID', 
+            str(e),
+            affected_name=f'User ID {current_user_id}'
+        )
+        return jsonify({'message': str(e)}), 400
 
     except Exception as e:
-        db.session.rollback()
         log_action(
             current_user_id, 
             'CHECKOUT_ERROR', 
@@ -299,4 +343,4 @@ def checkout():
             level='error',
             affected_name=f'User ID {current_user_id}'
         )
-        return jsonify({'message': 'An error occurred during checkout'}), 500
\ No newline at end of file
+        return jsonify({'message': 'An error occurred during checkout'}), 500
@@ -1,50 +1,112 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from datetime import datetime, timedelta
+import csv
+import io
+import json
+import zlib
 from app import db
 from sqlalchemy import or_
 from app.models import logEntry, Invoice, InvoiceItem, User, Product
 from flask_jwt_extended import jwt_required, get_jwt_identity 
-from app.utils.decorators import token_required
+from app.utils.decorators import token_required, conditional, read_replica
 from app.utils.logger import log_action
-from app.utils.pagination import paginate_query
+from app.utils.pagination import paginate_query, keyset_paginate, cursor_args
 
 logs_bp = Blueprint("logs", __name__, url_prefix='/logs')
 
+def load_invoices(invoice_ids):
+    """
+    Load invoices with their items and product names for a page of logs in
+    a single joined query. Returns {invoice_id: (invoice, items)}.
+    """
+    invoice_ids = {invoice_id for invoice_id in invoice_ids if invoice_id is not None}
+    if not invoice_ids:
+        return {}
+    rows = db.session.query(Invoice, InvoiceItem, Product.name).outerjoin(
+        InvoiceItem, InvoiceItem.invoice_id == Invoice.id
+    ).outerjoin(
+        Product, Product.id == InvoiceItem.product_id
+    ).filter(Invoice.id.in_(invoice_ids)).order_by(Invoice.id, InvoiceItem.id).all()
+
+    invoices = {}
+    for invoice, item, product_name in rows:
+        _, items = invoices.setdefault(invoice.id, (invoice, []))
+        if item is not None:
+            items.append({
+                'product_id': item.product_id,
+                'product_name': product_name,
+                'quantity': item.quantity,
+                'price': item.price
+            })
+    return invoices
+
+def list_logs(query):
+    """
+    Respond with the logs matched by query, newest first.
+
+    Without `limit` or `cursor` the full list is returned as before. With
+    either, a keyset-paginated page is returned instead:
+        - limit: Items per page (default: 50, max: 200)
+        - cursor: next_cursor from the previous page
+        - include_total: Add an approximate_total of matching rows (default: false)
+    """
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return jsonify([log.to_dict() for log in query.all()]), 200
+
+    limit, cursor, include_total = cursor_args(request.args)
+    page = keyset_paginate(query, logEntry.timestamp, logEntry.id, cursor, limit, with_total=include_total)
+    response = {
+        'logs': [log.to_dict() for log in page.items],
+        'next_cursor': page.next_cursor
+    }
+    if include_total:
+        response['approximate_total'] = page.approximate_total
+    return jsonify(response), 200
+
 @logs_bp.route("/logs", methods=["GET"])
 @token_required
+@read_replica('log_entries')
 def get_all_logs():
     """Retrieve all log entries."""
     try:
-        logs = logEntry.query.all()
-        return jsonify([log.to_dict() for log in logs]), 200
+        return list_logs(logEntry.query)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         # Log the error (if logging is enabled)
         return jsonify({'message': f'Error retrieving logs: {str(e)}'}), 500
 
 @logs_bp.route("/logs/user/<int:user_id>", methods=["GET"])
 @token_required
+@read_replica('log_entries')
 def get_user_logs(user_id):
     """Retrieve all log entries for a specific user."""
     try:
-        logs = logEntry.query.filter_by(user_id=user_id).all()
-        return jsonify([log.to_dict() for log in logs]), 200
+        return list_logs(logEntry.query.filter_by(user_id=user_id))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         # Log the error (if logging is enabled)
         return jsonify({'message': f'Error retrieving logs for user {user_id}: {str(e)}'}), 500
 
 @logs_bp.route("/logs/action/<string:action>", methods=["GET"])
 @token_required
+@read_replica('log_entries')
 def get_logs_by_action(action):
     """Retrieve logs filtered by action type."""
     try:
-        logs = logEntry.query.filter_by(action=action).all()
-        return jsonify([log.to_dict() for log in logs]), 200
+        return list_logs(logEntry.query.filter_by(action=action))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         # Log the error (if logging is enabled)
         return jsonify({'message': f'Error retrieving logs for action {action}: {str(e)}'}), 500
 
 @logs_bp.route('/sales', methods=['GET'])
 @jwt_required()
+@conditional('log_entries.checkout', 'log_entries.invoice', 'invoices', 'invoice_items', 'products',
+             refresh_every=60)
+@read_replica('log_entries.checkout', 'log_entries.invoice', 'invoices', 'invoice_items', 'products')
 def get_sales_logs():
     """
     Retrieve sales-related logs with filtering options.
@@ -108,49 +170,30 @@ def get_sales_logs():
         # Paginate the results
         paginated_results = paginate_query(query, page, per_page)
         
+        # Load every referenced invoice and its items in one go
+        invoices = load_invoices(log.invoice_id for log in paginated_results.items)
+
         # Enhance log data with invoice information where available
         enhanced_logs = []
         for log in paginated_results.items:
             log_data = log.to_dict()
             
-            # Try to extract invoice ID from affected_name or message
-            invoice_id = None
-            if log.affected_name and 'Invoice ID' in log.affected_name:
-                invoice_id = log.affected_name.split('Invoice ID ')[1]
-            elif 'invoice' in log.message.lower():
-                # Try to find invoice ID in message
-                import re
-                match = re.search(r'invoice (\d+)', log.message.lower())
-                if match:
-                    invoice_id = match.group(1)
-            
             # Add invoice details if found
-            if invoice_id:
-                try:
-                    invoice = Invoice.query.get(invoice_id)
-                    if invoice:
-                        log_data['invoice'] = {
-                            'id': invoice.id,
-                            'total_amount': invoice.total_amount,
-                            'created_at': invoice.created_at.isoformat(),
-                            'items': []
-                        }
-                        
-                        # Add invoice items
-                        for item in invoice.items:
-                            products = Product.query.get(item.product_id)
-                            log_data['invoice']['items'].append({
-                                'product_id': item.product_id,
-                                'product_name': products.name if products else 'Unknown',
-                                'quantity': item.quantity,
-                                'price': item.price
-                            })
-                except:
-                    pass
+            if log.invoice_id in invoices:
+                invoice, items = invoices[log.invoice_id]
+                log_data['invoice'] = {
+                    'id': invoice.id,
+                    'total_amount': invoice.total_amount,
+                    'created_at': invoice.created_at.isoformat(),
+                    'items': [{
+                        'product_id': item['product_id'],
+                        'product_name': item['product_name'] or 'Unknown',
+                        'quantity': item['quantity'],
+                        'price': item['price']
+                    } for item in items]
+                }
             
             enhanced_logs.append(log_data)
-
-            print(enhanced_logs)
         
         # Prepare response
         response = {
@@ -178,6 +221,7 @@ def get_sales_logs():
     
 @logs_bp.route('/sales/user', methods=['GET'])
 @jwt_required()
+@read_replica('users', 'log_entries.checkout', 'invoices', 'invoice_items', 'products')
 def get_user_sales_logs():
     """
     Retrieve sales logs filtered by user ID.
@@ -223,30 +267,27 @@ def get_user_sales_logs():
         # Pagination
         paginated = query.paginate(page=page, per_page=per_page, error_out=False)
         
+        # Load every referenced invoice and its items in one go
+        invoices = load_invoices(log.invoice_id for log in paginated.items)
+
         # Enhance with invoice data
         sales_data = []
         for log in paginated.items:
             log_data = log.to_dict()
             
-            # Extract invoice ID
-            invoice_id = None
-            if log.affected_name and 'Invoice ID' in log.affected_name:
-                invoice_id = log.affected_name.split('Invoice ID ')[1]
-            
-            if invoice_id:
-                invoice = Invoice.query.get(invoice_id)
-                if invoice:
-                    log_data['invoice'] = {
-                        'id': invoice.id,
-                        'total': invoice.total_amount,
-                        'date': invoice.created_at.isoformat(),
-                        'items': [{
-                            'product_id': item.product_id,
-                            'product_name': Product.query.get(item.product_id).name,
-                            'quantity': item.quantity,
-                            'price': item.price
-                        } for item in invoice.items]
-                    }
+            if log.invoice_id in invoices:
+                invoice, items = invoices[log.invoice_id]
+                log_data['invoice'] = {
+                    'id': invoice.id,
+                    'total': invoice.total_amount,
+                    'date': invoice.created_at.isoformat(),
+                    'items': [{
+                        'product_id': item['product_id'],
+                        'product_name': item['product_name'],
+                        'quantity': item['quantity'],
+                        'price': item['price']
+                    } for item in items]
+                }
             
             sales_data.append(log_data)
         
@@ -266,4 +307,109 @@ def get_user_sales_logs():
             f'Failed to retrieve user sales: {str(e)}',
             level='error'
         )
-        return jsonify({'error': 'Failed to retrieve sales data'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to retrieve sales data'}), 500
+
+EXPORT_COLUMNS = [
+    'id', 'timestamp', 'user_id', 'acting_username', 'action', 'message', 'affected_name',
+    'invoice_id', 'product_id', 'ip_address', 'user_agent', 'endpoint', 'method', 'status_code', 'additional_data'
+]
+
+@logs_bp.route('/export', methods=['GET'])
+@jwt_required()
+@token_required
+@read_replica('users', 'log_entries')
+def export_logs():
+    """
+    Stream audit logs, oldest first, as NDJSON or CSV without loading them into memory.
+    The response is gzip-compressed when the client sends Accept-Encoding: gzip.
+
+    Query Parameters:
+        - format: 'ndjson' or 'csv' (default: 'ndjson')
+        - start: Only logs at or after this ISO timestamp
+        - end: Only logs at or before this ISO timestamp
+        - action: Filter by action type
+        - user_id: Filter by acting user ID
+    """
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+    if not current_user or not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': "format must be 'ndjson' or 'csv'"}), 400
+
+    table = logEntry.__table__
+    query = db.select(*[table.c[column] for column in EXPORT_COLUMNS])
+    try:
+        if request.args.get('start'):
+            query = query.where(table.c.timestamp >= datetime.fromisoformat(request.args['start']))
+        if request.args.get('end'):
+            query = query.where(table.c.timestamp <= datetime.fromisoformat(request.args['end']))
+        if request.args.get('user_id'):
+            query = query.where(table.c.user_id == int(request.args['user_id']))
+    except ValueError:
+        return jsonify({'error': 'Invalid parameter value'}), 400
+    if request.args.get('action'):
+        query = query.where(table.c.action == request.args['action'])
+    query = query.order_by(table.c.timestamp, table.c.id).execution_options(
+        stream_results=True, yield_per=1000
+    )
+
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None
+        result = db.session.execute(query)
+
+        def emit(chunk):
+            data = chunk.encode('utf-8')
+            return compressor.compress(data) if compressor else data
+
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield emit(buffer.getvalue())
+
+        for rows in result.partitions():
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow([
+                        value.isoformat() if isinstance(value, datetime) else value
+                        for value in row
+                    ])
+                chunk = buffer.getvalue()
+            else:
+                chunk = ''.join(
+                    json.dumps({
+                        column: value.isoformat() if isinstance(value, datetime) else value
+                        for column, value in zip(EXPORT_COLUMNS, row)
+                    }) + '\n'
+                    for row in rows
+                )
+            data = emit(chunk)
+            if data:
+                yield data
+
+        if compressor:
+            yield compressor.flush()
+
+    log_action(
+        current_user_id,
+        'EXPORT_LOGS',
+        f'Exported logs as {export_format}',
+        additional_data=dict(request.args),
+        affected_name='Audit Logs'
+    )
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"logs-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{'csv' if export_format == 'csv' else 'ndjson'}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,40 @@
+import hmac
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from app.utils.decorators import token_required
+from app.utils.db_pool import pool_snapshot
+from app.utils.request_metrics import prometheus_text
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+
+def render_metrics():
+    return current_app.response_class(prometheus_text(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics():
+    """
+    Request, connection pool and audit writer metrics in the Prometheus text
+    format, for the worker process that answers (every series carries its
+    pid as the worker label). Scrapers send METRICS_TOKEN as a bearer token;
+    without METRICS_TOKEN a user's access token is required instead.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return jwt_required()(token_required(render_metrics))()
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({"message": "Unauthorized"}), 401
+    return render_metrics()
+
+
+@metrics_bp.route('/pool', methods=['GET'])
+@jwt_required()
+@token_required
+def get_pool_metrics():
+    """
+    Database connection pool usage for the worker process that answers:
+    checkouts, time spent waiting for a connection, timeouts and how many
+    connections are in use. Poll a few times to see every worker.
+    """
+    return jsonify(pool_snapshot()), 200
@@ -1,17 +1,26 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta
-from app.models import User, Product, Invoice, InvoiceItem, Category
+from app.models import User, Product, Invoice, InvoiceItem, Category, DailySales, StockMovement, StockSnapshot
+from app.models.models import consecutive_periods, month_periods
 from app import db
 from app.utils.logger import log_action
-from app.utils.decorators import token_required
+from app.utils.decorators import token_required, idempotent, conditional, read_replica
+from app.utils.inventory import parse_adjustments, apply_stock_adjustments, lock_products, StockError
+from app.utils.product_import import FORMATS, detect_format, parse_products, validate_products
+from app.utils.catalogue import catalogue_response, all_products, products_in_category
+from app.utils.pagination import keyset_paginate, cursor_args
+from app.utils.stock_events import queue_stock_changes, get_stock_event_queue
+from decimal import Decimal, InvalidOperation
 
 products_bp = Blueprint('products', __name__, url_prefix='/products')
 
 @products_bp.route('/total_stock', methods=['GET'])
 @jwt_required()
 @token_required
+@read_replica('products')
 def get_total_stock():
     """Get total product stock count"""
     current_user_id = get_jwt_identity()
@@ -40,6 +49,8 @@ def get_total_stock():
 @products_bp.route('/stock-by-category', methods=['GET'])
 @jwt_required()
 @token_required
+@conditional('products', 'categories')
+@read_replica('products', 'categories')
 def get_stock_by_category():
     current_user_id = get_jwt_identity()
     if isinstance(current_user_id, dict):
@@ -79,6 +90,7 @@ def get_stock_by_category():
 @products_bp.route('/revenue', methods=['GET'])
 @jwt_required()
 @token_required
+@read_replica('daily_sales', 'invoices')
 def get_revenue():
     """Calculate revenue for the past 30 days"""
     current_user_id = get_jwt_identity()
@@ -90,8 +102,8 @@ def get_revenue():
         end_date = datetime.utcnow()  # Current date and time
         start_date = end_date - timedelta(days=30)  # 30 days ago
 
-        # Calculate revenue for the past 30 days
-        revenue = Invoice.calculate_revenue(start_date, end_date)
+        # Whole days from the daily rollup, the two partial days from invoices
+        revenue = DailySales.revenue_in_window(start_date, end_date)
 
         # Log the action
         log_action(
@@ -117,42 +129,33 @@ def get_revenue():
 @products_bp.route('/compare-sales', methods=['GET'])
 @jwt_required()
 @token_required
+@read_replica('daily_sales')
 def compare_sales():
-    """Compare revenue between the last 30 days and the previous 30 days using growth factor and percentage change."""
+    """Compare revenue between the last 30 days and the previous 30 days using growth factor and percentage change.
+
+    Query Parameters:
+        - days: Length of each period in days (default: 30)
+    """
     current_user_id = get_jwt_identity()
     if isinstance(current_user_id, dict):
         current_user_id = current_user_id.get('id')
 
     try:
-        # Calculate date ranges for comparison
-        current_time = datetime.utcnow()
-        
-        # Period 1: Last 30 days
-        period1_end = current_time
-        period1_start = current_time - timedelta(days=30)
-        
-        # Period 2: Previous 30 days (before period 1)
-        period2_end = period1_start
-        period2_start = period2_end - timedelta(days=30)
-
-        # Log the date ranges for debugging
-        print(f"Period 1: {period1_start} to {period1_end}")
-        print(f"Period 2: {period2_start} to {period2_end}")
+        days = request.args.get('days', 30, type=int)
+        if days < 1 or days > 366:
+            return jsonify({"error": "days must be between 1 and 366"}), 400
 
-        # Get revenue for both periods
-        revenue_period1 = Invoice.calculate_revenue(period1_start, period1_end)
-        revenue_period2 = Invoice.calculate_revenue(period2_start, period2_end)
-
-        # Calculate growth factor and percentage change
-        growth_factor = Invoice.compare_sales_growth_factor(
-            period1_start, period1_end,
-            period2_start, period2_end
+        # Two back-to-back periods of whole days ending today
+        (period2_start, period2_end), (period1_start, period1_end) = consecutive_periods(
+            datetime.utcnow().date(), timedelta(days=days), 2
         )
 
-        percentage_change = Invoice.compare_sales_periods(
-            period1_start, period1_end,
-            period2_start, period2_end
-        )
+        # Revenue for both periods and the derived figures, in one rollup query
+        comparison = DailySales.compare_periods(period1_start, period1_end, period2_start, period2_end)
+        revenue_period1 = comparison['revenue_period1']
+        revenue_period2 = comparison['revenue_period2']
+        growth_factor = comparison['growth_factor']
+        percentage_change = comparison['percentage_change']
 
         # Format the previous month's date range (YYYY-MM-DD)
         previous_month_start = period2_start.strftime('%Y-%m-%d')
@@ -188,9 +191,117 @@ def compare_sales():
         )
         return jsonify({"error": f"Error comparing sales: {str(e)}"}), 500
 
+@products_bp.route('/sales-series', methods=['GET'])
+@jwt_required()
+@token_required
+@read_replica('daily_sales')
+def get_sales_series():
+    """Revenue per period for charting trends, in a single query.
+
+    Query Parameters:
+        - interval: 'day', 'week' or 'month' (default: 'month')
+        - periods: Number of periods ending with the current one (default: 12)
+    """
+    current_user_id = get_jwt_identity()
+    if isinstance(current_user_id, dict):
+        current_user_id = current_user_id.get('id')
+
+    interval = request.args.get('interval', 'month')
+    count = request.args.get('periods', 12, type=int)
+    if interval not in ('day', 'week', 'month'):
+        return jsonify({"error": "interval must be one of day, week, month"}), 400
+    if count < 1 or count > 366:
+        return jsonify({"error": "periods must be between 1 and 366"}), 400
+
+    try:
+        today = datetime.utcnow().date()
+        if interval == 'month':
+            periods = month_periods(today, count)
+        else:
+            periods = consecutive_periods(today, timedelta(days=1 if interval == 'day' else 7), count)
+
+        series = [{
+            'start': period['start'].strftime('%Y-%m-%d'),
+            'end': period['end'].strftime('%Y-%m-%d'),
+            'revenue': period['revenue']
+        } for period in DailySales.revenue_series(periods)]
+
+        log_action(
+            current_user_id,
+            'GET_SALES_SERIES',
+            f'Sales series fetched: {count} x {interval}',
+            affected_name='Sales Series'
+        )
+        return jsonify({"interval": interval, "series": series}), 200
+
+    except Exception as e:
+        log_action(
+            current_user_id,
+            'GET_SALES_SERIES_ERROR',
+            str(e),
+            level='error',
+            affected_name='Sales Series'
+        )
+        return jsonify({"error": f"Error fetching sales series: {str(e)}"}), 500
+
+@products_bp.route('/stock-at', methods=['GET'])
+@jwt_required()
+@token_required
+@read_replica('stock_snapshots', 'stock_movements', 'products')
+def get_stock_at():
+    """Stock levels at a point in time, from the nearest snapshot and the stock ledger.
+
+    Query Parameters:
+        - at: ISO date or datetime in UTC (default: now)
+        - product_id: Only this product
+        - category_id: Only products in this category
+    """
+    current_user_id = get_jwt_identity()
+    if isinstance(current_user_id, dict):
+        current_user_id = current_user_id.get('id')
+
+    try:
+        at = datetime.fromisoformat(request.args['at']) if request.args.get('at') else datetime.utcnow()
+    except ValueError:
+        return jsonify({"error": "at must be an ISO date or datetime"}), 400
+    product_id = request.args.get('product_id', type=int)
+    category_id = request.args.get('category_id', type=int)
+
+    try:
+        snapshot_at, levels = StockSnapshot.stock_at(at, product_id=product_id, category_id=category_id)
+
+        log_action(
+            current_user_id,
+            'GET_STOCK_AT',
+            f'Stock levels fetched for {at.isoformat()}',
+            affected_name='Stock History',
+            product_id=product_id
+        )
+        return jsonify({
+            "at": at.isoformat(),
+            "snapshot_at": snapshot_at.isoformat() if snapshot_at else None,
+            "products": [
+                {"product_id": level_product_id, "name": name, "in_stock": int(in_stock)}
+                for level_product_id, name, in_stock in levels
+            ],
+            "total_stock": sum(int(in_stock) for _, _, in_stock in levels)
+        }), 200
+
+    except Exception as e:
+        log_action(
+            current_user_id,
+            'GET_STOCK_AT_ERROR',
+            str(e),
+            level='error',
+            affected_name='Stock History'
+        )
+        return jsonify({"error": f"Error fetching stock levels: {str(e)}"}), 500
+
 @products_bp.route('/inventory-value', methods=['GET'])
 @jwt_required()
 @token_required
+@conditional('products', 'categories')
+@read_replica('products', 'categories')
 def get_inventory_value():
     """Get inventory value by category"""
     current_user_id = get_jwt_identity()
@@ -223,9 +334,12 @@ def get_inventory_value():
             level='error',
             affected_name='Inventory Value by Category'
         )
-        return jsonify({"error": f"Error fetching inventory value: {str(e)}"}), 500@products_bp.route('/user-sales/<int:user_id>', methods=['GET'])
+        return jsonify({"error": f"Error fetching inventory value: {str(e)}"}), 500
+
+@products_bp.route('/user-sales/<int:user_id>', methods=['GET'])
 @jwt_required()
 @token_required
+@read_replica('users', 'daily_sales')
 def get_user_sales(user_id):
     """Get sales for a specific user"""
     current_user_id = get_jwt_identity()
@@ -265,6 +379,7 @@ def get_user_sales(user_id):
 @products_bp.route('/all', methods=['GET'])
 @jwt_required()
 @token_required
+@conditional('products', 'categories')
 def get_all_products():
     """Get all products in inventory"""
     current_user_id = get_jwt_identity()
@@ -272,32 +387,17 @@ def get_all_products():
         current_user_id = current_user_id.get('id')
 
     try:
-        products = Product.query.join(Category).all()
-        products_list = []
-        
-        for product in products:  # Using explicit loop for clarity
-            product_data = {
-                "id": product.id,
-                "name": product.name,
-                "abv": product.abv,
-                "price": float(product.price),
-                "category": product.category.name,
-                "category_id": product.category.id,
-                "bottle_size": product.bottle_size,
-                "in_stock": product.in_stock,
-                "image_url": product.image_url,
-                "added_by": product.added_by,
-                "added_at": product.added_at.isoformat() if product.added_at else None
-            }
-            products_list.append(product_data)
+        response = catalogue_response('products', all_products)
 
+        # Catalogue reads are frequent; keep them out of the audit table
         log_action(
             current_user_id, 
             'GET_ALL_PRODUCTS', 
             'Fetched all products',
+            save_to_db=False,
             affected_name='All products'
         )
-        return jsonify({"products": products_list}), 200
+        return response
         
     except Exception as e:
         log_action(
@@ -308,6 +408,175 @@ def get_all_products():
             affected_name='All products'
         )
         return jsonify({"error": f"Error fetching products: {str(e)}"}), 500
+@products_bp.route('/search', methods=['GET'])
+@jwt_required()
+@token_required
+@conditional('products', 'categories')
+def search_products():
+    """
+    Search, filter and sort products, a page at a time.
+
+    Query Parameters:
+        - q: text to look for in the product name
+        - match: 'substring' (default) or 'prefix'
+        - category_id: only this category
+        - min_price / max_price, min_abv / max_abv, min_bottle_size / max_bottle_size,
+          min_stock / max_stock: inclusive ranges
+        - in_stock: true for products with stock left only
+        - sort: name (default), price, bottle_size, in_stock or newest
+        - order: asc or desc (default asc, desc for newest)
+        - limit, cursor, include_total: as for GET /invoices/
+    """
+    current_user_id = get_jwt_identity()
+    if isinstance(current_user_id, dict):
+        current_user_id = current_user_id.get('id')
+
+    try:
+        limit, cursor, include_total = cursor_args(request.args)
+        match = request.args.get('match', 'substring')
+        if match not in ('substring', 'prefix'):
+            raise ValueError('match must be substring or prefix')
+        sort = request.args.get('sort', 'name')
+        if sort not in Product.SEARCH_SORTS:
+            raise ValueError(f"sort must be one of {', '.join(Product.SEARCH_SORTS)}")
+        order = request.args.get('order', 'desc' if sort == 'newest' else 'asc')
+        if order not in ('asc', 'desc'):
+            raise ValueError('order must be asc or desc')
+        category_id = request.args.get('category_id', type=int)
+
+        ranges = {}
+        for param, column, parse in (('price', 'price', Decimal), ('abv', 'abv', float),
+                                     ('bottle_size', 'bottle_size', int), ('stock', 'in_stock', int)):
+            bounds = []
+            for end in ('min', 'max'):
+                value = request.args.get(f'{end}_{param}')
+                try:
+                    bounds.append(parse(value) if value not in (None, '') else None)
+                except (ValueError, InvalidOperation):
+                    raise ValueError(f'{end}_{param} must be a number')
+            if bounds != [None, None]:
+                ranges[column] = tuple(bounds)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        query = Product.search(
+            q=(request.args.get('q') or '').strip() or None,
+            match=match,
+            category_id=category_id,
+            ranges=ranges,
+            in_stock_only=request.args.get('in_stock', 'false').lower() == 'true'
+        )
+        sort_column = getattr(Product, Product.SEARCH_SORTS[sort])
+        page = keyset_paginate(query, sort_column, Product.id, cursor, limit,
+                               descending=order == 'desc', with_total=include_total)
+
+        products_list = [{
+            "id": product.id,
+            "name": product.name,
+            "abv": product.abv,
+            "price": float(product.price),
+            "category": product.category.name,
+            "category_id": product.category_id,
+            "bottle_size": product.bottle_size,
+            "in_stock": product.in_stock,
+            "reorder_level": product.reorder_level,
+            "image_url": product.image_url,
+            "added_by": product.added_by,
+            "added_at": product.added_at.isoformat() if product.added_at else None
+        } for product in page.items]
+
+        response = {'products': products_list, 'next_cursor': page.next_cursor}
+        if include_total:
+            response['approximate_total'] = page.approximate_total
+        return jsonify(response), 200
+
+    except Exception as e:
+        log_action(
+            current_user_id,
+            'SEARCH_PRODUCTS_ERROR',
+            str(e),
+            level='error',
+            affected_name='Product search'
+        )
+        return jsonify({"error": f"Error searching products: {str(e)}"}), 500
+
+@products_bp.route('/low-stock', methods=['GET'])
+@jwt_required()
+@token_required
+@conditional('products', 'categories')
+def get_low_stock():
+    """
+    Products at or below their reorder level, largest shortfall first.
+
+    Query Parameters:
+        - category_id: only this category
+    """
+    current_user_id = get_jwt_identity()
+    if isinstance(current_user_id, dict):
+        current_user_id = current_user_id.get('id')
+
+    try:
+        products = Product.low_stock(category_id=request.args.get('category_id', type=int)).all()
+        return jsonify({'products': [{
+            'id': product.id,
+            'name': product.name,
+            'category': product.category.name,
+            'category_id': product.category_id,
+            'in_stock': product.in_stock,
+            'reorder_level': product.reorder_level,
+            'shortfall': product.reorder_level - product.in_stock,
+        } for product in products]}), 200
+
+    except Exception as e:
+        log_action(
+            current_user_id,
+            'GET_LOW_STOCK_ERROR',
+            str(e),
+            level='error',
+            affected_name='Low stock'
+        )
+        return jsonify({"error": f"Error fetching low stock: {str(e)}"}), 500
+
+
+@products_bp.route('/stock-events', methods=['GET'])
+@jwt_required()
+@token_required
+def get_stock_events():
+    """
+    Poll for products crossing their reorder level (see app/utils/stock_events.py).
+
+    Query Parameters:
+        - after: last seq already seen (default: 0)
+        - wait: seconds to wait for a new event, 0-30 (default: 0)
+        - limit: events per response, 1-500 (default: 100)
+    """
+    try:
+        after = request.args.get('after', 0, type=int)
+        wait = request.args.get('wait', 0, type=float)
+        limit = request.args.get('limit', 100, type=int)
+        if after < 0 or not 0 <= wait <= 30 or not 1 <= limit <= 500:
+            raise ValueError
+    except ValueError:
+        return jsonify({'message': 'after must be >= 0, wait 0-30 and limit 1-500'}), 400
+
+    events, last_seq, missed = get_stock_event_queue().poll(after, limit, wait)
+    return jsonify({
+        'events': events,
+        'last_seq': events[-1]['seq'] if events else last_seq,
+        'missed': missed
+    }), 200
+
+
+def _non_negative_int_error(data, *fields):
+    """Message for the first of fields present in data that is not a non-negative integer, else None."""
+    for field in fields:
+        value = data.get(field)
+        if field in data and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            return f'{field} must be a non-negative integer'
+    return None
+
+
 @products_bp.route('/add', methods=['POST'])
 @jwt_required()
 @token_required
@@ -319,6 +588,9 @@ def add_product():
     data = request.get_json()
     if not Category.query.get(data.get('category_id')):
         return jsonify({"msg": "Invalid category"}), 400
+    error = _non_negative_int_error(data, 'in_stock', 'reorder_level')
+    if error:
+        return jsonify({"msg": error}), 400
 
     try:
         new_product = Product(
@@ -327,20 +599,26 @@ def add_product():
             price=data.get('price'),
             category_id=data.get('category_id'),
             bottle_size=data.get('bottle_size'),
-            in_stock=data.get('in_stock'),
+            in_stock=data.get('in_stock', 0),
+            reorder_level=data.get('reorder_level', 0),
             image_url=data.get('image_url'),
             added_by=current_user.id,
             added_at=datetime.utcnow()
         )
 
         db.session.add(new_product)
+        db.session.flush()
+        StockMovement.record([{
+            'product_id': new_product.id, 'delta': new_product.in_stock or 0, 'reason': 'initial'
+        }], current_user.id)
         db.session.commit()
 
         log_action(
             current_user.id,
             'ADD_PRODUCT',
             f'Product added: {new_product.name}',
-            affected_name=new_product.name
+            affected_name=new_product.name,
+            product_id=new_product.id
         )
 
         return jsonify({"msg": "Product added successfully", "product_id": new_product.id}), 201
@@ -357,6 +635,123 @@ def add_product():
         return jsonify({"error": f"Error adding product: {str(e)}"}), 500
 
 
+@products_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+@token_required
+def bulk_import_products():
+    """
+    Create or update many products at once, matched by name.
+
+    The body is a JSON array (or {"products": [...]}), NDJSON or CSV, chosen
+    by Content-Type, the extension of an uploaded `file`, or ?format=.
+    Only the columns present in the input are overwritten on existing
+    products. Nothing is written if any row is invalid.
+    """
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+    if not current_user.can_manage_inventory():
+        return jsonify({"msg": "Insufficient permissions"}), 403
+
+    try:
+        upload = request.files.get('file')
+        if upload:
+            text = upload.read().decode('utf-8-sig')
+            fmt = request.args.get('format') or detect_format(upload.mimetype, upload.filename)
+        else:
+            text = request.get_data(as_text=True)
+            fmt = request.args.get('format') or detect_format(request.content_type)
+        if fmt not in FORMATS:
+            return jsonify({"msg": f"format must be one of {', '.join(FORMATS)}"}), 400
+
+        records = parse_products(text, fmt)
+        if not records:
+            return jsonify({"msg": "No products provided"}), 400
+
+        groups, errors = validate_products(records, Product.category_lookup())
+        if errors:
+            return jsonify({"msg": "Invalid products", "errors": errors}), 400
+
+        created, updated = Product.bulk_upsert(current_user.id, groups)
+        db.session.commit()
+
+        summary = {'received': len(records), 'created': created, 'updated': updated}
+        log_action(
+            current_user.id,
+            'BULK_IMPORT_PRODUCTS',
+            f'Imported {created + updated} products ({created} created, {updated} updated)',
+            additional_data=dict(summary, format=fmt),
+            affected_name='Product Inventory'
+        )
+        return jsonify(dict(summary, msg="Products imported successfully")), 200
+
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        log_action(
+            current_user.id,
+            'BULK_IMPORT_PRODUCTS_ERROR',
+            str(e),
+            level='error',
+            affected_name='Product Inventory'
+        )
+        return jsonify({"error": f"Error importing products: {str(e)}"}), 500
+
+
+@products_bp.route('/stock-adjustments', methods=['POST'])
+@jwt_required()
+@token_required
+@idempotent
+def adjust_stock():
+    """
+    Apply a delivery or stocktake to many products in one transaction.
+
+    Body: {"reason": "...", "adjustments": [{"product_id": 1, "delta": 12}, {"product_id": 2, "count": 30, "reason": "..."}]}
+    delta adds (or, if negative, removes) units; count sets the level outright.
+    A line's reason defaults to the top-level reason. Returns the new levels.
+    """
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+    if not current_user.can_manage_inventory():
+        return jsonify({"msg": "Insufficient permissions"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        lines = parse_adjustments(data.get('adjustments'), data.get('reason'))
+        levels = apply_stock_adjustments(lines, current_user_id)
+        db.session.commit()
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({"msg": str(e)}), e.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        log_action(
+            current_user.id,
+            'STOCK_ADJUSTMENT_ERROR',
+            str(e),
+            level='error',
+            affected_name='Product Inventory'
+        )
+        return jsonify({"error": f"Error adjusting stock: {str(e)}"}), 500
+
+    reasons = {line['product_id']: line['reason'] for line in lines}
+    log_action(
+        current_user_id,
+        'STOCK_ADJUSTMENT',
+        f'Adjusted stock for {len(levels)} products',
+        additional_data={'lines': [
+            {'product_id': level['product_id'], 'from': level['previous'], 'to': level['in_stock'],
+             'reason': reasons[level['product_id']]}
+            for level in levels
+        ]},
+        affected_name='Product Inventory'
+    )
+    return jsonify({"msg": "Stock adjusted", "products": levels}), 200
+
+
 @products_bp.route('/<int:product_id>', methods=['PUT'])
 @jwt_required()
 @token_required
@@ -395,11 +790,20 @@ def update_product(product_id):
             'UPDATE_PRODUCT_ERROR', 
             'No update data',
             level='error',
-            affected_name=product.name
+            affected_name=product.name,
+            product_id=product.id
         )
         return jsonify({'message': 'No data provided'}), 400
+    error = _non_negative_int_error(data, 'in_stock', 'reorder_level')
+    if error:
+        return jsonify({'message': error}), 400
 
     try:
+        if 'in_stock' in data or 'reorder_level' in data:
+            # Re-read the product under the lock, so the ledger delta is taken
+            # against the level this update replaces, not one a sale has moved since
+            lock_products([product.id])
+            db.session.refresh(product)
         if 'name' in data: product.name = data['name']
         if 'abv' in data: product.abv = data['abv']
         if 'price' in data: product.price = data['price']
@@ -408,7 +812,16 @@ def update_product(product_id):
             if category:
                 product.category = category
         if 'bottle_size' in data: product.bottle_size = data['bottle_size']
-        if 'in_stock' in data: product.in_stock = data['in_stock']
+        previous_stock, previous_level = product.in_stock, product.reorder_level
+        if 'reorder_level' in data: product.reorder_level = data['reorder_level']
+        if 'in_stock' in data:
+            product.in_stock = data['in_stock']
+            StockMovement.record([{
+                'product_id': product.id, 'delta': product.in_stock - previous_stock, 'reason': 'product_update'
+            }], current_user_id, track_events=False)
+        # One event for the stock and reorder level change together
+        queue_stock_changes([(product.id, product.name, previous_stock, product.in_stock,
+                              previous_level, product.reorder_level)])
         if 'image_url' in data: product.image_url = data['image_url']
 
         db.session.commit()
@@ -416,7 +829,8 @@ def update_product(product_id):
             current_user_id, 
             'UPDATE_PRODUCT_SUCCESS', 
             f'Updated {product.name}',
-            affected_name=product.name
+            affected_name=product.name,
+            product_id=product.id
         )
         return jsonify({
             'message': 'Product updated',
@@ -429,6 +843,7 @@ def update_product(product_id):
                 'category_name': product.category.name if product.category else None,
                 'bottle_size': product.bottle_size,
                 'in_stock': product.in_stock,
+                'reorder_level': product.reorder_level,
                 'image_url': product.image_url
             }
         }), 200
@@ -439,7 +854,8 @@ def update_product(product_id):
             'UPDATE_PRODUCT_ERROR', 
             str(e), 
             level='error',
-            affected_name=product.name
+            affected_name=product.name,
+            product_id=product.id
         )
         return jsonify({'message': f'Update error: {str(e)}'}), 500
 @products_bp.route('/<int:product_id>', methods=['DELETE'])
@@ -491,6 +907,22 @@ def delete_product(product_id):
                 'name': product_name
             }
         }), 200
+
+    except IntegrityError:
+        # Invoices, stock movements or carts still point at the product
+        db.session.rollback()
+        log_action(
+            current_user_id,
+            'DELETE_PRODUCT_ERROR',
+            f'Product {product_id} is still referenced by invoices, stock movements or carts',
+            level='error',
+            affected_name=f'Product ID {product_id}',
+            product_id=product_id
+        )
+        return jsonify({
+            'message': 'Product has sales or stock history and cannot be deleted; set its stock to 0 instead',
+            'product_id': product_id
+        }), 409
         
     except Exception as e:
         db.session.rollback()
@@ -507,41 +939,43 @@ def delete_product(product_id):
         }), 500
 @products_bp.route('/top_selling', methods=['GET'])
 @token_required
+@read_replica('products', 'daily_sales')
 def get_top_selling():
     # Get the current date and the date one month ago
-    now = datetime.utcnow()
-    last_month = now - timedelta(days=30)
+    today = datetime.utcnow().date()
+    last_month = today - timedelta(days=29)
 
     # Query to get the top three most sold products in the last month
     top_products = db.session.query(
+        Product.id,
         Product.name,
-        func.sum(InvoiceItem.quantity).label('total_sold'),
-        func.sum(InvoiceItem.quantity * InvoiceItem.price).label('total_revenue')
-    ).join(InvoiceItem, InvoiceItem.product_id == Product.id) \
-     .join(Invoice, Invoice.id == InvoiceItem.invoice_id) \
-     .filter(Invoice.created_at >= last_month) \
-     .group_by(Product.name) \
-     .order_by(func.sum(InvoiceItem.quantity).desc()) \
+        func.sum(DailySales.quantity).label('total_sold'),
+        func.sum(DailySales.revenue).label('total_revenue')
+    ).join(DailySales, DailySales.product_id == Product.id) \
+     .filter(DailySales.day >= last_month) \
+     .group_by(Product.id, Product.name) \
+     .order_by(func.sum(DailySales.quantity).desc()) \
      .limit(3).all()
 
-    # Query to get the total sales for the previous month
+    # Query to get the previous month's sales for those products
     previous_month_start = last_month - timedelta(days=30)
     previous_month_sales = db.session.query(
-        Product.name,
-        func.sum(InvoiceItem.quantity).label('total_sold')
-    ).join(InvoiceItem, InvoiceItem.product_id == Product.id) \
-     .join(Invoice, Invoice.id == InvoiceItem.invoice_id) \
-     .filter(Invoice.created_at >= previous_month_start, Invoice.created_at < last_month) \
-     .group_by(Product.name).all()
+        DailySales.product_id,
+        func.sum(DailySales.quantity).label('total_sold')
+    ).filter(
+        DailySales.product_id.in_([product.id for product in top_products]),
+        DailySales.day >= previous_month_start,
+        DailySales.day < last_month
+    ).group_by(DailySales.product_id).all()
 
     # Convert previous month sales to a dictionary for easy lookup
-    previous_sales_dict = {name: total_sold for name, total_sold in previous_month_sales}
+    previous_sales_dict = {product_id: total_sold for product_id, total_sold in previous_month_sales}
 
     # Prepare the response data
     result = []
     for product in top_products:
-        name, total_sold, total_revenue = product
-        previous_sold = previous_sales_dict.get(name, 0)
+        product_id, name, total_sold, total_revenue = product
+        previous_sold = previous_sales_dict.get(product_id, 0)
         if previous_sold == 0:
             percentage_change = 0
         else:
@@ -560,6 +994,7 @@ def get_top_selling():
 @products_bp.route('/by-category/<int:category_id>', methods=['GET'])
 @jwt_required()
 @token_required
+@conditional('products', 'categories')
 def get_products_by_category(category_id):
     """Get all products in a specific category"""
     current_user_id = get_jwt_identity()
@@ -567,9 +1002,8 @@ def get_products_by_category(category_id):
         current_user_id = current_user_id.get('id')
 
     try:
-        # Verify category exists
-        category = Category.query.get(category_id)
-        if not category:
+        response = catalogue_response(f'category:{category_id}', lambda: products_in_category(category_id))
+        if response is None:
             log_action(
                 current_user_id,
                 'GET_PRODUCTS_BY_CATEGORY_ERROR',
@@ -579,31 +1013,14 @@ def get_products_by_category(category_id):
             )
             return jsonify({'message': 'Category not found'}), 404
 
-        # Get products with category details
-        products = Product.query.filter_by(category_id=category_id).all()
-        
-        products_list = [{
-            "id": product.id,
-            "name": product.name,
-            "price": float(product.price),
-            "in_stock": product.in_stock,
-            "category": category.name,
-            "added_at": product.added_at.isoformat() if product.added_at else None
-        } for product in products]
-
         log_action(
             current_user_id,
             'GET_PRODUCTS_BY_CATEGORY',
-            f'Fetched {len(products)} products from {category.name}',
-            affected_name=category.name
+            f'Fetched products from category {category_id}',
+            save_to_db=False,
+            affected_name=f'Category ID {category_id}'
         )
-        
-        return jsonify({
-            "category_id": category_id,
-            "category_name": category.name,
-            "product_count": len(products),
-            "products": products_list
-        }), 200
+        return response
 
     except Exception as e:
         log_action(
@@ -614,57 +1031,3 @@ def get_products_by_category(category_id):
             affected_name=f'Category ID {category_id}'
         )
         return jsonify({"error": f"Error fetching products: {str(e)}"}), 500
-    
-"""
-
-@products_bp.route('/by-category/<int:category_id>', methods=['GET'])
-@jwt_required()
-@token_required
-def get_products_by_category(category_id):
-    
-    current_user_id = get_jwt_identity()
-    if isinstance(current_user_id, dict):
-        current_user_id = current_user_id.get('id')
-
-    try:
-        # Verify category exists
-        category = Category.query.get(category_id)
-        if not category:
-            return jsonify({'message': 'Category not found'}), 404
-
-        # Get query parameters
-        in_stock_only = request.args.get('in_stock', 'false').lower() == 'true'
-        min_stock = request.args.get('min_stock', 0, type=int)
-
-        # Base query
-        query = Product.query.filter_by(category_id=category_id)
-
-        # Apply filters
-        if in_stock_only:
-            query = query.filter(Product.in_stock > 0)
-        if min_stock > 0:
-            query = query.filter(Product.in_stock >= min_stock)
-
-        products = query.all()
-        
-        # Format response
-        products_list = [{
-            "id": product.id,
-            "name": product.name,
-            "price": float(product.price),
-            "in_stock": product.in_stock,
-            "is_in_stock": product.in_stock > 0  # Additional helpful field
-        } for product in products]
-
-        return jsonify({
-            "category_id": category_id,
-            "category_name": category.name,
-            "in_stock_only": in_stock_only,
-            "min_stock": min_stock,
-            "product_count": len(products_list),
-            "products": products_list
-        }), 200
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-"""
\ No newline at end of file
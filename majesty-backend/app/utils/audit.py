@@ -0,0 +1,184 @@
+# app/utils/audit.py
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from sqlalchemy.exc import IntegrityError
+
+from app.utils.retry import retry_on_conflict
+from app.utils.table_versions import bump_table_versions
+
+
+class AuditWriter:
+    """
+    Background writer for audit log rows.
+
+    log_action hands rows to a bounded in-process queue and returns straight
+    away. A daemon thread drains the queue and writes the rows to log_entries
+    with multi-row INSERTs on its own connection, flushing whenever
+    AUDIT_BATCH_SIZE rows are waiting or AUDIT_FLUSH_INTERVAL_MS has passed.
+    Rows that do not fit in the queue are counted in `dropped` instead of
+    blocking the request.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.batch_size = 200
+        self.flush_interval = 0.5
+        self.queue = None
+        self.dropped = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AUDIT_ASYNC', True)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 200)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL_MS', 500) / 1000.0
+        self.queue = queue.Queue(maxsize=app.config.get('AUDIT_QUEUE_SIZE', 10000))
+        app.extensions['audit_writer'] = self
+        atexit.register(self.shutdown)
+
+    def enqueue(self, row):
+        """Queue a log_entries row for writing. Never blocks the caller."""
+        if not self.enabled:
+            self._write([row])
+            return
+
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logging.getLogger('wine_inventory').warning(
+                f"Audit queue full, dropped log entry: {row.get('action')}"
+            )
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize() if self.queue else 0,
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+    def flush(self):
+        """Synchronously write everything currently waiting in the queue."""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self, timeout=5):
+        """Stop the worker and write whatever is still queued."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # Forked worker: the parent's queue and thread are not ours
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self):
+        """Wait for up to batch_size rows or until the flush interval elapses."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @retry_on_conflict
+    def _insert(self, rows):
+        from app import db
+        from app.models import logEntry, User, Invoice, Product
+
+        with db.engine.begin() as conn:
+            # Resolve acting usernames for the whole batch in one query
+            user_ids = {row['user_id'] for row in rows if row['user_id'] is not None}
+            usernames = {}
+            if user_ids:
+                usernames = dict(conn.execute(
+                    db.select(User.id, User.username).where(User.id.in_(user_ids))
+                ).all())
+            for row in rows:
+                row['acting_username'] = usernames.get(row['user_id'])
+
+            try:
+                with conn.begin_nested():
+                    conn.execute(logEntry.__table__.insert().values(rows))
+            except IntegrityError:
+                # A referenced user, invoice or product was deleted before the
+                # batch was written: keep the rows, drop the dangling references
+                for column, model in (('user_id', User), ('invoice_id', Invoice), ('product_id', Product)):
+                    ids = {row[column] for row in rows if row[column] is not None}
+                    existing = set(conn.execute(
+                        db.select(model.id).where(model.id.in_(ids))
+                    ).scalars()) if ids else set()
+                    for row in rows:
+                        if row[column] not in existing:
+                            row[column] = None
+                conn.execute(logEntry.__table__.insert().values(rows))
+
+            # Readers polling for one kind of entry (e.g. CHECKOUT_*) only
+            # need to notice batches that contain that kind
+            bump_table_versions(conn, {'log_entries'} | {
+                'log_entries.' + row['action'].split('_')[0].lower() for row in rows if row.get('action')
+            })
+
+    def _write(self, rows):
+        try:
+            with self.app.app_context():
+                self._insert(rows)
+            with self._lock:
+                self.written += len(rows)
+        except Exception as e:
+            with self._lock:
+                self.dropped += len(rows)
+            logger = logging.getLogger('wine_inventory')
+            logger.error(f"Failed to save {len(rows)} log entries to database: {str(e)}")
+            logger.debug(traceback.format_exc())
@@ -0,0 +1,184 @@
+# app/utils/catalogue.py
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.table_versions import get_table_versions
+
+try:
+    import redis
+except ImportError:  # optional, only needed for CATALOGUE_CACHE_URL
+    redis = None
+
+# Writes to these tables change what the catalogue endpoints return
+CATALOGUE_TABLES = frozenset(('products', 'categories'))
+
+
+class LocalBackend:
+    """In-process stand-in for a shared cache: a dict with expiry."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            # Keys from older table versions are never read again; let them go
+            self._entries = {k: entry for k, entry in self._entries.items() if entry[1] > now}
+            self._entries[key] = (value, now + self.ttl)
+
+
+class RedisBackend:
+    """Cache shared by every worker, kept in Redis."""
+
+    def __init__(self, url, ttl, prefix='wss:catalogue:'):
+        if redis is None:
+            raise RuntimeError('CATALOGUE_CACHE_URL is set but the redis package is not installed')
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+
+class CatalogueCache:
+    """
+    Read-through cache of the serialized product and category lists.
+
+    Entries are keyed by the versions of products and categories in
+    table_versions, which every committed write to them bumps in the
+    database, so no worker serves a catalogue older than the last write,
+    whichever worker made it. The cache lives in process unless
+    CATALOGUE_CACHE_URL points at Redis, where the workers share it;
+    entries for old versions expire after CATALOGUE_CACHE_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.backend = LocalBackend(30)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        ttl = app.config.get('CATALOGUE_CACHE_TTL', 30)
+        url = app.config.get('CATALOGUE_CACHE_URL')
+        self.backend = RedisBackend(url, ttl) if url else LocalBackend(ttl)
+        app.extensions['catalogue_cache'] = self
+
+    def get(self, name, build):
+        """
+        Return (body, version) for the catalogue view called name, where
+        version names the table versions it was built at. build() returns
+        the data to serialize, or None if there is nothing to show (which is
+        not cached); in that case body is None.
+        """
+        # Read before building, so the body is never older than its key
+        versions = get_table_versions(CATALOGUE_TABLES)
+        version = '.'.join(str(versions[table]) for table in sorted(versions))
+        key = f'{version}:{name}'
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            logging.getLogger('wine_inventory').error(f"Catalogue cache unavailable: {str(e)}")
+            key = cached = None
+        if cached is not None:
+            return cached, version
+
+        data = build()
+        if data is None:
+            return None, version
+        body = current_app.json.dumps(data).encode()
+        if key is not None:
+            try:
+                self.backend.set(key, body)
+            except Exception as e:
+                logging.getLogger('wine_inventory').error(f"Catalogue cache unavailable: {str(e)}")
+        return body, version
+
+
+def get_catalogue_cache():
+    return current_app.extensions['catalogue_cache']
+
+
+def catalogue_response(name, build):
+    """
+    Serve a catalogue view from the cache. Returns None when build() found
+    nothing. ETags and 304s come from @conditional on the view.
+    """
+    body, _ = get_catalogue_cache().get(name, build)
+    if body is None:
+        return None
+    return current_app.response_class(body, status=200, mimetype='application/json')
+
+
+def all_products():
+    from app import db
+    from app.models import Product, Category
+
+    rows = db.session.query(
+        Product.id, Product.name, Product.abv, Product.price, Category.name, Category.id,
+        Product.bottle_size, Product.in_stock, Product.image_url, Product.added_by, Product.added_at,
+        Product.reorder_level
+    ).join(Category, Product.category_id == Category.id).order_by(Product.id).all()
+
+    return {"products": [{
+        "id": row[0],
+        "name": row[1],
+        "abv": row[2],
+        "price": float(row[3]),
+        "category": row[4],
+        "category_id": row[5],
+        "bottle_size": row[6],
+        "in_stock": row[7],
+        "image_url": row[8],
+        "added_by": row[9],
+        "added_at": row[10].isoformat() if row[10] else None,
+        "reorder_level": row[11]
+    } for row in rows]}
+
+
+def products_in_category(category_id):
+    from app import db
+    from app.models import Product, Category
+
+    category = db.session.get(Category, category_id)
+    if not category:
+        return None
+
+    rows = db.session.query(
+        Product.id, Product.name, Product.price, Product.in_stock, Product.added_at
+    ).filter(Product.category_id == category_id).order_by(Product.id).all()
+
+    return {
+        "category_id": category_id,
+        "category_name": category.name,
+        "product_count": len(rows),
+        "products": [{
+            "id": row[0],
+            "name": row[1],
+            "price": float(row[2]),
+            "in_stock": row[3],
+            "category": category.name,
+            "added_at": row[4].isoformat() if row[4] else None
+        } for row in rows]
+    }
+
+
+def all_categories():
+    from app.models import Category
+
+    return [c.to_dict() for c in Category.query.order_by(Category.id).all()]
+
@@ -0,0 +1,207 @@
+# app/utils/db_pool.py
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (seconds) of the checkout wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+SQLITE_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class PoolStats:
+    """Counters for connection checkouts from one process's pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.wait_buckets = [0] * len(WAIT_BUCKETS)
+            self.peak_checked_out = 0
+
+    def record(self, waited, checked_out, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    self.wait_buckets[index] += 1
+                    break
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            data = {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'wait_seconds_avg': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+                'wait_buckets': [{'le': bound, 'count': count} for bound, count in zip(WAIT_BUCKETS, self.wait_buckets)],
+                'peak_checked_out': self.peak_checked_out,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        return data
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    stats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.stats is not None:
+                self.stats.record(time.perf_counter() - started, self.checkedout(), timed_out=True)
+            raise
+        if self.stats is not None:
+            self.stats.record(time.perf_counter() - started, self.checkedout())
+        return connection
+
+
+def engine_options(config, stats=None):
+    """
+    SQLAlchemy engine options for the DB_POOL_* / DB_* settings in config.
+
+    Sizes are per worker process, so the database sees up to
+    workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. SQLite files
+    also get the DB_SQLITE_* PRAGMAs on connect; in-memory SQLite keeps
+    Flask-SQLAlchemy's own pool.
+    """
+    url = make_url(config.get('SQLALCHEMY_DATABASE_URI') or 'sqlite://')
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+
+    # A subclass per app, so the stats survive engine.dispose() recreating the pool
+    poolclass = type('TimedQueuePool', (TimedQueuePool,), {'stats': stats})
+    options = {
+        'poolclass': poolclass,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+    if backend == 'sqlite':
+        pragmas = sqlite_pragmas(config)
+        if pragmas:
+            event.listen(poolclass, 'connect', lambda dbapi_connection, record: _run_pragmas(dbapi_connection, pragmas))
+
+    elif backend == 'postgresql':
+        connect_args = {}
+        statement_timeout = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+        if config.get('DB_PGBOUNCER', False):
+            # Transaction pooling hands each transaction to whichever server
+            # connection is free, so nothing may live on the session: no
+            # server-side prepared statements (psycopg 3 prepares repeated
+            # queries by default; psycopg2 never does) and no startup options
+            if url.get_driver_name() == 'psycopg':
+                connect_args['prepare_threshold'] = None
+            if statement_timeout:
+                logging.getLogger('wine_inventory').warning(
+                    "DB_STATEMENT_TIMEOUT_MS is ignored with DB_PGBOUNCER; "
+                    "set it on the role instead (ALTER ROLE ... SET statement_timeout)"
+                )
+        elif statement_timeout:
+            connect_args['options'] = f'-c statement_timeout={int(statement_timeout)}'
+        if connect_args:
+            options['connect_args'] = connect_args
+
+    return options
+
+
+def sqlite_pragmas(config):
+    """
+    PRAGMAs run on every new SQLite connection, from the DB_SQLITE_* settings.
+
+    WAL lets readers carry on while a checkout writes, and with
+    synchronous=NORMAL a commit only waits for the WAL to be written, not
+    synced (a power cut can lose the last commits, never corrupt the file).
+    busy_timeout makes a writer wait for the lock instead of failing with
+    "database is locked". foreign_keys matches what PostgreSQL enforces.
+    """
+    if not config.get('DB_SQLITE_TUNING', True):
+        return []
+    synchronous = str(config.get('DB_SQLITE_SYNCHRONOUS', 'NORMAL')).upper()
+    if synchronous not in SQLITE_SYNCHRONOUS:
+        raise ValueError(f"DB_SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS)}")
+    return [
+        'PRAGMA journal_mode=WAL',
+        f'PRAGMA synchronous={synchronous}',
+        f"PRAGMA busy_timeout={int(config.get('DB_SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(config.get('DB_SQLITE_MMAP_SIZE', 268435456))}",
+        # Negative sizes are in KiB rather than pages
+        f"PRAGMA cache_size=-{int(config.get('DB_SQLITE_CACHE_SIZE_KB', 65536))}",
+        'PRAGMA foreign_keys=ON',
+    ]
+
+
+def _run_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def init_app(app):
+    """Configure the pool from the app config. Call before db.init_app(app)."""
+    stats = PoolStats()
+    options = engine_options(app.config, stats)
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS still win
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    app.extensions['pool_stats'] = stats
+
+    # The read replica gets its own pool, sized by the same settings
+    replica_uri = app.config.get('SQLALCHEMY_REPLICA_URI')
+    if replica_uri:
+        replica_stats = PoolStats()
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault('replica', {
+            'url': replica_uri,
+            **engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=replica_uri), replica_stats),
+        })
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['replica_pool_stats'] = replica_stats
+
+
+def pool_snapshot():
+    """Pool stats and current usage for this process, and for the replica's pool if any."""
+    from app import db
+
+    data = current_app.extensions['pool_stats'].snapshot(db.engine.pool)
+    replica_stats = current_app.extensions.get('replica_pool_stats')
+    if replica_stats is not None:
+        data['replica'] = replica_stats.snapshot(db.engines['replica'].pool)
+    return data
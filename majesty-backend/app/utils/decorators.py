@@ -1,38 +1,19 @@
+import hashlib
+import time
 from functools import wraps
-from flask import request, jsonify
-import jwt  # Ensure you have imported the jwt library (usually PyJWT)
-from app import db
-from config.development import DevelopmentConfig  # Make sure you import your config where the SECRET_KEY is defined
+from flask import request, jsonify, make_response, current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 
-def extract_jti(token: str) -> str:
-    """
-    Extract the JWT ID (jti) from the token.
+def token_required(f):
     """
-    try:
-        from config.development import DevelopmentConfig  # Import your config class
-        decoded_token = jwt.decode(token, DevelopmentConfig.JWT_SECRET_KEY, algorithms=["HS256"])
+    Require a valid, non-revoked access token.
 
-        return decoded_token.get("jti")  # Extract the 'jti' field
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
-
-def is_token_blacklisted(token: str) -> bool:
-    """
-    Check if the given token's jti is blacklisted.
+    When @jwt_required() has already run, its decoded payload (and the
+    blocklist check done while decoding it) is reused, so the token is only
+    decoded once per request.
     """
-    from app.models import BlacklistedToken  # Import here to avoid circular import
-    
-    jti = extract_jti(token)
-    if not jti:
-        return True  # Token is invalid or expired, treat it as blacklisted
-
-    # Check if the jti exists in the database
-    blacklisted = BlacklistedToken.query.filter_by(jti=jti).first()
-    return blacklisted is not None
-
-def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
@@ -40,13 +21,122 @@ def token_required(f):
         if not token:
             return jsonify({"message": "Token is missing!"}), 401
 
-        # Remove 'Bearer ' prefix if it exists
-        if token.startswith("Bearer "):
-            token = token.split(" ")[1]
-
-        # Check if token is blacklisted
-        if is_token_blacklisted(token):
-            return jsonify({"message": "Unauthorized!: User has been logged out"}), 401
+        try:
+            get_jwt()
+        except RuntimeError:
+            # Not decoded yet: decode it here, which also runs the revocation check
+            try:
+                verify_jwt_in_request()
+            except (JWTExtendedException, PyJWTError):
+                return jsonify({"message": "Unauthorized!: User has been logged out"}), 401
 
         return f(*args, **kwargs)
     return decorated
+
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header on write requests.
+
+    The first request with a key runs normally and its response is stored;
+    a retry with the same key and body gets the stored response back (with
+    an Idempotent-Replayed header) without the view running again. Reusing
+    a key for a different request is a 422, and a retry that arrives while
+    the first request is still running is a 409. Responses with a 5xx
+    status are not stored, so the request can be retried. Apply after
+    @jwt_required() and @token_required; keys are scoped to the user.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"message": "Idempotency-Key must be at most 255 characters"}), 400
+
+        store = current_app.extensions['idempotency']
+        user_id = int(get_jwt_identity())
+        request_hash = store.request_hash(request.method, request.path, request.get_data())
+
+        outcome, stored = store.begin(user_id, key, request_hash)
+        if outcome == store.MISMATCH:
+            return jsonify({"message": "Idempotency-Key was already used for a different request"}), 422
+        if outcome == store.IN_PROGRESS:
+            return jsonify({"message": "A request with this Idempotency-Key is still being processed"}), 409
+        if outcome == store.REPLAY:
+            status_code, body = stored
+            response = current_app.response_class(body, status=status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            store.release(user_id, key)
+            raise
+
+        if response.status_code >= 500:
+            store.release(user_id, key)
+        else:
+            store.complete(user_id, key, request_hash, response.status_code, response.get_data(as_text=True))
+        return response
+    return decorated
+
+def conditional(*tables, refresh_every=None, max_age=0):
+    """
+    Answer conditional GETs for a view whose response only depends on the
+    given tables, the request URL and the user.
+
+    The ETag is built from the tables' change counters (table_versions), so
+    a matching If-None-Match gets a 304 before the view runs, for the price
+    of one primary-key lookup. Views whose result also moves with the clock
+    (e.g. "the last 7 days") pass refresh_every seconds so the ETag changes
+    at least that often. max_age lets clients reuse a response without
+    asking for that many seconds. Apply after @jwt_required().
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            from app.utils.table_versions import get_table_versions
+
+            versions = get_table_versions(tables)
+            validator = [request.full_path, str(get_jwt_identity())]
+            validator += [f'{name}={versions[name]}' for name in sorted(versions)]
+            if refresh_every:
+                validator.append(str(int(time.time() // refresh_every)))
+            etag = hashlib.sha1('|'.join(validator).encode()).hexdigest()
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = f'private, max-age={max_age}' if max_age else 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
+        return decorated
+    return decorator
+
+def read_replica(*tables):
+    """
+    Run a read-only view against the read replica (SQLALCHEMY_REPLICA_URI)
+    when it has applied every committed write to the given tables, and
+    against the primary otherwise, so what a user just wrote is always in
+    what they read next. Costs one primary-key lookup on each database;
+    without a replica it does nothing. Apply after @conditional, so a 304
+    never touches the replica.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                from app.utils.replica import use_replica
+
+                use_replica(tables)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
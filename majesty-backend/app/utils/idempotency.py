@@ -0,0 +1,188 @@
+# app/utils/idempotency.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+
+class IdempotencyStore:
+    """
+    Remembers the response to requests sent with an Idempotency-Key header.
+
+    The first request with a key claims a row in idempotency_keys (committed
+    on its own connection, so a concurrent retry sees it straight away) and
+    stores its response there once it has finished. A retry within
+    IDEMPOTENCY_TTL_SECONDS gets that response back without the view being
+    run again. Finished responses are also kept in a small per-process LRU
+    of IDEMPOTENCY_CACHE_SIZE entries, so most retries never reach the
+    database. A claim that has not finished within IDEMPOTENCY_LEASE_SECONDS
+    (its worker crashed or was killed) is taken over by the next retry;
+    keep the lease longer than the gunicorn worker timeout.
+    """
+
+    # Outcomes of begin()
+    PROCEED = 'proceed'
+    REPLAY = 'replay'
+    IN_PROGRESS = 'in_progress'
+    MISMATCH = 'mismatch'
+
+    def __init__(self, app=None):
+        self.ttl = timedelta(hours=24)
+        self.lease = timedelta(seconds=120)
+        self.cache_size = 1024
+        self._cache = OrderedDict()  # (user_id, key) -> (request_hash, status_code, body, expires_at)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = timedelta(seconds=app.config.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+        self.lease = timedelta(seconds=app.config.get('IDEMPOTENCY_LEASE_SECONDS', 120))
+        self.cache_size = app.config.get('IDEMPOTENCY_CACHE_SIZE', 1024)
+        app.extensions['idempotency'] = self
+
+    @staticmethod
+    def request_hash(method, path, body):
+        digest = hashlib.sha256()
+        digest.update(f'{method} {path}\n'.encode())
+        digest.update(body or b'')
+        return digest.hexdigest()
+
+    def begin(self, user_id, key, request_hash):
+        """
+        Claim key for user_id. Returns (outcome, stored) where stored is
+        (status_code, body) for REPLAY and None otherwise.
+        """
+        cached = self._cache_get((user_id, key))
+        if cached is not None:
+            cached_hash, status_code, body = cached
+            if cached_hash != request_hash:
+                return self.MISMATCH, None
+            return self.REPLAY, (status_code, body)
+
+        from app import db
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        now = datetime.utcnow()
+        for _ in range(2):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(table.insert().values(
+                        user_id=user_id, key=key, request_hash=request_hash,
+                        created_at=now, claimed_at=now, expires_at=now + self.ttl
+                    ))
+                return self.PROCEED, None
+            except IntegrityError:
+                pass
+
+            with db.engine.begin() as conn:
+                row = conn.execute(
+                    db.select(table.c.request_hash, table.c.status_code, table.c.response_body,
+                              table.c.claimed_at, table.c.expires_at)
+                    .where(table.c.user_id == user_id, table.c.key == key)
+                ).first()
+                if row is not None and row.expires_at <= now:
+                    # Expired but not purged yet: treat the key as new
+                    conn.execute(table.delete().where(table.c.user_id == user_id, table.c.key == key))
+                    continue
+
+            if row is None:
+                continue
+            if row.request_hash != request_hash:
+                return self.MISMATCH, None
+            if row.status_code is None:
+                if row.claimed_at > now - self.lease:
+                    return self.IN_PROGRESS, None
+                # The claim outlived its lease, so its request died: take it over,
+                # unless another retry got there first
+                with db.engine.begin() as conn:
+                    taken = conn.execute(table.update().where(
+                        table.c.user_id == user_id, table.c.key == key,
+                        table.c.status_code.is_(None), table.c.claimed_at == row.claimed_at
+                    ).values(claimed_at=now)).rowcount
+                return (self.PROCEED if taken else self.IN_PROGRESS), None
+            self._cache_put((user_id, key), (row.request_hash, row.status_code, row.response_body, row.expires_at))
+            return self.REPLAY, (row.status_code, row.response_body)
+
+        return self.IN_PROGRESS, None
+
+    def complete(self, user_id, key, request_hash, status_code, body):
+        """Store the response for a claimed key."""
+        from app import db
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(
+                table.c.user_id == user_id, table.c.key == key
+            ).values(status_code=status_code, response_body=body))
+        self._cache_put((user_id, key), (request_hash, status_code, body, datetime.utcnow() + self.ttl))
+
+    def release(self, user_id, key):
+        """Drop a claim whose request failed, so the client can retry it."""
+        from app import db
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(
+                table.c.user_id == user_id, table.c.key == key, table.c.status_code.is_(None)
+            ))
+
+    def _cache_get(self, cache_key):
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                return None
+            if entry[3] <= datetime.utcnow():
+                del self._cache[cache_key]
+                return None
+            self._cache.move_to_end(cache_key)
+            return entry[:3]
+
+    def _cache_put(self, cache_key, entry):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[cache_key] = entry
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def get_idempotency_store():
+    return current_app.extensions['idempotency']
+
+
+def purge_expired_idempotency_keys(batch_size=1000):
+    """
+    Delete idempotency keys past their expiry, batch_size rows at a time.
+    Returns (rows_removed, elapsed_seconds).
+    """
+    from app import db
+    from app.models import IdempotencyKey
+
+    started = time.monotonic()
+    now = datetime.utcnow()
+
+    removed = 0
+    while True:
+        ids = [row_id for (row_id,) in db.session.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at < now
+        ).limit(batch_size)]
+        if not ids:
+            break
+        db.session.query(IdempotencyKey).filter(
+            IdempotencyKey.id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        removed += len(ids)
+        if len(ids) < batch_size:
+            break
+
+    return removed, time.monotonic() - started
@@ -0,0 +1,508 @@
+# app/utils/inventory.py
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import bindparam, func
+
+from app.utils.retry import retry_on_conflict
+
+
+class StockError(ValueError):
+    """
+    A checkout line that cannot be fulfilled. status_code is 404 when the
+    product does not exist and 400 when there is not enough stock.
+    product_id is None when no single product can be blamed.
+    """
+
+    def __init__(self, message, product_id, status_code=400):
+        super().__init__(message)
+        self.product_id = product_id
+        self.status_code = status_code
+
+
+def aggregate_lines(lines):
+    """
+    Merge (product_id, quantity) lines into {product_id: quantity}.
+    Raises ValueError for non-positive or non-integer quantities.
+    """
+    quantities = {}
+    for product_id, quantity in lines:
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError(f'Invalid quantity for product {product_id}')
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + quantity
+    if not quantities:
+        raise ValueError('No items to check out')
+    return quantities
+
+
+def reserve_stock(quantities, locked_rows=None):
+    """
+    Decrement in_stock for every product in {product_id: quantity} within
+    the current transaction and return {product_id: (name, price)}.
+
+    Products are locked with one SELECT ... FOR UPDATE in id order, so two
+    checkouts touching the same products queue up instead of deadlocking;
+    pass locked_rows (with id, name, price and in_stock) if the caller has
+    already locked them. SQLite has no row locks; there the decrement is a
+    conditional UPDATE that only applies while enough stock is left, which
+    takes the database write lock before prices are read. Raises
+    StockError; the caller must roll back.
+    """
+    from app import db
+    from app.models import Product
+
+    product_ids = sorted(quantities)
+    products = Product.__table__
+    params = [{'product_id': product_id, 'quantity': quantities[product_id]} for product_id in product_ids]
+    decrement = products.update().where(
+        products.c.id == bindparam('product_id'),
+        products.c.in_stock >= bindparam('quantity')
+    ).values(in_stock=products.c.in_stock - bindparam('quantity'))
+
+    select_products = db.select(
+        products.c.id, products.c.name, products.c.price, products.c.in_stock
+    ).where(products.c.id.in_(product_ids)).order_by(products.c.id)
+
+    if is_sqlite():
+        result = db.session.execute(decrement, params)
+        if result.rowcount != len(params):
+            # Some line was short; undo the lines that went through and report which
+            db.session.rollback()
+            _check_stock(quantities, db.session.execute(select_products).all())
+            # Every line fits again (a competing sale rolled back): no product to blame
+            raise StockError('Not enough stock', None)
+        rows = db.session.execute(select_products).all()
+    else:
+        rows = locked_rows
+        if rows is None:
+            rows = db.session.execute(select_products.with_for_update()).all()
+        _check_stock(quantities, rows)
+        db.session.execute(decrement, params)
+
+    return {row.id: (row.name, row.price) for row in rows}
+
+
+def lock_products(product_ids):
+    """
+    Lock the given products until the transaction ends and return their
+    (id, name, in_stock) rows in id order, read under the lock. Outside
+    SQLite this is one SELECT ... FOR UPDATE. SQLite has no row locks, so a
+    no-op UPDATE of the rows first takes the database write lock, as the
+    decrement in reserve_stock does; no other transaction can then change
+    stock before this one ends.
+    """
+    from app import db
+    from app.models import Product
+
+    products = Product.__table__
+    product_ids = sorted(product_ids)
+    select_products = db.select(
+        products.c.id, products.c.name, products.c.in_stock
+    ).where(products.c.id.in_(product_ids)).order_by(products.c.id)
+
+    if is_sqlite():
+        db.session.execute(products.update().where(
+            products.c.id.in_(product_ids)
+        ).values(in_stock=products.c.in_stock))
+        return db.session.execute(select_products).all()
+    return db.session.execute(select_products.with_for_update()).all()
+
+
+def is_sqlite():
+    from app import db
+    return db.session.get_bind().dialect.name == 'sqlite'
+
+
+def _check_stock(quantities, rows):
+    found = {row.id: row for row in rows}
+    for product_id, quantity in quantities.items():
+        row = found.get(product_id)
+        if row is None:
+            raise StockError(f'product {product_id} not found', product_id, status_code=404)
+        if row.in_stock < quantity:
+            raise StockError(f'Not enough stock for product {row.name}', product_id)
+
+
+def _record_invoice(user_id, quantities, products):
+    """
+    Insert the invoice, with total_amount the sum of its lines, and
+    bulk-insert its items at the reserved prices, add them to the
+    daily_sales rollup and record the stock movements. Does not commit.
+    """
+    from app import db
+    from app.models import Invoice, InvoiceItem, DailySales, StockMovement
+
+    total_amount = sum(
+        (Decimal(str(products[product_id][1])) * quantity for product_id, quantity in quantities.items()),
+        Decimal('0')
+    )
+    invoice = Invoice(
+        user_id=user_id,
+        total_amount=total_amount,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(invoice)
+    db.session.flush()
+
+    items = [{
+        'invoice_id': invoice.id,
+        'product_id': product_id,
+        'quantity': quantity,
+        'price': products[product_id][1]
+    } for product_id, quantity in quantities.items()]
+    db.session.execute(InvoiceItem.__table__.insert(), items)
+
+    DailySales.apply_invoice(user_id, invoice.created_at, [
+        (item['product_id'], item['quantity'], item['price']) for item in items
+    ])
+    StockMovement.record(({
+        'product_id': item['product_id'],
+        'delta': -item['quantity'],
+        'reason': 'sale',
+        'invoice_id': invoice.id,
+    } for item in items), user_id)
+    return invoice
+
+
+@retry_on_conflict
+def create_invoice(user_id, lines):
+    """
+    Check out (product_id, quantity) lines for user_id as one transaction:
+    lock and decrement stock, insert the invoice, bulk-insert its items at
+    the current product prices, update the daily_sales rollup and commit.
+
+    total_amount is the sum of the lines, like the rollup's revenue, so the
+    two never disagree. Returns the new Invoice. Raises StockError or
+    ValueError after rolling back.
+    """
+    from app import db
+
+    try:
+        quantities = aggregate_lines(lines)
+        products = reserve_stock(quantities)
+        invoice = _record_invoice(user_id, quantities, products)
+        db.session.commit()
+        return invoice
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+@retry_on_conflict
+def checkout_cart(user_id):
+    """
+    Check out everything in user_id's cart as one transaction. The cart rows
+    and their products are read (and locked, outside SQLite) in one query,
+    the total is computed from current prices, and the cart is emptied in
+    the same commit as the invoice. Returns the new Invoice.
+    Raises StockError, or ValueError if the cart is empty or was checked
+    out concurrently, after rolling back.
+    """
+    from app import db
+    from app.models import Cart, Product
+
+    try:
+        query = db.select(
+            Cart.id.label('cart_item_id'), Cart.quantity,
+            Product.id, Product.name, Product.price, Product.in_stock
+        ).join(Product, Product.id == Cart.product_id).where(
+            Cart.user_id == user_id
+        ).order_by(Product.id)
+        if not is_sqlite():
+            query = query.with_for_update(of=[Cart.__table__, Product.__table__])
+        rows = db.session.execute(query).all()
+        if not rows:
+            raise ValueError('Cart is empty')
+
+        quantities = {row.id: row.quantity for row in rows}
+        products = reserve_stock(quantities, locked_rows=rows)
+        invoice = _record_invoice(user_id, quantities, products)
+
+        cart_item_ids = [row.cart_item_id for row in rows]
+        cleared = db.session.execute(
+            Cart.__table__.delete().where(Cart.__table__.c.id.in_(cart_item_ids))
+        ).rowcount
+        if cleared != len(cart_item_ids):
+            raise ValueError('Cart changed during checkout')
+
+        db.session.commit()
+        return invoice
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def parse_adjustments(adjustments, default_reason=None):
+    """
+    Validate stock adjustment lines. Each line has a product_id and either a
+    delta (received or written-off units) or a count (absolute level from a
+    stocktake), plus an optional reason. Returns a list of
+    {product_id, delta, count, reason}. Raises ValueError.
+    """
+    if not isinstance(adjustments, list) or not adjustments:
+        raise ValueError('adjustments must be a non-empty list')
+
+    lines = []
+    seen = set()
+    for index, adjustment in enumerate(adjustments, start=1):
+        if not isinstance(adjustment, dict):
+            raise ValueError(f'Line {index}: must be an object')
+        product_id = adjustment.get('product_id')
+        if isinstance(product_id, bool) or not isinstance(product_id, int):
+            raise ValueError(f'Line {index}: product_id must be an integer')
+        if product_id in seen:
+            raise ValueError(f'Line {index}: product {product_id} appears more than once')
+        seen.add(product_id)
+
+        delta, count = adjustment.get('delta'), adjustment.get('count')
+        if (delta is None) == (count is None):
+            raise ValueError(f'Line {index}: give exactly one of delta or count')
+        value = delta if count is None else count
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f'Line {index}: delta and count must be integers')
+        if count is not None and count < 0:
+            raise ValueError(f'Line {index}: count must not be negative')
+
+        reason = adjustment.get('reason', default_reason)
+        lines.append({
+            'product_id': product_id,
+            'delta': delta,
+            'count': count,
+            'reason': str(reason)[:255] if reason is not None else None,
+        })
+    return lines
+
+
+def apply_stock_adjustments(lines, user_id=None):
+    """
+    Apply parsed adjustment lines in the current transaction: one locking
+    read of the products (see lock_products), one executemany UPDATE for
+    deltas and one for counts, one read of the new levels and one insert
+    into the stock ledger. A delta may not take stock below zero. Counts
+    are turned into ledger deltas against the level read under the lock,
+    so a sale committing meanwhile cannot make the ledger disagree with
+    in_stock. Returns [{product_id, name, previous, in_stock}] in product
+    id order. Raises StockError; does not commit.
+    """
+    from app import db
+    from app.models import Product, StockMovement
+
+    products = Product.__table__
+    product_ids = sorted(line['product_id'] for line in lines)
+    select_products = db.select(
+        products.c.id, products.c.name, products.c.in_stock
+    ).where(products.c.id.in_(product_ids)).order_by(products.c.id)
+
+    before = {row.id: row for row in lock_products(product_ids)}
+
+    for line in lines:
+        row = before.get(line['product_id'])
+        if row is None:
+            raise StockError(f"product {line['product_id']} not found", line['product_id'], status_code=404)
+        if line['delta'] is not None and row.in_stock + line['delta'] < 0:
+            raise StockError(f'Not enough stock for product {row.name}', row.id)
+
+    deltas = [{'product_id': line['product_id'], 'delta': line['delta']} for line in lines if line['delta'] is not None]
+    counts = [{'product_id': line['product_id'], 'count': line['count']} for line in lines if line['count'] is not None]
+
+    if deltas:
+        db.session.execute(products.update().where(
+            products.c.id == bindparam('product_id')
+        ).values(in_stock=products.c.in_stock + bindparam('delta')), deltas)
+    if counts:
+        db.session.execute(products.update().where(
+            products.c.id == bindparam('product_id')
+        ).values(in_stock=bindparam('count')), counts)
+
+    after = db.session.execute(select_products).all()
+    StockMovement.record(({
+        'product_id': line['product_id'],
+        'delta': line['delta'] if line['delta'] is not None else line['count'] - before[line['product_id']].in_stock,
+        'reason': line['reason'] or ('adjustment' if line['delta'] is not None else 'stocktake'),
+    } for line in lines), user_id)
+    return [{
+        'product_id': row.id,
+        'name': row.name,
+        'previous': before[row.id].in_stock,
+        'in_stock': row.in_stock,
+    } for row in after]
+
+
+def shift_stock(deltas):
+    """
+    Add {product_id: delta} to in_stock in one executemany UPDATE, in
+    product id order. Negative deltas only apply while enough stock is left;
+    outside SQLite the affected products are locked and checked first.
+    Raises StockError; the caller must roll back.
+    """
+    from app import db
+    from app.models import Product
+
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    products = Product.__table__
+    product_ids = sorted(deltas)
+    if not is_sqlite():
+        rows = db.session.execute(
+            db.select(products.c.id, products.c.name, products.c.in_stock)
+            .where(products.c.id.in_(product_ids)).order_by(products.c.id).with_for_update()
+        ).all()
+        _check_stock({row_id: -delta for row_id, delta in deltas.items() if delta < 0}, rows)
+
+    params = [{'product_id': product_id, 'delta': deltas[product_id]} for product_id in product_ids]
+    result = db.session.execute(products.update().where(
+        products.c.id == bindparam('product_id'),
+        products.c.in_stock + bindparam('delta') >= 0
+    ).values(in_stock=products.c.in_stock + bindparam('delta')), params)
+
+    if db.session.get_bind().dialect.supports_sane_multi_rowcount and result.rowcount != len(params):
+        # Find the line that did not apply, for the error message
+        rows = db.session.execute(
+            db.select(products.c.id, products.c.name, products.c.in_stock)
+            .where(products.c.id.in_(product_ids))
+        ).all()
+        _check_stock({row_id: 1 for row_id in deltas}, rows)
+        short = [row for row in rows if row.in_stock + deltas[row.id] < 0]
+        if short:
+            raise StockError(f'Not enough stock for product {short[0].name}', short[0].id)
+        raise StockError('Not enough stock', None)
+
+
+@retry_on_conflict
+def update_invoice(invoice, new_items, user_id=None, fields=None):
+    """
+    Replace invoice's items with new_items ({product_id, quantity} dicts) as
+    a diff in one transaction, and set the columns in fields (notes, status)
+    in the same one, so a retry applies them again. Only products whose quantity changed have
+    their stock moved (one batched UPDATE), their invoice_items rows
+    updated, inserted or deleted, their daily_sales rows adjusted and a
+    stock movement recorded. Lines that stay keep the price they were sold
+    at; new lines are priced from products. total_amount is recomputed from
+    the resulting items. new_items=None only recomputes the total.
+    Raises StockError or ValueError after rolling back.
+    """
+    from app import db
+    from app.models import Invoice, InvoiceItem, Product, DailySales, StockMovement
+
+    items = InvoiceItem.__table__
+    try:
+        if not is_sqlite():
+            db.session.execute(db.select(Invoice.id).where(Invoice.id == invoice.id).with_for_update())
+
+        for column, value in (fields or {}).items():
+            setattr(invoice, column, value)
+
+        old_rows = db.session.execute(
+            db.select(items.c.id, items.c.product_id, items.c.quantity, items.c.price)
+            .where(items.c.invoice_id == invoice.id).order_by(items.c.id)
+        ).all()
+        old = {}
+        for row in old_rows:
+            old.setdefault(row.product_id, []).append(row)
+
+        if new_items is not None:
+            new = aggregate_lines((item['product_id'], item['quantity']) for item in new_items)
+            old_quantities = {product_id: sum(row.quantity for row in rows) for product_id, rows in old.items()}
+            changed = sorted(
+                product_id for product_id in set(old) | set(new)
+                if old_quantities.get(product_id, 0) != new.get(product_id, 0)
+            )
+
+            if changed:
+                shift_stock({
+                    product_id: old_quantities.get(product_id, 0) - new.get(product_id, 0)
+                    for product_id in changed
+                })
+
+                added = [product_id for product_id in changed if product_id not in old]
+                prices = dict(db.session.execute(
+                    db.select(Product.id, Product.price).where(Product.id.in_(added))
+                ).all()) if added else {}
+                missing = [product_id for product_id in added if product_id not in prices]
+                if missing:
+                    raise StockError(f'product {missing[0]} not found', missing[0], status_code=404)
+
+                removed_lines, added_lines = [], []
+                deletes, updates, inserts = [], [], []
+                for product_id in changed:
+                    rows = old.get(product_id, [])
+                    price = rows[0].price if rows else prices[product_id]
+                    removed_lines.extend((product_id, row.quantity, row.price) for row in rows)
+                    quantity = new.get(product_id, 0)
+                    if quantity:
+                        added_lines.append((product_id, quantity, price))
+
+                    if not quantity:
+                        deletes.extend(row.id for row in rows)
+                    elif rows:
+                        # Merge any duplicate lines for the product into the first one
+                        updates.append({'item_id': rows[0].id, 'quantity': quantity})
+                        deletes.extend(row.id for row in rows[1:])
+                    else:
+                        inserts.append({'invoice_id': invoice.id, 'product_id': product_id,
+                                        'quantity': quantity, 'price': price})
+
+                if deletes:
+                    db.session.execute(items.delete().where(items.c.id.in_(deletes)))
+                if updates:
+                    db.session.execute(items.update().where(
+                        items.c.id == bindparam('item_id')
+                    ).values(quantity=bindparam('quantity')), updates)
+                if inserts:
+                    db.session.execute(items.insert(), inserts)
+
+                DailySales.apply_invoice(invoice.user_id, invoice.created_at, removed_lines, sign=-1)
+                DailySales.apply_invoice(invoice.user_id, invoice.created_at, added_lines)
+                StockMovement.record(({
+                    'product_id': product_id,
+                    'delta': old_quantities.get(product_id, 0) - new.get(product_id, 0),
+                    'reason': 'invoice_update',
+                    'invoice_id': invoice.id,
+                } for product_id in changed), user_id)
+
+        invoice.total_amount = db.session.execute(
+            db.select(func.coalesce(func.sum(items.c.quantity * items.c.price), 0))
+            .where(items.c.invoice_id == invoice.id)
+        ).scalar()
+        db.session.commit()
+        return invoice
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+@retry_on_conflict
+def delete_invoice(invoice, user_id=None):
+    """
+    Delete invoice and its items in one transaction, returning the sold
+    units to stock and taking them out of the daily_sales rollup.
+    """
+    from app import db
+    from app.models import Invoice, InvoiceItem, DailySales, StockMovement
+
+    items = InvoiceItem.__table__
+    try:
+        rows = db.session.execute(
+            db.select(items.c.product_id, items.c.quantity, items.c.price).where(items.c.invoice_id == invoice.id)
+        ).all()
+        returned = {}
+        for row in rows:
+            returned[row.product_id] = returned.get(row.product_id, 0) + row.quantity
+
+        shift_stock(returned)
+        DailySales.apply_invoice(invoice.user_id, invoice.created_at, rows, sign=-1)
+        StockMovement.record(({
+            'product_id': product_id,
+            'delta': quantity,
+            'reason': 'invoice_delete',
+            'invoice_id': invoice.id,
+        } for product_id, quantity in returned.items()), user_id)
+
+        db.session.execute(items.delete().where(items.c.invoice_id == invoice.id))
+        db.session.execute(Invoice.__table__.delete().where(Invoice.__table__.c.id == invoice.id))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
@@ -1,8 +1,9 @@
 # app/utils/logger.py
 from datetime import datetime
-from flask import request, g, has_request_context
+from flask import request, g, has_request_context, current_app
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 import traceback
+import time
 import json
 import os
 import logging # Import logEntry from the models
@@ -70,12 +71,13 @@ def setup_logger(app):
     
     return logger
 
-def log_action(user_id, action, message, additional_data=None, save_to_db=True, level='info', affected_name=None):
+def log_action(user_id, action, message, additional_data=None, save_to_db=True, level='info', affected_name=None,
+               invoice_id=None, product_id=None):
     """
     Log user actions with detailed information including acting user and affected entity.
+    invoice_id / product_id link the entry to the invoice or product it concerns.
+    Database rows are written asynchronously by the app's AuditWriter.
     """
-    from app import db 
-    from app.models import logEntry, User  # Added User import
     logger = logging.getLogger('wine_inventory')
     
     # Build log data object
@@ -110,34 +112,32 @@ def log_action(user_id, action, message, additional_data=None, save_to_db=True,
     log_method = getattr(logger, level.lower())
     log_method(log_message)
     
-    # Save to database if requested
+    # Hand the row to the background audit writer if requested
     if save_to_db:
         try:
-            # Get acting username
-            acting_username = None
-            if user_id:
-                user = User.query.get(user_id)
-                acting_username = user.username if user else None
+            try:
+                user_id = int(user_id) if user_id is not None else None
+            except (TypeError, ValueError):
+                pass
 
-            # Create log entry with additional fields
-            log_entry = logEntry(
-                user_id=user_id,
-                acting_username=acting_username,
-                action=action,
-                message=message,
-                affected_name=affected_name,
-                ip_address=log_data.get('ip_address'),
-                user_agent=log_data.get('user_agent'),
-                endpoint=log_data.get('endpoint'),
-                method=log_data.get('method'),
-                additional_data=json.dumps(additional_data) if additional_data else None,
-                status_code=getattr(g, 'status_code', None) if has_request_context() else None
-            )
-            db.session.add(log_entry)
-            db.session.commit()
+            log_entry = {
+                'timestamp': datetime.utcnow(),
+                'user_id': user_id,
+                'action': action,
+                'message': message,
+                'affected_name': affected_name,
+                'invoice_id': invoice_id,
+                'product_id': product_id,
+                'ip_address': log_data.get('ip_address'),
+                'user_agent': log_data.get('user_agent'),
+                'endpoint': log_data.get('endpoint'),
+                'method': log_data.get('method'),
+                'additional_data': json.dumps(additional_data) if additional_data else None,
+                'status_code': getattr(g, 'status_code', None) if has_request_context() else None,
+            }
+            current_app.extensions['audit_writer'].enqueue(log_entry)
         except Exception as e:
-            db.session.rollback()
-            logger.error(f"Failed to save log entry to database: {str(e)}")
+            logger.error(f"Failed to queue log entry: {str(e)}")
             logger.debug(traceback.format_exc())
     
     return log_data
@@ -155,7 +155,15 @@ def log_response(response):
     if has_request_context():
         g.status_code = response.status_code
     
-    logger.debug(f"Response: {response.status_code}")
+    metrics = g.get('request_metrics') if has_request_context() else None
+    if metrics is not None:
+        started, queries, sql_seconds = metrics
+        logger.debug(
+            f"Response: {response.status_code} for {request.method} {request.path} in "
+            f"{(time.perf_counter() - started) * 1000:.1f}ms, {queries} queries ({sql_seconds * 1000:.1f}ms)"
+        )
+    else:
+        logger.debug(f"Response: {response.status_code}")
     return response
 
 # Error logging
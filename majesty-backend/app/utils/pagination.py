@@ -1,5 +1,12 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
 from math import ceil
 
+from sqlalchemy import tuple_
+
 def paginate_query(query, page, per_page):
     """
     Paginate a SQLAlchemy query.
@@ -11,7 +18,117 @@ def paginate_query(query, page, per_page):
     items = query.limit(per_page).offset((page - 1) * per_page).all()
     total = query.order_by(None).count()  # More efficient count without ordering
     pages = ceil(total / per_page) if per_page else 1
-    
-    from collections import namedtuple
+
     Pagination = namedtuple('Pagination', ['items', 'total', 'pages'])
-    return Pagination(items=items, total=total, pages=pages)
\ No newline at end of file
+    return Pagination(items=items, total=total, pages=pages)
+
+
+CursorPage = namedtuple('CursorPage', ['items', 'next_cursor', 'approximate_total'])
+
+
+def encode_cursor(sort_value, row_id):
+    """
+    Encode the position after (sort_value, row_id) as an opaque URL-safe string.
+    """
+    if isinstance(sort_value, datetime):
+        value = {'t': 'datetime', 'v': sort_value.isoformat()}
+    elif isinstance(sort_value, date):
+        value = {'t': 'date', 'v': sort_value.isoformat()}
+    elif isinstance(sort_value, Decimal):
+        value = {'t': 'decimal', 'v': str(sort_value)}
+    else:
+        value = {'t': 'raw', 'v': sort_value}
+    payload = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor. Raises ValueError for a malformed cursor.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, row_id = json.loads(payload)
+        kind, raw = value['t'], value['v']
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if kind == 'datetime':
+        return datetime.fromisoformat(raw), row_id
+    if kind == 'date':
+        return date.fromisoformat(raw), row_id
+    if kind == 'decimal':
+        return Decimal(raw), row_id
+    return raw, row_id
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, limit=50, descending=True, with_total=False):
+    """
+    Paginate a query by (sort_column, id_column) instead of LIMIT/OFFSET, so
+    every page costs the same index range scan however deep it is.
+
+    Returns a CursorPage with:
+    - items: current page items
+    - next_cursor: opaque cursor for the following page, or None on the last page
+    - approximate_total: row estimate for the unpaginated query if with_total, else None
+    """
+    approximate_total = approximate_count(query) if with_total else None
+
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor)
+        position = tuple_(sort_column, id_column)
+        if descending:
+            query = query.filter(position < tuple_(sort_value, last_id))
+        else:
+            query = query.filter(position > tuple_(sort_value, last_id))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+    return CursorPage(items=items, next_cursor=next_cursor, approximate_total=approximate_total)
+
+
+def approximate_count(query):
+    """
+    Estimated row count for a query. On PostgreSQL this is the planner's
+    estimate from EXPLAIN, which does not scan the table; other databases
+    fall back to an exact COUNT.
+    """
+    from sqlalchemy import text
+    from app import db
+
+    bind = db.session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return query.order_by(None).count()
+
+    statement = query.order_by(None).statement.compile(
+        dialect=bind.dialect, compile_kwargs={'literal_binds': True}
+    )
+    plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {statement}')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def cursor_args(args, default_limit=50, max_limit=200):
+    """
+    Read limit, cursor and include_total from request args.
+    Raises ValueError for out-of-range values.
+    """
+    limit = int(args.get('limit', default_limit))
+    if limit < 1 or limit > max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+    cursor = args.get('cursor') or None
+    if cursor:
+        decode_cursor(cursor)
+    include_total = args.get('include_total', 'false').lower() == 'true'
+    return limit, cursor, include_total
@@ -0,0 +1,162 @@
+# app/utils/product_import.py
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+FORMATS = ('json', 'ndjson', 'csv')
+
+# Columns an import may set, besides category / category_id
+IMPORT_COLUMNS = ('name', 'abv', 'price', 'bottle_size', 'in_stock', 'reorder_level', 'image_url')
+REQUIRED_COLUMNS = ('name', 'price', 'bottle_size')
+MAX_ERRORS = 100
+
+
+def detect_format(content_type, filename=None):
+    """Guess the import format from a Content-Type or file extension."""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonlines'):
+        return 'ndjson'
+    if filename:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension in ('csv',):
+            return 'csv'
+        if extension in ('ndjson', 'jsonl'):
+            return 'ndjson'
+    return 'json'
+
+
+def parse_products(text, fmt):
+    """
+    Parse a product catalogue into a list of dicts. fmt is 'json' (an array,
+    or an object with a "products" array), 'ndjson' (one object per line)
+    or 'csv' (with a header row). Raises ValueError for malformed input.
+    """
+    if fmt == 'json':
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON: {e}')
+        if isinstance(data, dict):
+            data = data.get('products')
+        if not isinstance(data, list):
+            raise ValueError('Expected a JSON array of products')
+        records = data
+    elif fmt == 'ndjson':
+        records = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f'Invalid JSON on line {line_number}: {e}')
+    elif fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        # Empty CSV cells mean "not given"
+        records = [{key: value for key, value in row.items() if key and value not in (None, '')} for row in reader]
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+    if not all(isinstance(record, dict) for record in records):
+        raise ValueError('Every product must be an object')
+    return records
+
+
+def validate_products(records, categories):
+    """
+    Turn parsed records into products table rows.
+
+    categories maps both category ids and lower-cased category names to
+    category ids; a record gives either category_id or category. Returns
+    (groups, errors). groups maps a tuple of the IMPORT_COLUMNS a record
+    actually gave (the ones an upsert should overwrite) to its rows, and
+    errors is a list of {"row": n, "error": message}, capped at MAX_ERRORS.
+    A name that appears more than once keeps its last row.
+    """
+    rows = {}
+    errors = []
+
+    for index, record in enumerate(records, start=1):
+        try:
+            row = _validate_record(record, categories)
+        except ValueError as e:
+            errors.append({'row': index, 'error': str(e)})
+            if len(errors) >= MAX_ERRORS:
+                break
+            continue
+        columns = tuple(column for column in IMPORT_COLUMNS if record.get(column) not in (None, ''))
+        rows[row['name']] = (columns, row)
+
+    groups = {}
+    for columns, row in rows.values():
+        groups.setdefault(columns, []).append(row)
+    return groups, errors
+
+
+def _validate_record(record, categories):
+    for column in REQUIRED_COLUMNS:
+        if record.get(column) in (None, ''):
+            raise ValueError(f'{column} is required')
+
+    name = str(record['name']).strip()
+    if not name or len(name) > 50:
+        raise ValueError('name must be 1-50 characters')
+
+    if record.get('category_id') not in (None, ''):
+        category_id = categories.get(_to_int(record['category_id'], 'category_id'))
+    elif record.get('category') not in (None, ''):
+        category_id = categories.get(str(record['category']).strip().lower())
+    else:
+        raise ValueError('category_id or category is required')
+    if category_id is None:
+        raise ValueError('Invalid category')
+
+    try:
+        price = Decimal(str(record['price']))
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+    if price < 0:
+        raise ValueError('price must not be negative')
+
+    in_stock = record.get('in_stock')
+    in_stock = _to_int(in_stock, 'in_stock') if in_stock not in (None, '') else 0
+    if in_stock < 0:
+        raise ValueError('in_stock must not be negative')
+
+    reorder_level = record.get('reorder_level')
+    reorder_level = _to_int(reorder_level, 'reorder_level') if reorder_level not in (None, '') else 0
+    if reorder_level < 0:
+        raise ValueError('reorder_level must not be negative')
+
+    abv = record.get('abv')
+    if abv not in (None, ''):
+        try:
+            abv = float(abv)
+        except (TypeError, ValueError):
+            raise ValueError('abv must be a number')
+    else:
+        abv = None
+
+    return {
+        'name': name,
+        'abv': abv,
+        'price': price,
+        'category_id': category_id,
+        'bottle_size': _to_int(record['bottle_size'], 'bottle_size'),
+        'in_stock': in_stock,
+        'reorder_level': reorder_level,
+        'image_url': record.get('image_url') or None,
+    }
+
+
+def _to_int(value, column):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} must be a whole number')
+    if not number.is_integer():
+        raise ValueError(f'{column} must be a whole number')
+    return int(number)
@@ -0,0 +1,87 @@
+# app/utils/replica.py
+import logging
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+# Bind key of the read replica in SQLALCHEMY_BINDS (see app/utils/db_pool.py)
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    db.session, able to send reads to the read replica.
+
+    Once use_replica() has switched the session over, SELECTs go to the
+    replica. Everything else stays on the primary: flushes,
+    INSERT/UPDATE/DELETE, text() statements and session.connection(). So
+    does every read after the session has written something.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and clause is not None and self.info.get('use_replica')
+                and getattr(clause, 'is_select', False)
+                and not self._flushing and not self.info.get('written_tables')):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def has_replica():
+    return REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def replica_table_versions(tables):
+    """{table name: version} for tables as the replica has them."""
+    from app import db
+    from app.utils.table_versions import table_versions_query
+
+    versions = dict.fromkeys(tables, 0)
+    with db.engines[REPLICA_BIND].connect() as connection:
+        versions.update((name, int(version)) for name, version in connection.execute(table_versions_query(tables)))
+    return versions
+
+
+def use_replica(tables):
+    """
+    Send the rest of this request's reads to the replica, if there is one
+    and it has applied every committed write to tables. Otherwise they stay
+    on the primary, so a report opened right after a checkout still
+    includes that checkout. Returns True when the replica will be used.
+    """
+    from app import db
+    from app.utils.table_versions import get_table_versions
+
+    if not has_replica():
+        return False
+
+    primary = get_table_versions(tables)
+    try:
+        replica = replica_table_versions(tables)
+    except SQLAlchemyError as e:
+        logging.getLogger('wine_inventory').warning(f"Read replica unavailable, reading from the primary: {str(e)}")
+        return False
+    if any(replica[name] < version for name, version in primary.items()):
+        return False
+
+    db.session.info['use_replica'] = True
+    return True
+
+
+def sync_sqlite_replica():
+    """
+    Copy the primary SQLite database over the replica, standing in for
+    replication when trying out the replica routing with two SQLite files.
+    """
+    from app import db
+
+    primary, replica = db.engines[None], db.engines[REPLICA_BIND]
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise RuntimeError('Only SQLite primaries and replicas can be synced this way')
+
+    source, target = primary.raw_connection(), replica.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+    finally:
+        source.close()
+        target.close()
@@ -0,0 +1,249 @@
+# app/utils/request_metrics.py
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Upper bounds (seconds) of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the SQL-statements-per-request histogram; N+1 views land in the top ones
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class EndpointStats:
+    """Totals for one (endpoint, method) in one thread's shard."""
+
+    __slots__ = ('statuses', 'latency_buckets', 'latency_sum', 'query_buckets',
+                 'queries', 'sql_seconds', 'response_bytes')
+
+    def __init__(self):
+        self.statuses = {}
+        # One slot per bucket plus +Inf, not cumulative until rendered
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.query_buckets = [0] * (len(QUERY_BUCKETS) + 1)
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+
+
+class RequestMetrics:
+    """
+    Per-endpoint latency, status codes, response size and SQL cost.
+
+    Each request is timed from before_request to after_request, and every
+    statement run on one of the app's engines during it is counted and
+    timed from before/after_cursor_execute. Totals are kept per worker
+    process in one shard per OS thread, so recording never takes a lock;
+    a scrape adds the shards up. Under gevent all greenlets of a thread
+    share its shard, which is safe because they only switch on I/O.
+    Streamed responses are counted when their headers are sent, with the
+    bytes known at that point.
+    """
+
+    def __init__(self, app=None):
+        self._shards = {}  # native thread id -> {(endpoint, method): EndpointStats}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from app import db
+
+        app.extensions['request_metrics'] = self
+        if not app.config.get('REQUEST_METRICS', True):
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+                event.listen(engine, 'handle_error', _forget_failed_execute)
+
+    def record(self, endpoint, method, status, seconds, queries, sql_seconds, response_bytes):
+        shard = self._shards.get(threading.get_native_id())
+        if shard is None:
+            shard = self._new_shard()
+        stats = shard.get((endpoint, method))
+        if stats is None:
+            stats = shard[(endpoint, method)] = EndpointStats()
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.latency_sum += seconds
+        stats.query_buckets[bisect_left(QUERY_BUCKETS, queries)] += 1
+        stats.queries += queries
+        stats.sql_seconds += sql_seconds
+        stats.response_bytes += response_bytes
+
+    def totals(self):
+        """{(endpoint, method): EndpointStats} summed over every thread of this process."""
+        totals = {}
+        for shard in list(self._shards.values()):
+            for key, stats in list(shard.items()):
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = EndpointStats()
+                for status, count in list(stats.statuses.items()):
+                    total.statuses[status] = total.statuses.get(status, 0) + count
+                for index, count in enumerate(stats.latency_buckets):
+                    total.latency_buckets[index] += count
+                for index, count in enumerate(stats.query_buckets):
+                    total.query_buckets[index] += count
+                total.latency_sum += stats.latency_sum
+                total.queries += stats.queries
+                total.sql_seconds += stats.sql_seconds
+                total.response_bytes += stats.response_bytes
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._shards = {}
+            self._pid = os.getpid()
+
+    def _new_shard(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's counts are not ours
+                self._shards = {}
+                self._pid = os.getpid()
+            return self._shards.setdefault(threading.get_native_id(), {})
+
+    def _start(self):
+        g.request_metrics = [time.perf_counter(), 0, 0.0]  # started, queries, sql seconds
+
+    def _finish(self, response):
+        started, queries, sql_seconds = g.get('request_metrics', (None, 0, 0.0))
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self.record(endpoint, request.method, response.status_code, time.perf_counter() - started,
+                        queries, sql_seconds, response.calculate_content_length() or 0)
+        return response
+
+
+def get_request_metrics():
+    return current_app.extensions['request_metrics']
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context():
+        counters = g.get('request_metrics')
+        if counters is not None:
+            counters[1] += 1
+            counters[2] += time.perf_counter() - started
+
+
+def _forget_failed_execute(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def prometheus_text():
+    """This worker's request, pool and audit metrics in the Prometheus text format."""
+    from app import db
+    from app.utils.db_pool import WAIT_BUCKETS
+
+    worker = str(os.getpid())
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def sample(name, labels, value):
+        label_text = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        lines.append(f'{name}{{{label_text}}} {_number(value)}')
+
+    def histogram(name, labels, bounds, counts, total):
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            sample(f'{name}_bucket', dict(labels, le=_number(bound)), cumulative)
+        cumulative += counts[-1]
+        sample(f'{name}_bucket', dict(labels, le='+Inf'), cumulative)
+        sample(f'{name}_sum', labels, total)
+        sample(f'{name}_count', labels, cumulative)
+
+    totals = sorted(get_request_metrics().totals().items())
+
+    metric('wss_http_requests_total', 'counter', 'Requests handled, by endpoint, method and status.')
+    for (endpoint, method), stats in totals:
+        for status, count in sorted(stats.statuses.items()):
+            sample('wss_http_requests_total', {'worker': worker, 'endpoint': endpoint, 'method': method,
+                                               'status': status}, count)
+
+    metric('wss_http_request_duration_seconds', 'histogram', 'Time from before_request to after_request.')
+    for (endpoint, method), stats in totals:
+        histogram('wss_http_request_duration_seconds', {'worker': worker, 'endpoint': endpoint, 'method': method},
+                  LATENCY_BUCKETS, stats.latency_buckets, stats.latency_sum)
+
+    metric('wss_http_response_bytes_total', 'counter', 'Response body bytes, where the length was known.')
+    for (endpoint, method), stats in totals:
+        sample('wss_http_response_bytes_total', {'worker': worker, 'endpoint': endpoint, 'method': method},
+               stats.response_bytes)
+
+    metric('wss_db_queries_per_request', 'histogram', 'SQL statements run per request.')
+    for (endpoint, method), stats in totals:
+        histogram('wss_db_queries_per_request', {'worker': worker, 'endpoint': endpoint, 'method': method},
+                  QUERY_BUCKETS, stats.query_buckets, stats.queries)
+
+    metric('wss_db_query_seconds_total', 'counter', 'Time spent running SQL statements in requests.')
+    for (endpoint, method), stats in totals:
+        sample('wss_db_query_seconds_total', {'worker': worker, 'endpoint': endpoint, 'method': method},
+               stats.sql_seconds)
+
+    pools = [('primary', current_app.extensions['pool_stats'], db.engine.pool)]
+    if 'replica_pool_stats' in current_app.extensions:
+        pools.append(('replica', current_app.extensions['replica_pool_stats'], db.engines['replica'].pool))
+    snapshots = [(name, stats.snapshot(pool)) for name, stats, pool in pools]
+
+    metric('wss_db_pool_checkouts_total', 'counter', 'Connections handed out by the pool.')
+    for name, snapshot in snapshots:
+        sample('wss_db_pool_checkouts_total', {'worker': worker, 'pool': name}, snapshot['checkouts'])
+    metric('wss_db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection.')
+    for name, snapshot in snapshots:
+        sample('wss_db_pool_timeouts_total', {'worker': worker, 'pool': name}, snapshot['timeouts'])
+    metric('wss_db_pool_wait_seconds', 'histogram', 'Time spent waiting for a connection.')
+    for name, snapshot in snapshots:
+        counts = [bucket['count'] for bucket in snapshot['wait_buckets']]
+        # Every wait fits a bucket or timed out, so checkouts + timeouts is the count
+        overflow = snapshot['checkouts'] + snapshot['timeouts'] - sum(counts)
+        histogram('wss_db_pool_wait_seconds', {'worker': worker, 'pool': name}, WAIT_BUCKETS,
+                  counts + [max(overflow, 0)], snapshot['wait_seconds_total'])
+    for key, help_text in (('checked_out', 'Connections in use.'), ('idle', 'Connections open and idle.'),
+                           ('overflow', 'Connections open beyond pool_size.')):
+        metric(f'wss_db_pool_{key}', 'gauge', help_text)
+        for name, snapshot in snapshots:
+            if key in snapshot:
+                sample(f'wss_db_pool_{key}', {'worker': worker, 'pool': name}, snapshot[key])
+
+    audit = current_app.extensions.get('audit_writer')
+    if audit is not None:
+        audit_stats = audit.stats()
+        metric('wss_audit_entries_total', 'counter', 'Log entries written or dropped by the audit writer.')
+        for outcome in ('written', 'dropped'):
+            sample('wss_audit_entries_total', {'worker': worker, 'outcome': outcome}, audit_stats[outcome])
+        metric('wss_audit_queue_length', 'gauge', 'Log entries waiting to be written.')
+        sample('wss_audit_queue_length', {'worker': worker}, audit_stats['queued'])
+
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,49 @@
+# app/utils/retry.py
+import random
+import time
+from functools import wraps
+
+from flask import current_app, has_app_context
+from sqlalchemy.exc import DBAPIError
+
+# PostgreSQL serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+# SQLite SQLITE_BUSY and SQLITE_LOCKED (primary result codes)
+RETRYABLE_SQLITE_CODES = (5, 6)
+
+
+def is_retryable(error):
+    """True for lock and serialization conflicts that running the transaction again can get past."""
+    if not isinstance(error, DBAPIError) or error.connection_invalidated:
+        return False
+    orig = error.orig
+    if (getattr(orig, 'sqlstate', None) or getattr(orig, 'pgcode', None)) in RETRYABLE_SQLSTATES:
+        return True
+    code = getattr(orig, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in RETRYABLE_SQLITE_CODES
+    message = str(orig).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_conflict(f):
+    """
+    Run f again when it fails with a lock or serialization conflict, up to
+    DB_RETRY_ATTEMPTS times in all, sleeping a random time of up to
+    DB_RETRY_BACKOFF_MS (doubling after each attempt) in between. f must
+    run one whole transaction and roll it back when it raises, as the
+    functions in app/utils/inventory.py do.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        config = current_app.config if has_app_context() else {}
+        attempts = max(int(config.get('DB_RETRY_ATTEMPTS', 3)), 1)
+        backoff = config.get('DB_RETRY_BACKOFF_MS', 20) / 1000
+        for attempt in range(attempts):
+            try:
+                return f(*args, **kwargs)
+            except DBAPIError as e:
+                if attempt + 1 == attempts or not is_retryable(e):
+                    raise
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+    return decorated
@@ -0,0 +1,137 @@
+# app/utils/revocation.py
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+
+class RevocationCache:
+    """
+    Process-local cache of revoked JWT ids (jti).
+
+    The cache is filled from blacklisted_tokens at startup and updated by
+    /auth/logout, so checking a token that is not revoked normally costs no
+    database round trip. A jti that is not in the cache is looked up once and
+    remembered as "not revoked" for JWT_REVOCATION_NEGATIVE_TTL seconds, which
+    bounds how long a logout done in another worker process can go unnoticed.
+    Revoked entries are forgotten once the token's own `exp` has passed.
+    """
+
+    def __init__(self, app=None):
+        self.negative_ttl = 30
+        self._revoked = {}   # jti -> exp (unix timestamp) or None if unknown
+        self._negative = {}  # jti -> unix timestamp until which it is known good
+        self._lock = threading.Lock()
+        self._next_prune = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.negative_ttl = app.config.get('JWT_REVOCATION_NEGATIVE_TTL', 30)
+        app.extensions['revocation_cache'] = self
+        with app.app_context():
+            try:
+                self.load()
+            except Exception as e:
+                logging.getLogger('wine_inventory').error(f"Failed to load revoked tokens: {str(e)}")
+
+    def load(self):
+        """Fill the cache from blacklisted_tokens."""
+        from app import db
+        from app.models import BlacklistedToken
+
+        rows = db.session.query(BlacklistedToken.jti, BlacklistedToken.expires_at).filter(
+            or_(BlacklistedToken.expires_at.is_(None), BlacklistedToken.expires_at > datetime.utcnow())
+        ).all()
+        with self._lock:
+            self._revoked = {jti: _to_timestamp(expires_at) for jti, expires_at in rows}
+            self._negative.clear()
+        db.session.remove()
+
+    def revoke(self, jti, exp=None):
+        with self._lock:
+            self._revoked[jti] = exp
+            self._negative.pop(jti, None)
+
+    def is_revoked(self, jti, exp=None):
+        now = time.time()
+        if now >= self._next_prune:
+            self._prune(now)
+
+        if jti in self._revoked:
+            return True
+        known_good_until = self._negative.get(jti)
+        if known_good_until is not None and known_good_until > now:
+            return False
+
+        from app import db
+        from app.models import BlacklistedToken
+
+        revoked = db.session.query(BlacklistedToken.id).filter_by(jti=jti).first() is not None
+        with self._lock:
+            if revoked:
+                self._revoked[jti] = exp
+            else:
+                self._negative[jti] = now + self.negative_ttl
+        return revoked
+
+    def _prune(self, now):
+        with self._lock:
+            self._revoked = {
+                jti: exp for jti, exp in self._revoked.items()
+                if exp is None or exp > now
+            }
+            self._negative = {
+                jti: until for jti, until in self._negative.items()
+                if until > now
+            }
+            self._next_prune = now + max(self.negative_ttl, 1)
+
+
+def get_revocation_cache():
+    return current_app.extensions['revocation_cache']
+
+
+def _to_timestamp(expires_at):
+    if expires_at is None:
+        return None
+    return (expires_at - datetime(1970, 1, 1)).total_seconds()
+
+
+def prune_expired_tokens(batch_size=1000):
+    """
+    Delete revocations whose token has expired, batch_size rows at a time.
+    Rows written before expires_at existed are pruned once they are older
+    than JWT_ACCESS_TOKEN_EXPIRES. Returns (rows_removed, elapsed_seconds).
+    """
+    from app import db
+    from app.models import BlacklistedToken
+
+    started = time.monotonic()
+    now = datetime.utcnow()
+
+    expired = BlacklistedToken.expires_at < now
+    lifetime = current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15))
+    if isinstance(lifetime, timedelta):
+        expired = or_(expired, and_(
+            BlacklistedToken.expires_at.is_(None),
+            BlacklistedToken.created_at < now - lifetime
+        ))
+
+    removed = 0
+    while True:
+        ids = [row_id for (row_id,) in db.session.query(BlacklistedToken.id).filter(expired).limit(batch_size)]
+        if not ids:
+            break
+        db.session.query(BlacklistedToken).filter(
+            BlacklistedToken.id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        removed += len(ids)
+        if len(ids) < batch_size:
+            break
+
+    return removed, time.monotonic() - started
@@ -0,0 +1,147 @@
+# app/utils/stock_events.py
+import threading
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+
+class StockEventQueue:
+    """
+    In-process feed of products crossing their reorder level.
+
+    Every stock change goes through StockMovement.record, which compares
+    each product's level before and after against its reorder_level and
+    queues a 'low_stock', 'out_of_stock' or 'restocked' event on the
+    session. The events are published here once the transaction commits
+    (and dropped if it rolls back). Consumers poll with the last seq they
+    saw; the newest STOCK_EVENT_QUEUE_SIZE events are kept. The feed is per
+    worker process, so consumers should treat /products/low-stock as the
+    full picture and this as the stream of changes to it.
+    """
+
+    def __init__(self, app=None):
+        self._events = deque(maxlen=1000)
+        self._seq = 0
+        self._condition = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._events = deque(maxlen=app.config.get('STOCK_EVENT_QUEUE_SIZE', 1000))
+        app.extensions['stock_events'] = self
+        _install_session_hooks()
+
+    def publish(self, events):
+        with self._condition:
+            for event in events:
+                self._seq += 1
+                self._events.append(dict(event, seq=self._seq))
+            self._condition.notify_all()
+
+    def poll(self, after=0, limit=100, timeout=0):
+        """
+        Return (events, last_seq, missed): up to limit events with seq >
+        after, waiting up to timeout seconds for one to arrive. missed is
+        True when events after `after` have already been dropped (or the
+        process restarted), so the consumer should rescan low stock.
+        """
+        with self._condition:
+            if timeout and self._seq <= after:
+                self._condition.wait_for(lambda: self._seq > after, timeout)
+            missed = after > self._seq
+            if missed:
+                after = 0
+            elif self._events and self._events[0]['seq'] > after + 1:
+                missed = True
+            events = [event for event in self._events if event['seq'] > after][:limit]
+            return events, self._seq, missed
+
+
+def get_stock_event_queue():
+    return current_app.extensions['stock_events']
+
+
+def stock_crossing(previous, in_stock, previous_level, reorder_level):
+    """The event type for a product moving between these states, or None."""
+    was_low = previous <= previous_level
+    is_low = in_stock <= reorder_level
+    if is_low and (not was_low or (in_stock <= 0 < previous)):
+        return 'out_of_stock' if in_stock <= 0 else 'low_stock'
+    if was_low and not is_low:
+        return 'restocked'
+    return None
+
+
+def queue_stock_changes(changes):
+    """
+    Queue events for changes, an iterable of (product_id, name, previous,
+    in_stock, previous_level, reorder_level), to be published when the
+    current transaction commits.
+    """
+    from app import db
+
+    now = datetime.utcnow().isoformat()
+    events = []
+    for product_id, name, previous, in_stock, previous_level, reorder_level in changes:
+        kind = stock_crossing(previous, in_stock, previous_level, reorder_level)
+        if kind:
+            events.append({
+                'type': kind,
+                'product_id': product_id,
+                'name': name,
+                'previous': previous,
+                'in_stock': in_stock,
+                'reorder_level': reorder_level,
+                'at': now,
+            })
+    if events:
+        db.session.info.setdefault('stock_events', []).extend(events)
+
+
+def track_stock_deltas(deltas):
+    """
+    Queue events for {product_id: delta} that has just been applied to
+    in_stock in the current transaction, reading the new levels in one query.
+    """
+    from app import db
+    from app.models import Product
+
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    rows = db.session.execute(
+        db.select(Product.id, Product.name, Product.in_stock, Product.reorder_level)
+        .where(Product.id.in_(deltas))
+    ).all()
+    queue_stock_changes(
+        (row.id, row.name, row.in_stock - deltas[row.id], row.in_stock, row.reorder_level, row.reorder_level)
+        for row in rows
+    )
+
+
+_hooks_installed = False
+
+
+def _install_session_hooks():
+    global _hooks_installed
+    if _hooks_installed:
+        return
+
+    from sqlalchemy import event
+    from app import db
+
+    def after_commit(session):
+        events = session.info.pop('stock_events', None)
+        if events and has_app_context():
+            queue = current_app.extensions.get('stock_events')
+            if queue is not None:
+                queue.publish(events)
+
+    def after_transaction_end(session, transaction):
+        if transaction.parent is None:
+            session.info.pop('stock_events', None)
+
+    event.listen(db.session, 'after_commit', after_commit)
+    event.listen(db.session, 'after_transaction_end', after_transaction_end)
+    _hooks_installed = True
@@ -0,0 +1,70 @@
+# app/utils/sweeper.py
+import logging
+import os
+import threading
+import traceback
+
+
+class Sweeper:
+    """
+    Optional in-process housekeeping thread.
+
+    Every SWEEP_INTERVAL_SECONDS the registered jobs are run inside an app
+    context. Each job returns (rows_removed, elapsed_seconds), which is
+    logged. An interval of 0 (the default) disables the thread; the same
+    jobs are available as CLI commands for cron-style scheduling.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 0
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('SWEEP_INTERVAL_SECONDS', 0)
+        app.extensions['sweeper'] = self
+        if self.interval:
+            # Started lazily so each worker process gets its own thread after forking
+            app.before_request(self._ensure_started)
+
+    def add_job(self, name, func):
+        self.jobs[name] = func
+
+    def run_once(self):
+        logger = logging.getLogger('wine_inventory')
+        results = {}
+        with self.app.app_context():
+            for name, func in self.jobs.items():
+                try:
+                    removed, elapsed = func()
+                    results[name] = (removed, elapsed)
+                    logger.info(f"Sweeper job {name}: removed {removed} rows in {elapsed:.3f}s")
+                except Exception as e:
+                    logger.error(f"Sweeper job {name} failed: {str(e)}")
+                    logger.debug(traceback.format_exc())
+        return results
+
+    def stop(self):
+        self._stop.set()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -0,0 +1,120 @@
+# app/utils/table_versions.py
+import random
+from datetime import datetime
+from itertools import chain
+
+from flask import current_app, has_app_context
+
+from app.utils.upsert import upsert
+
+# Callbacks run after a commit with the set of tables it wrote
+_commit_listeners = []
+_hooks_installed = False
+
+
+def init_app(app):
+    """Start counting writes per table (idempotent across apps)."""
+    global _hooks_installed
+    if _hooks_installed:
+        return
+
+    from sqlalchemy import event
+    from app import db
+
+    event.listen(db.session, 'after_flush', _track_flush)
+    event.listen(db.session, 'do_orm_execute', _track_execute)
+    event.listen(db.session, 'before_commit', _bump_before_commit)
+    event.listen(db.session, 'after_commit', _notify_after_commit)
+    event.listen(db.session, 'after_transaction_end', _forget_after_transaction)
+    _hooks_installed = True
+
+
+def add_commit_listener(callback):
+    """callback(app, tables) runs after each commit that wrote tables."""
+    if callback not in _commit_listeners:
+        _commit_listeners.append(callback)
+
+
+def bump_table_versions(session, tables):
+    """
+    Add one to the version of each table, creating missing rows. Runs in the
+    current transaction of session, which may also be a Connection. The
+    transaction bumps one randomly chosen shard of every counter, so
+    writers to the same table mostly lock different rows.
+    """
+    from app.models import TableVersion
+
+    shards = current_app.config.get('TABLE_VERSION_SHARDS', 8) if has_app_context() else 8
+    shard = random.randrange(max(int(shards), 1))
+    now = datetime.utcnow()
+    # Sorted so concurrent writers lock the rows in the same order
+    upsert(
+        session, TableVersion.__table__,
+        [{'table_name': name, 'shard': shard, 'version': 1, 'updated_at': now} for name in sorted(tables)],
+        ['table_name', 'shard'],
+        lambda table, excluded: {'version': table.c.version + 1, 'updated_at': excluded.updated_at}
+    )
+
+
+def table_versions_query(tables):
+    """SELECT of (table_name, version) for tables, adding up their shards."""
+    from app import db
+    from app.models import TableVersion
+
+    return db.select(TableVersion.table_name, db.func.sum(TableVersion.version)).where(
+        TableVersion.table_name.in_(tables)
+    ).group_by(TableVersion.table_name)
+
+
+def get_table_versions(tables):
+    """{table name: version} for tables; never-written tables are at 0."""
+    from app import db
+
+    versions = dict.fromkeys(tables, 0)
+    versions.update((name, int(version)) for name, version in db.session.execute(table_versions_query(tables)))
+    return versions
+
+
+def _written(session):
+    return session.info.setdefault('written_tables', set())
+
+
+def _track_flush(session, flush_context):
+    tables = {
+        obj.__tablename__ for obj in chain(session.new, session.dirty, session.deleted)
+        if hasattr(obj, '__tablename__')
+    }
+    if tables:
+        _written(session).update(tables)
+
+
+def _track_execute(orm_execute_state):
+    # Bulk and Core statements run through the session skip the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        name = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+        if name and name != 'table_versions':
+            _written(orm_execute_state.session).add(name)
+
+
+def _bump_before_commit(session):
+    # Flush now so writes still pending are counted in this transaction
+    session.flush()
+    tables = session.info.pop('written_tables', None)
+    if tables:
+        bump_table_versions(session.connection(), tables)
+        session.info['committed_tables'] = tables
+
+
+def _notify_after_commit(session):
+    tables = session.info.pop('committed_tables', None)
+    if tables and has_app_context():
+        app = current_app._get_current_object()
+        for callback in _commit_listeners:
+            callback(app, tables)
+
+
+def _forget_after_transaction(session, transaction):
+    if transaction.parent is None:
+        # Rolled back, or already handled by the commit hooks
+        session.info.pop('written_tables', None)
+        session.info.pop('committed_tables', None)
@@ -0,0 +1,80 @@
+# app/utils/upsert.py
+from sqlalchemy import and_, bindparam, or_, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+# Rows per SELECT when looking up existing keys without a native upsert
+PORTABLE_LOOKUP_CHUNK = 200
+
+
+def upsert(session, table, rows, index_elements, update):
+    """
+    Insert rows into table, updating the existing row when one with the same
+    index_elements is already present, as a single multi-row statement on
+    PostgreSQL, SQLite and MySQL/MariaDB. Other databases get a portable
+    fallback (see _upsert_portable).
+
+    update(table, excluded) must return the {column: expression} mapping to
+    apply on conflict, where excluded refers to the values of the row that
+    could not be inserted. Runs in the current transaction of session, which
+    may also be a Connection.
+    """
+    if not rows:
+        return
+
+    bind = session.get_bind() if hasattr(session, 'get_bind') else session
+    dialect = bind.dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=update(table, stmt.excluded))
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=update(table, stmt.excluded))
+    elif dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(update(table, stmt.inserted))
+    else:
+        _upsert_portable(session, table, rows, index_elements, update)
+        return
+
+    session.execute(stmt)
+
+
+class _Incoming:
+    """Stands in for `excluded`: each column is a bind parameter filled from the row."""
+
+    def __getattr__(self, name):
+        return bindparam(f'new_{name}')
+
+    __getitem__ = __getattr__
+
+
+def _upsert_portable(session, table, rows, index_elements, update):
+    """
+    Upsert with plain SQL: look up which keys exist, then one executemany
+    UPDATE for those rows and one INSERT for the rest. Not atomic against
+    another transaction inserting the same keys at the same time; that one
+    fails with IntegrityError instead.
+    """
+    key_columns = [table.c[name] for name in index_elements]
+    existing = set()
+    for start in range(0, len(rows), PORTABLE_LOOKUP_CHUNK):
+        chunk = rows[start:start + PORTABLE_LOOKUP_CHUNK]
+        existing.update(tuple(key) for key in session.execute(select(*key_columns).where(or_(*(
+            and_(*(column == row[column.name] for column in key_columns)) for row in chunk
+        )))))
+
+    updates, inserts = [], []
+    for row in rows:
+        if tuple(row[name] for name in index_elements) in existing:
+            params = {f'new_{name}': value for name, value in row.items()}
+            params.update({f'key_{name}': row[name] for name in index_elements})
+            updates.append(params)
+        else:
+            inserts.append(row)
+
+    if updates:
+        session.execute(table.update().where(*(
+            column == bindparam(f'key_{column.name}') for column in key_columns
+        )).values(update(table, _Incoming())), updates)
+    if inserts:
+        session.execute(table.insert(), inserts)
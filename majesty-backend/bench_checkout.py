@@ -0,0 +1,148 @@
+"""
+Concurrency check for /invoices/checkout.
+Run from majesty-backend directory: python bench_checkout.py [--threads 8] [--checkouts 50] [--stock 100]
+                                     [--sqlite-tuning on|off|both] [--sync-audit]
+
+Many threads check out the same scarce product at once. The script fails if
+more units were sold than were in stock, or if invoices, items and stock do
+not add up, and prints checkouts per second.
+
+Uses a throwaway SQLite database unless BENCH_DATABASE_URL is set
+(point it at an empty PostgreSQL database to exercise SELECT ... FOR UPDATE).
+--sqlite-tuning off runs without the DB_SQLITE_* PRAGMAs and without
+retries, as before they existed; both runs each on a fresh database.
+--sync-audit writes each log entry in the request instead of in the
+background, like AUDIT_ASYNC = False.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db
+from app.models.models import User, Role, Category, Product, Invoice, InvoiceItem
+
+
+def make_config(tuned=True, sync_audit=False):
+    database_url = os.environ.get('BENCH_DATABASE_URL')
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    class BenchConfig:
+        DEBUG = False
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = database_url
+        JWT_SECRET_KEY = 'bench-secret-key-that-is-long-enough-for-hs256'
+        JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+        AUDIT_ASYNC = not sync_audit
+        DB_SQLITE_TUNING = tuned
+        DB_RETRY_ATTEMPTS = 3 if tuned else 1
+
+    return BenchConfig
+
+
+def seed(app, stock):
+    with app.app_context():
+        role = Role(name='admin')
+        db.session.add(role)
+        user = User(username='bench', is_admin=True)
+        user.set_password('bench')
+        user.roles.append(role)
+        db.session.add(user)
+        db.session.commit()
+
+        category = Category(name='Bench', created_by=user.id)
+        db.session.add(category)
+        db.session.commit()
+
+        scarce = Product(name='Scarce', price=100, category_id=category.id, bottle_size=750,
+                         in_stock=stock, added_by=user.id)
+        plenty = Product(name='Plenty', price=10, category_id=category.id, bottle_size=750,
+                         in_stock=1000000, added_by=user.id)
+        db.session.add_all([scarce, plenty])
+        db.session.commit()
+        return scarce.id, plenty.id
+
+
+def run(args, tuned):
+    app = create_app(make_config(tuned, args.sync_audit))
+    scarce_id, plenty_id = seed(app, args.stock)
+
+    client = app.test_client()
+    token = client.post('/auth/login', json={'username': 'bench', 'password': 'bench'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    payload = {
+        'items': [
+            {'item': {'id': scarce_id}, 'number_sold': 1},
+            {'item': {'id': plenty_id}, 'number_sold': 2},
+        ],
+        'total_amount': 120
+    }
+
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        thread_client = app.test_client()
+        for _ in range(args.checkouts):
+            status = thread_client.post('/invoices/checkout', json=payload, headers=headers).status_code
+            with lock:
+                results[status] = results.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    app.extensions['audit_writer'].shutdown()
+    with app.app_context():
+        in_stock = db.session.get(Product, scarce_id).in_stock
+        invoices = Invoice.query.count()
+        sold = db.session.query(db.func.sum(InvoiceItem.quantity)).filter(
+            InvoiceItem.product_id == scarce_id
+        ).scalar() or 0
+
+    attempts = args.threads * args.checkouts
+    succeeded = results.get(201, 0)
+    print(f"attempts: {attempts}  responses: {dict(sorted(results.items()))}")
+    print(f"scarce stock: {args.stock} -> {in_stock}, sold {sold}, invoices {invoices}")
+    print(f"{attempts / elapsed:.1f} checkout requests/s, {succeeded / elapsed:.1f} completed checkouts/s")
+
+    ok = (
+        in_stock >= 0
+        and sold == args.stock - in_stock
+        and invoices == succeeded
+        and succeeded == min(attempts, args.stock)
+    )
+    print('OK' if ok else 'FAILED: stock and invoices do not add up')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--checkouts', type=int, default=50, help='checkouts per thread')
+    parser.add_argument('--stock', type=int, default=100, help='units of the scarce product')
+    parser.add_argument('--sqlite-tuning', choices=['on', 'off', 'both'], default='on',
+                        help='SQLite PRAGMAs and retries (both: run without, then with)')
+    parser.add_argument('--sync-audit', action='store_true', help='write log entries in the request')
+    args = parser.parse_args()
+
+    ok = True
+    for tuned in {'on': [True], 'off': [False], 'both': [False, True]}[args.sqlite_tuning]:
+        if args.sqlite_tuning == 'both':
+            print(f"--- sqlite tuning {'on' if tuned else 'off'}")
+        ok = run(args, tuned) and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Load test comparing the Flask development server with gunicorn.
+Run from majesty-backend directory: python bench_serving.py [--clients 16] [--seconds 10] [--products 500]
+
+Seeds a throwaway database, then for each server starts it, logs in and
+has --clients threads hammer GET /products/all and POST /invoices/checkout
+(over keep-alive connections) for --seconds each, printing requests per
+second, latency percentiles and errors. Extra gunicorn profiles can be
+picked with --gunicorn "sync:4" "gthread:4x8" (class:workers[xthreads]).
+
+Uses a throwaway SQLite database unless BENCH_DATABASE_URL is set (point
+it at an empty PostgreSQL database to see the workers scale on writes).
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def server_env(database_url):
+    env = dict(os.environ)
+    env.update({
+        'FLASK_ENV': 'production',
+        'DATABASE_URL': database_url,
+        'JWT_SECRET_KEY': 'bench-secret-key-that-is-long-enough-for-hs256',
+        'GUNICORN_ACCESS_LOG': '',
+        'GUNICORN_LOG_LEVEL': 'warning',
+    })
+    return env
+
+
+def seed(database_url, products):
+    os.environ.update(server_env(database_url))
+    from app import create_app, db
+    from app.models.models import User, Role, Category, Product
+
+    app = create_app()
+    with app.app_context():
+        role = Role(name='admin')
+        user = User(username='bench', is_admin=True)
+        user.set_password('bench')
+        user.roles.append(role)
+        db.session.add_all([role, user])
+        db.session.commit()
+
+        category = Category(name='Bench', created_by=user.id)
+        db.session.add(category)
+        db.session.commit()
+        db.session.add_all([
+            Product(name=f'Bench {i}', price=10 + i % 50, category_id=category.id, bottle_size=750,
+                    in_stock=10000000, added_by=user.id)
+            for i in range(products)
+        ])
+        db.session.commit()
+    app.extensions['audit_writer'].shutdown()
+
+
+def start_server(kind, port, env):
+    if kind == 'flask':
+        command = [sys.executable, '-m', 'flask', '--app', 'wsgi', 'run', '--port', str(port)]
+    else:
+        worker_class, _, size = kind.partition(':')
+        workers, _, threads = size.partition('x')
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                   '--worker-class', worker_class, 'wsgi:app']
+        if workers:
+            command += ['--workers', workers]
+        if threads:
+            command += ['--threads', threads]
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/categories/get')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{kind} server did not start')
+
+
+def request(connection, method, path, headers, body=None):
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def run_load(port, clients, seconds, method, path, headers, body=None):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, failed = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = request(connection, method, path, headers, body)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = None
+            if status is None or status >= 400:
+                failed += 1
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    count = len(latencies)
+
+    def percentile(p):
+        return latencies[min(count - 1, int(count * p))] * 1000 if count else 0
+
+    return {
+        'rps': count / seconds,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--gunicorn', nargs='*', default=['gthread'],
+                        help='gunicorn profiles as class[:workers[xthreads]]; defaults come from gunicorn.conf.py')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('BENCH_DATABASE_URL')
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    seed(database_url, args.products)
+    env = server_env(database_url)
+
+    checkout = json.dumps({'items': [{'item': {'id': 1}, 'number_sold': 1}], 'total_amount': 10})
+    print(f"{'server':<22}{'endpoint':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for kind in ['flask'] + [f'gunicorn {profile}' for profile in args.gunicorn]:
+        process = start_server(kind.split(' ', 1)[-1], args.port, env)
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+            status, data = request(connection, 'POST', '/auth/login', {'Content-Type': 'application/json'},
+                                   json.dumps({'username': 'bench', 'password': 'bench'}))
+            headers = {'Authorization': f"Bearer {json.loads(data)['token']}", 'Content-Type': 'application/json'}
+
+            for label, method, path, body in (('GET /products/all', 'GET', '/products/all', None),
+                                              ('POST checkout', 'POST', '/invoices/checkout', checkout)):
+                result = run_load(args.port, args.clients, args.seconds, method, path, headers, body)
+                print(f"{kind:<22}{label:<22}{result['rps']:>9.1f}{result['p50']:>9.1f}"
+                      f"{result['p95']:>9.1f}{result['p99']:>9.1f}{result['errors']:>8}")
+        finally:
+            process.terminate()
+            process.wait(30)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,4 +6,61 @@ import os
 class ProductionConfig:
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
-    JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "default_prod_secret_key")
\ No newline at end of file
+    # Optional read replica for reports and log views (see app/utils/replica.py)
+    SQLALCHEMY_REPLICA_URI = os.environ.get("DATABASE_REPLICA_URL")
+
+    # Connection pool, per worker process (see app/utils/db_pool.py)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))  # PostgreSQL, 0 = none
+    DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"  # transaction pooling mode
+
+    # SQLite PRAGMAs set on connect, for single-shop installs (see app/utils/db_pool.py)
+    DB_SQLITE_TUNING = os.environ.get("DB_SQLITE_TUNING", "true").lower() == "true"
+    DB_SQLITE_SYNCHRONOUS = os.environ.get("DB_SQLITE_SYNCHRONOUS", "NORMAL")
+    DB_SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", 5000))
+    DB_SQLITE_MMAP_SIZE = int(os.environ.get("DB_SQLITE_MMAP_SIZE", 268435456))
+    DB_SQLITE_CACHE_SIZE_KB = int(os.environ.get("DB_SQLITE_CACHE_SIZE_KB", 65536))
+
+    # Transactions failing on a lock or serialization conflict are run again
+    # (see app/utils/retry.py)
+    DB_RETRY_ATTEMPTS = int(os.environ.get("DB_RETRY_ATTEMPTS", 3))
+    DB_RETRY_BACKOFF_MS = int(os.environ.get("DB_RETRY_BACKOFF_MS", 20))
+
+    JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "default_prod_secret_key")
+    JWT_REVOCATION_NEGATIVE_TTL = int(os.environ.get("JWT_REVOCATION_NEGATIVE_TTL", 30))
+
+    # Background audit log writer (see app/utils/audit.py)
+    AUDIT_ASYNC = os.environ.get("AUDIT_ASYNC", "true").lower() == "true"
+    AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 200))
+    AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get("AUDIT_FLUSH_INTERVAL_MS", 500))
+
+    # Periodic cleanup of expired rows (0 disables the in-process sweeper)
+    SWEEP_INTERVAL_SECONDS = int(os.environ.get("SWEEP_INTERVAL_SECONDS", 0))
+    SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", 1000))
+
+    # Stored responses for retried requests with an Idempotency-Key header
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 86400))
+    IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 120))  # > GUNICORN_TIMEOUT
+    IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 1024))
+
+    # Cached product and category lists (see app/utils/catalogue.py). Point
+    # CATALOGUE_CACHE_URL at Redis to share the cache between workers.
+    CATALOGUE_CACHE_URL = os.environ.get("CATALOGUE_CACHE_URL")
+    CATALOGUE_CACHE_TTL = int(os.environ.get("CATALOGUE_CACHE_TTL", 30))
+
+    # Rows each table_versions counter is spread over, so writers to one
+    # table do not all queue on a single row (see app/utils/table_versions.py)
+    TABLE_VERSION_SHARDS = int(os.environ.get("TABLE_VERSION_SHARDS", 8))
+
+    # Recent reorder-level crossings kept for /products/stock-events
+    STOCK_EVENT_QUEUE_SIZE = int(os.environ.get("STOCK_EVENT_QUEUE_SIZE", 1000))
+
+    # Per-endpoint latency and SQL cost served at /metrics (see app/utils/request_metrics.py).
+    # Scrapers authenticate with METRICS_TOKEN; unset, /metrics needs a user's access token.
+    REQUEST_METRICS = os.environ.get("REQUEST_METRICS", "true").lower() == "true"
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for serving the API (see wsgi.py and docs/serving.md).
+
+Every setting can be overridden with a GUNICORN_* environment variable.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# sync: one request per process. gthread: a pool of threads per process,
+# good for an API that mostly waits on the database (the default).
+# gevent: many greenlets per process; needs `pip install gevent`.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+# Processes: 2 x cores + 1 keeps every core busy while some workers wait on I/O
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))  # gevent only
+
+# Build the app once in the master so workers share the imported code
+# copy-on-write. gevent has to patch the standard library before the app is
+# imported, so it loads the app in each worker instead.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false" if worker_class == "gevent" else "true").lower() == "true"
+
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Recycle workers now and then so slow leaks cannot build up; the jitter
+# stops them all restarting at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Access log to stdout; set GUNICORN_ACCESS_LOG to a path, or to nothing to turn it off
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # With preload_app the master connected to the database while building
+    # the app; a worker must not share those sockets, so it drops them from
+    # its copy of the pool and opens its own
+    if not server.cfg.preload_app:
+        return
+    from wsgi import app
+    from app import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    app.extensions['pool_stats'].reset()
+    if 'replica_pool_stats' in app.extensions:
+        app.extensions['replica_pool_stats'].reset()
@@ -0,0 +1,27 @@
+"""Add expires_at to blacklisted_tokens
+
+Revision ID: add_blacklist_expires_at
+Revises: add_image_url
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_blacklist_expires_at'
+down_revision = 'add_image_url'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Store the revoked token's exp so expired rows can be pruned
+    op.add_column('blacklisted_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.create_index('idx_blacklisted_token_expires_at', 'blacklisted_tokens', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('idx_blacklisted_token_expires_at', table_name='blacklisted_tokens')
+    op.drop_column('blacklisted_tokens', 'expires_at')
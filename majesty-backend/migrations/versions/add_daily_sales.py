@@ -0,0 +1,38 @@
+"""Add daily_sales rollup table
+
+Revision ID: add_daily_sales
+Revises: add_blacklist_expires_at
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_daily_sales'
+down_revision = 'add_blacklist_expires_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fill it afterwards with: flask backfill-daily-sales
+    op.create_table(
+        'daily_sales',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Numeric(12, 2), nullable=False),
+        sa.Column('invoice_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'product_id', 'user_id')
+    )
+    op.create_index('idx_daily_sales_product_day', 'daily_sales', ['product_id', 'day'])
+    op.create_index('idx_daily_sales_user_day', 'daily_sales', ['user_id', 'day'])
+
+
+def downgrade():
+    op.drop_index('idx_daily_sales_user_day', table_name='daily_sales')
+    op.drop_index('idx_daily_sales_product_day', table_name='daily_sales')
+    op.drop_table('daily_sales')
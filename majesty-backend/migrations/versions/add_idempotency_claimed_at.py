@@ -0,0 +1,30 @@
+"""Add claimed_at to idempotency_keys
+
+Revision ID: add_idempotency_claimed_at
+Revises: add_reorder_level
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_idempotency_claimed_at'
+down_revision = 'add_reorder_level'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    # Existing claims were made when their row was created
+    op.execute('UPDATE idempotency_keys SET claimed_at = created_at')
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.alter_column('claimed_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.drop_column('claimed_at')
@@ -0,0 +1,59 @@
+"""Add invoice_id and product_id references to log_entries
+
+Revision ID: add_log_entry_refs
+Revises: add_daily_sales
+Create Date: 2026-10-18
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_log_entry_refs'
+down_revision = 'add_daily_sales'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('log_entries', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoice_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('product_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_log_entries_invoice_id', 'invoices', ['invoice_id'], ['id'], ondelete='SET NULL')
+        batch_op.create_foreign_key('fk_log_entries_product_id', 'products', ['product_id'], ['id'], ondelete='SET NULL')
+        batch_op.create_index('idx_log_invoice_id', ['invoice_id'], unique=False)
+        batch_op.create_index('idx_log_product_id', ['product_id'], unique=False)
+
+    # Older entries only mention the invoice in affected_name ("Invoice ID 12")
+    # or the message ("... invoice 12"); link those that still exist.
+    conn = op.get_bind()
+    existing = {row[0] for row in conn.execute(sa.text('SELECT id FROM invoices'))}
+    rows = conn.execute(sa.text(
+        "SELECT id, affected_name, message FROM log_entries "
+        "WHERE affected_name LIKE 'Invoice ID %' OR LOWER(message) LIKE '%invoice %'"
+    )).all()
+
+    updates = []
+    for log_id, affected_name, message in rows:
+        match = re.match(r'Invoice ID (\d+)$', affected_name or '') or re.search(r'invoice (\d+)', (message or '').lower())
+        if match and int(match.group(1)) in existing:
+            updates.append({'log_id': log_id, 'invoice_id': int(match.group(1))})
+
+    if updates:
+        conn.execute(
+            sa.text('UPDATE log_entries SET invoice_id = :invoice_id WHERE id = :log_id'),
+            updates
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('log_entries', schema=None) as batch_op:
+        batch_op.drop_index('idx_log_product_id')
+        batch_op.drop_index('idx_log_invoice_id')
+        batch_op.drop_constraint('fk_log_entries_product_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_log_entries_invoice_id', type_='foreignkey')
+        batch_op.drop_column('product_id')
+        batch_op.drop_column('invoice_id')
@@ -0,0 +1,32 @@
+"""Add reorder_level to products
+
+Revision ID: add_reorder_level
+Revises: add_product_search
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_reorder_level'
+down_revision = 'add_product_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reorder_level', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index(
+            'idx_product_low_stock', ['category_id'], unique=False,
+            postgresql_where=sa.text('in_stock <= reorder_level'),
+            sqlite_where=sa.text('in_stock <= reorder_level')
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('idx_product_low_stock')
+        batch_op.drop_column('reorder_level')
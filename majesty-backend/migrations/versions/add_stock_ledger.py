@@ -0,0 +1,55 @@
+"""Add stock_movements ledger and stock_snapshots
+
+Revision ID: add_stock_ledger
+Revises: add_idempotency_keys
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_stock_ledger'
+down_revision = 'add_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Take the first snapshot afterwards with: flask snapshot-stock
+    op.create_table(
+        'stock_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(length=255), nullable=False),
+        sa.Column('invoice_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.create_index('idx_stock_movement_product_created', ['product_id', 'created_at'], unique=False)
+        batch_op.create_index('idx_stock_movement_created', ['created_at'], unique=False)
+
+    op.create_table(
+        'stock_snapshots',
+        sa.Column('taken_at', sa.DateTime(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('in_stock', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('taken_at', 'product_id')
+    )
+    with op.batch_alter_table('stock_snapshots', schema=None) as batch_op:
+        batch_op.create_index('idx_stock_snapshot_product_taken', ['product_id', 'taken_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stock_snapshots', schema=None) as batch_op:
+        batch_op.drop_index('idx_stock_snapshot_product_taken')
+    op.drop_table('stock_snapshots')
+
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_index('idx_stock_movement_created')
+        batch_op.drop_index('idx_stock_movement_product_created')
+    op.drop_table('stock_movements')
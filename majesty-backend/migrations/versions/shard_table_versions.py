@@ -0,0 +1,50 @@
+"""Split each table_versions counter over several shard rows
+
+Revision ID: shard_table_versions
+Revises: add_idempotency_claimed_at
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'shard_table_versions'
+down_revision = 'add_idempotency_claimed_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.rename_table('table_versions', 'table_versions_old')
+    op.create_table(
+        'table_versions',
+        sa.Column('table_name', sa.String(length=64), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name', 'shard', name='pk_table_version_shards')
+    )
+    # Each table's version is the sum of its shards, so the counts carry over as shard 0
+    op.execute(
+        'INSERT INTO table_versions (table_name, shard, version, updated_at) '
+        'SELECT table_name, 0, version, updated_at FROM table_versions_old'
+    )
+    op.drop_table('table_versions_old')
+
+
+def downgrade():
+    op.rename_table('table_versions', 'table_versions_old')
+    op.create_table(
+        'table_versions',
+        sa.Column('table_name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name', name='pk_table_versions')
+    )
+    op.execute(
+        'INSERT INTO table_versions (table_name, version, updated_at) '
+        'SELECT table_name, SUM(version), MAX(updated_at) FROM table_versions_old GROUP BY table_name'
+    )
+    op.drop_table('table_versions_old')
@@ -23,8 +23,15 @@ else
   echo "[WARNING] $REQUIREMENTS not found. Skipping package install."
 fi
 
-# 4. Run the backend server
+# 4. Run the backend server: `./start_backend.sh prod` serves with gunicorn,
+#    anything else starts the Flask development server
+if [ "$1" = "prod" ]; then
+  echo "[INFO] Starting backend with gunicorn..."
+  export FLASK_ENV=production
+  exec gunicorn -c gunicorn.conf.py --bind 127.0.0.1:5000 wsgi:app
+fi
+
 echo "[INFO] Starting backend..."
-export FLASK_APP=app.py
+export FLASK_APP=run.py
 export FLASK_ENV=development
 flask run --host=127.0.0.1 --port=5000
@@ -0,0 +1,102 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import User, Role, Category, Product
+
+
+class QueryCounter:
+    """Counts the SQL statements the test's own thread sends to an engine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        # The audit writer runs in the background and is not part of the request
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+    def remove(self):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+@pytest.fixture
+def app_config():
+    """Settings added to the app fixture's config; override it in a test module."""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    class TestConfig:
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        JWT_SECRET_KEY = 'test-secret-key-that-is-long-enough-for-hs256'
+        JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+
+    for name, value in app_config.items():
+        setattr(TestConfig, name, value)
+    app = create_app(TestConfig)
+    yield app
+    app.extensions['audit_writer'].shutdown()
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def user_id(app):
+    with app.app_context():
+        role = Role(name='admin')
+        user = User(username='admin', is_admin=True)
+        user.set_password('password')
+        user.roles.append(role)
+        db.session.add_all([role, user])
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def products(app, user_id):
+    """Ids of four products spread over two categories, 1000 of each in stock."""
+    with app.app_context():
+        categories = [Category(name=name, created_by=user_id) for name in ('Red', 'White')]
+        db.session.add_all(categories)
+        db.session.flush()
+        rows = [
+            Product(name=f'Wine {i}', price=10 + i, category_id=categories[i % 2].id, bottle_size=750,
+                    in_stock=1000, added_by=user_id)
+            for i in range(4)
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        return [product.id for product in rows]
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client, user_id):
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'password'})
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+
+@pytest.fixture
+def query_counter(app):
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+    yield counter
+    counter.remove()
@@ -0,0 +1,90 @@
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask_jwt_extended import decode_token
+from sqlalchemy import event
+
+from app import db
+from app.models import BlacklistedToken
+from app.utils import revocation
+from app.utils.revocation import RevocationCache, prune_expired_tokens
+
+
+def jti_of(app, headers):
+    with app.app_context():
+        return decode_token(headers['Authorization'].split()[1])['jti']
+
+
+def check_token(client, headers):
+    return client.get('/auth/check-token', headers=headers).status_code
+
+
+def test_logout_revokes_the_token(client, auth_headers):
+    assert check_token(client, auth_headers) == 200
+    assert client.post('/auth/logout', headers=auth_headers).status_code == 200
+    assert check_token(client, auth_headers) == 401
+
+
+def test_checking_a_known_good_token_skips_the_blocklist_query(app, client, auth_headers):
+    assert check_token(client, auth_headers) == 200  # Looks the jti up once
+
+    statements = []
+
+    def remember(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', remember)
+    try:
+        assert check_token(client, auth_headers) == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', remember)
+    # Neither the blocklist loader nor token_required went back to the database
+    assert not [statement for statement in statements if 'blacklisted_tokens' in statement]
+
+
+
+def test_token_required_reuses_the_token_jwt_required_decoded(client, auth_headers, monkeypatch):
+    checks = []
+    is_revoked = RevocationCache.is_revoked
+    monkeypatch.setattr(RevocationCache, 'is_revoked', lambda self, *args: checks.append(args) or is_revoked(self, *args))
+
+    assert client.get('/products/all', headers=auth_headers).status_code == 200  # @jwt_required() and @token_required
+    assert len(checks) == 1
+
+
+def test_token_required_alone_still_rejects_a_revoked_token(client, auth_headers):
+    assert client.get('/logs/logs', headers=auth_headers).status_code == 200  # @token_required only
+    assert client.post('/auth/logout', headers=auth_headers).status_code == 200
+    assert client.get('/logs/logs', headers=auth_headers).status_code == 401
+
+def test_revocation_by_another_worker_is_seen_once_the_negative_entry_expires(
+        app, client, auth_headers, monkeypatch):
+    assert check_token(client, auth_headers) == 200
+
+    # Another worker logs the token out: only the database knows
+    with app.app_context():
+        db.session.add(BlacklistedToken(jti=jti_of(app, auth_headers)))
+        db.session.commit()
+    assert check_token(client, auth_headers) == 200
+
+    later = time.time() + app.extensions['revocation_cache'].negative_ttl + 1
+    monkeypatch.setattr(revocation, 'time', SimpleNamespace(time=lambda: later, monotonic=time.monotonic))
+    assert check_token(client, auth_headers) == 401
+
+
+def test_expired_revocations_are_pruned(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.add_all([
+            BlacklistedToken(jti='expired', expires_at=now - timedelta(minutes=1)),
+            BlacklistedToken(jti='live', expires_at=now + timedelta(minutes=10)),
+            BlacklistedToken(jti='legacy', created_at=now - timedelta(days=2)),
+        ])
+        db.session.commit()
+
+        removed, _ = prune_expired_tokens(batch_size=1)
+        assert removed == 2
+        assert [jti for (jti,) in db.session.query(BlacklistedToken.jti)] == ['live']
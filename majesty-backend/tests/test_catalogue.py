@@ -0,0 +1,75 @@
+import threading
+
+from sqlalchemy import event
+
+from app import db
+from app.models import Cart, Product
+from app.utils.table_versions import bump_table_versions
+
+
+def write_from_another_worker(app, product_id, in_stock):
+    """Commit a stock change the way another worker process would: nothing in this process hears of it."""
+    with app.app_context():
+        products = Product.__table__
+        with db.engine.begin() as connection:
+            connection.execute(products.update().where(products.c.id == product_id).values(in_stock=in_stock))
+            bump_table_versions(connection, {'products'})
+
+
+def stock_levels(client, auth_headers):
+    response = client.get('/products/all', headers=auth_headers)
+    assert response.status_code == 200
+    return {product['id']: product['in_stock'] for product in response.get_json()['products']}
+
+
+def test_catalogue_sees_writes_made_by_other_workers(app, client, auth_headers, products):
+    assert stock_levels(client, auth_headers)[products[0]] == 1000
+
+    write_from_another_worker(app, products[0], 7)
+
+    assert stock_levels(client, auth_headers)[products[0]] == 7
+
+
+def test_catalogue_etag_changes_with_the_catalogue(app, client, auth_headers, products):
+    first = client.get('/products/all', headers=auth_headers)
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    unchanged = client.get('/products/all', headers=dict(auth_headers, **{'If-None-Match': etag}))
+    assert unchanged.status_code == 304
+
+    write_from_another_worker(app, products[0], 7)
+    changed = client.get('/products/all', headers=dict(auth_headers, **{'If-None-Match': etag}))
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert {product['id']: product['in_stock'] for product in changed.get_json()['products']}[products[0]] == 7
+
+
+def test_cart_reads_only_the_users_rows(app, client, auth_headers, user_id, products):
+    with app.app_context():
+        db.session.add(Cart(user_id=user_id, product_id=products[1], quantity=2))
+        db.session.commit()
+        engine = db.engine
+
+    statements = []
+
+    def remember(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == main_thread:
+            statements.append(statement)
+
+    main_thread = threading.get_ident()
+    event.listen(engine, 'before_cursor_execute', remember)
+    try:
+        response = client.get('/carts', headers=auth_headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', remember)
+
+    assert response.status_code == 200
+    [item] = response.get_json()['cart']
+    assert (item['product']['id'], item['product']['in_stock'], item['category']['name'], item['quantity']) == (
+        products[1], 1000, 'White', 2)
+    # One joined query for the cart, not a load of the whole catalogue
+    product_reads = [statement for statement in statements if 'products' in statement.split('FROM', 1)[-1]]
+    assert len(product_reads) == 1
+    assert 'cart_items.user_id' in product_reads[0]
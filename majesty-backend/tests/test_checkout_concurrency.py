@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import User, Cart, Product, Invoice, InvoiceItem, StockMovement
+
+CHECKOUTS = 12
+STOCK = 5
+
+
+@pytest.fixture
+def scarce_product(app, products):
+    """A product with fewer units in stock than there will be checkouts."""
+    with app.app_context():
+        product = db.session.get(Product, products[0])
+        product.in_stock = STOCK
+        db.session.commit()
+        return product.id
+
+
+def run_together(requests):
+    """Call every function in requests from its own thread, all at once; return their results."""
+    barrier = threading.Barrier(len(requests))
+    results = [None] * len(requests)
+
+    def run(index, request):
+        barrier.wait()
+        results[index] = request()
+
+    threads = [threading.Thread(target=run, args=(index, request)) for index, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def assert_sold_exactly_stock(app, product_id, statuses):
+    assert statuses.count(201) == STOCK
+    assert all(status == 400 for status in statuses if status != 201)
+    with app.app_context():
+        in_stock = db.session.get(Product, product_id).in_stock
+        sold = db.session.query(db.func.sum(InvoiceItem.quantity)).filter(
+            InvoiceItem.product_id == product_id
+        ).scalar()
+        ledger = db.session.query(db.func.sum(StockMovement.delta)).filter(
+            StockMovement.product_id == product_id
+        ).scalar()
+        invoices = Invoice.query.count()
+    assert in_stock == 0
+    assert sold == STOCK
+    assert ledger == -STOCK
+    assert invoices == STOCK
+
+
+def test_parallel_checkouts_never_oversell(app, auth_headers, scarce_product):
+    payload = {'items': [{'item': {'id': scarce_product}, 'number_sold': 1}], 'total_amount': 10}
+
+    def checkout():
+        return app.test_client().post('/invoices/checkout', json=payload, headers=auth_headers).status_code
+
+    statuses = run_together([checkout] * CHECKOUTS)
+    assert_sold_exactly_stock(app, scarce_product, statuses)
+
+
+def test_parallel_cart_checkouts_never_oversell(app, client, user_id, scarce_product):
+    with app.app_context():
+        for i in range(CHECKOUTS):
+            user = User(username=f'till{i}')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Cart(user_id=user.id, product_id=scarce_product, quantity=1))
+        db.session.commit()
+    headers = [
+        {'Authorization': 'Bearer ' + client.post(
+            '/auth/login', json={'username': f'till{i}', 'password': 'password'}
+        ).get_json()['token']}
+        for i in range(CHECKOUTS)
+    ]
+
+    def checkout(user_headers):
+        return lambda: app.test_client().post('/invoices/checkout-cart', headers=user_headers).status_code
+
+    statuses = run_together([checkout(user_headers) for user_headers in headers])
+    assert_sold_exactly_stock(app, scarce_product, statuses)
+    with app.app_context():
+        # Carts that checked out were emptied; the others keep their item
+        assert Cart.query.count() == CHECKOUTS - STOCK
+
+
+def sell_while_reading_stock(app, auth_headers, product_id, quantity):
+    """
+    Run a checkout of quantity units of product_id from another thread as
+    soon as this thread first reads products, giving it half a second to
+    commit before this thread carries on. Returns the thread and a function
+    that stops watching.
+    """
+    payload = {'items': [{'item': {'id': product_id}, 'number_sold': quantity}], 'total_amount': 10}
+    main_thread = threading.get_ident()
+    sale = threading.Thread(target=lambda: app.test_client().post(
+        '/invoices/checkout', json=payload, headers=auth_headers))
+
+    def after_read(conn, cursor, statement, parameters, context, executemany):
+        if (threading.get_ident() == main_thread and not sale.is_alive() and sale.ident is None
+                and statement.startswith('SELECT products.id')):
+            sale.start()
+            sale.join(0.5)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', after_read)
+    return sale, lambda: event.remove(engine, 'after_cursor_execute', after_read)
+
+
+def assert_ledger_matches_stock(app, product_id, initial):
+    with app.app_context():
+        in_stock = db.session.get(Product, product_id).in_stock
+        ledger = db.session.query(db.func.sum(StockMovement.delta)).filter(
+            StockMovement.product_id == product_id
+        ).scalar()
+    assert in_stock == initial + ledger
+
+
+def test_stocktake_racing_a_checkout_keeps_the_ledger_whole(app, client, auth_headers, products):
+    sale, stop = sell_while_reading_stock(app, auth_headers, products[0], 3)
+    try:
+        response = client.post('/products/stock-adjustments', headers=auth_headers, json={
+            'reason': 'stocktake', 'adjustments': [{'product_id': products[0], 'count': 900}],
+        })
+    finally:
+        stop()
+        sale.join()
+
+    assert response.status_code == 200
+    # The sale waited for the stocktake, so the count was taken against 1000 and 3 sold after it
+    assert response.get_json()['products'][0]['previous'] == 1000
+    assert_ledger_matches_stock(app, products[0], 1000)
+    with app.app_context():
+        assert db.session.get(Product, products[0]).in_stock == 897
+
+
+def test_product_update_racing_a_checkout_keeps_the_ledger_whole(app, client, auth_headers, products):
+    sale, stop = sell_while_reading_stock(app, auth_headers, products[0], 3)
+    try:
+        response = client.put(f'/products/{products[0]}', headers=auth_headers, json={'in_stock': 900})
+    finally:
+        stop()
+        sale.join()
+
+    assert response.status_code == 200
+    assert_ledger_matches_stock(app, products[0], 1000)
+    with app.app_context():
+        assert db.session.get(Product, products[0]).in_stock == 900
+        assert db.session.query(StockMovement.delta).filter(
+            StockMovement.product_id == products[0], StockMovement.reason == 'product_update'
+        ).scalar() == -97
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import IdempotencyKey
+from app.utils.idempotency import get_idempotency_store
+
+
+def claim_started(app, user_id, key, ago):
+    """Pretend the request holding key's claim started ago and never finished."""
+    with app.app_context():
+        db.session.query(IdempotencyKey).filter_by(user_id=user_id, key=key).update(
+            {'claimed_at': datetime.utcnow() - ago}
+        )
+        db.session.commit()
+
+
+def test_abandoned_claim_is_taken_over_after_the_lease(app, user_id):
+    with app.app_context():
+        store = get_idempotency_store()
+        request_hash = store.request_hash('POST', '/invoices/', b'{}')
+        assert store.begin(user_id, 'sale-1', request_hash) == (store.PROCEED, None)
+        assert store.begin(user_id, 'sale-1', request_hash) == (store.IN_PROGRESS, None)
+
+    claim_started(app, user_id, 'sale-1', store.lease + timedelta(seconds=1))
+    with app.app_context():
+        assert store.begin(user_id, 'sale-1', request_hash) == (store.PROCEED, None)
+        # The new claim has a fresh lease of its own
+        assert store.begin(user_id, 'sale-1', request_hash) == (store.IN_PROGRESS, None)
+
+        store.complete(user_id, 'sale-1', request_hash, 201, '{"ok": true}')
+    claim_started(app, user_id, 'sale-1', store.lease + timedelta(seconds=1))
+    with app.app_context():
+        # A finished request is replayed however old its claim is
+        assert store.begin(user_id, 'sale-1', request_hash) == (store.REPLAY, (201, '{"ok": true}'))
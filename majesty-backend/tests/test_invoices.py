@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import Category, Invoice, Product
+from app.utils.inventory import StockError, create_invoice, update_invoice
+from app.utils.replica import RoutingSession
+
+
+def add_invoices(app, user_id, products, count):
+    with app.app_context():
+        for i in range(count):
+            create_invoice(user_id, [
+                (products[i % len(products)], 1),
+                (products[(i + 1) % len(products)], 2),
+            ])
+
+
+@pytest.mark.parametrize('query_string', ['', '?limit=200'])
+def test_invoice_list_query_count_does_not_grow_with_invoices(
+        app, client, auth_headers, user_id, products, query_counter, query_string):
+    def list_invoices():
+        query_counter.reset()
+        response = client.get(f'/invoices/{query_string}', headers=auth_headers)
+        assert response.status_code == 200
+        return query_counter.count, response.get_json()['invoices']
+
+    add_invoices(app, user_id, products, 5)
+    list_invoices()  # First request also loads the revocation cache and the like
+    few_queries, invoices = list_invoices()
+    assert len(invoices) == 5
+
+    add_invoices(app, user_id, products, 45)
+    many_queries, invoices = list_invoices()
+    assert len(invoices) == 50
+    assert all(len(invoice['items']) == 2 for invoice in invoices)
+    assert {item['item']['category'] for invoice in invoices for item in invoice['items']} == {'Red', 'White'}
+
+    assert many_queries == few_queries
+
+
+def test_invoice_update_keeps_notes_and_status_when_retried(app, client, auth_headers, user_id, products):
+    with app.app_context():
+        invoice_id = create_invoice(user_id, [(products[0], 1)]).id
+
+    conflicts = []
+
+    def lock_first_commit(session):
+        if not conflicts:
+            conflicts.append(True)
+            raise OperationalError('COMMIT', {}, sqlite3.OperationalError('database is locked'))
+
+    event.listen(RoutingSession, 'before_commit', lock_first_commit)
+    try:
+        response = client.put(f'/invoices/{invoice_id}', headers=auth_headers, json={
+            'notes': 'paid by card', 'status': 'paid',
+            'items': [{'product_id': products[0], 'quantity': 3}],
+        })
+    finally:
+        event.remove(RoutingSession, 'before_commit', lock_first_commit)
+
+    assert response.status_code == 200
+    assert conflicts
+    with app.app_context():
+        invoice = db.session.get(Invoice, invoice_id)
+        assert (invoice.notes, invoice.status) == ('paid by card', 'paid')
+        assert [item.quantity for item in invoice.items] == [3]
+
+
+def test_invoice_list_etag_changes_when_a_category_is_renamed(app, client, auth_headers, user_id, products):
+    add_invoices(app, user_id, products, 1)
+    etag = client.get('/invoices/', headers=auth_headers).headers['ETag']
+
+    with app.app_context():
+        db.session.get(Category, db.session.get(Product, products[0]).category_id).name = 'Rosso'
+        db.session.commit()
+
+    response = client.get('/invoices/', headers=dict(auth_headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert 'Rosso' in {item['item']['category'] for item in response.get_json()['invoices'][0]['items']}
+
+
+def test_short_invoice_update_names_the_product(app, user_id, products):
+    with app.app_context():
+        invoice = create_invoice(user_id, [(products[0], 1), (products[1], 1)])
+        with pytest.raises(StockError) as error:
+            update_invoice(invoice, [{'product_id': products[0], 'quantity': 1},
+                                     {'product_id': products[1], 'quantity': 2000}])
+    assert error.value.product_id == products[1]
+    assert str(error.value) == 'Not enough stock for product Wine 1'
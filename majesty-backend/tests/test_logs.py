@@ -0,0 +1,138 @@
+import csv
+import gzip
+import io
+import json
+import queue
+from types import SimpleNamespace
+
+from app import db
+from app.models import Product, logEntry
+from app.utils import audit
+from app.utils.logger import log_action
+
+
+def logged_actions(app):
+    with app.app_context():
+        return [tuple(row) for row in db.session.query(
+            logEntry.action, logEntry.acting_username
+        ).order_by(logEntry.id)]
+
+
+def test_audit_rows_are_written_by_the_background_writer(app, user_id):
+    writer = app.extensions['audit_writer']
+    with app.app_context():
+        for action in ('FIRST', 'SECOND', 'THIRD'):
+            log_action(user_id, action, 'test entry')
+    writer.shutdown()
+
+    assert logged_actions(app) == [('FIRST', 'admin'), ('SECOND', 'admin'), ('THIRD', 'admin')]
+    assert writer.stats()['written'] == 3
+
+
+def test_a_full_audit_queue_drops_entries_instead_of_blocking(app, user_id, monkeypatch):
+    writer = app.extensions['audit_writer']
+    monkeypatch.setattr(writer, 'queue', queue.Queue(maxsize=1))
+    monkeypatch.setattr(writer, '_ensure_started', lambda: None)  # Nothing drains the queue
+    with app.app_context():
+        log_action(user_id, 'KEPT', 'test entry')
+        log_action(user_id, 'DROPPED', 'test entry')
+    assert writer.stats() == {'queued': 1, 'written': 0, 'dropped': 1}
+
+    writer.flush()
+    assert logged_actions(app) == [('KEPT', 'admin')]
+
+
+def test_a_forked_worker_starts_its_own_audit_queue(app, user_id, monkeypatch):
+    writer = app.extensions['audit_writer']
+    pid = SimpleNamespace(value=1000)
+    monkeypatch.setattr(audit, 'os', SimpleNamespace(getpid=lambda: pid.value))
+    with app.app_context():
+        log_action(user_id, 'PARENT', 'test entry')
+        parent_queue, parent_thread = writer.queue, writer._thread
+
+        pid.value = 1001
+        log_action(user_id, 'CHILD', 'test entry')
+    assert writer.queue is not parent_queue
+    assert writer._thread is not parent_thread and writer._thread.is_alive()
+
+    writer.shutdown()
+    assert ('CHILD', 'admin') in logged_actions(app)
+
+
+def test_export_streams_the_filtered_logs_as_ndjson(app, client, auth_headers, user_id):
+    with app.app_context():
+        for action in ('STOCKTAKE', 'CHECKOUT_SUCCESS', 'STOCKTAKE'):
+            log_action(user_id, action, f'{action} entry')
+    app.extensions['audit_writer'].shutdown()
+
+    response = client.get('/logs/export?action=STOCKTAKE', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(row['action'], row['user_id'], row['acting_username']) for row in rows] == [
+        ('STOCKTAKE', user_id, 'admin'), ('STOCKTAKE', user_id, 'admin')
+    ]
+    assert rows[0]['id'] < rows[1]['id']
+
+
+def test_export_gzips_csv_when_the_client_accepts_it(app, client, auth_headers, user_id):
+    with app.app_context():
+        log_action(user_id, 'STOCKTAKE', 'counted, with a comma')
+    app.extensions['audit_writer'].shutdown()
+
+    response = client.get('/logs/export?format=csv&action=STOCKTAKE',
+                          headers={**auth_headers, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.get_data()).decode('utf-8'))))
+    assert [(row['action'], row['message']) for row in rows] == [('STOCKTAKE', 'counted, with a comma')]
+
+
+def test_export_rejects_an_unknown_format(client, auth_headers):
+    response = client.get('/logs/export?format=xml', headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_sales_logs_join_the_invoice_the_entry_references(app, client, auth_headers, products):
+    response = client.post('/invoices/checkout', headers=auth_headers, json={
+        'items': [{'item': {'id': products[0]}, 'number_sold': 2}, {'item': {'id': products[1]}, 'number_sold': 1}],
+    })
+    assert response.status_code == 201
+    invoice_id = response.get_json()['invoice_id']
+    app.extensions['audit_writer'].shutdown()
+
+    response = client.get('/logs/sales', headers=auth_headers)
+    assert response.status_code == 200
+    [log] = [log for log in response.get_json()['logs'] if log['action'] == 'CHECKOUT_SUCCESS']
+    assert log['invoice']['id'] == invoice_id
+    assert [(item['product_name'], item['quantity']) for item in log['invoice']['items']] == [
+        ('Wine 0', 2), ('Wine 1', 1)
+    ]
+
+
+def test_deleting_a_product_clears_it_from_its_log_entries(app, user_id, products):
+    with app.app_context():
+        log_action(user_id, 'PRODUCT_UPDATE', 'test entry', product_id=products[3])
+    app.extensions['audit_writer'].shutdown()
+
+    with app.app_context():
+        db.session.execute(db.delete(Product).where(Product.id == products[3]))
+        db.session.commit()
+        assert db.session.query(logEntry.action, logEntry.product_id).all() == [('PRODUCT_UPDATE', None)]
+
+
+def test_entries_for_a_product_deleted_before_the_write_are_kept(app, user_id, products, monkeypatch):
+    writer = app.extensions['audit_writer']
+    monkeypatch.setattr(writer, '_ensure_started', lambda: None)  # Hold the rows until flush
+    with app.app_context():
+        log_action(user_id, 'PRODUCT_UPDATE', 'still here', product_id=products[2])
+        log_action(user_id, 'PRODUCT_DELETE', 'already gone', product_id=products[3])
+        db.session.execute(db.delete(Product).where(Product.id == products[3]))
+        db.session.commit()
+    writer.flush()
+
+    with app.app_context():
+        assert db.session.query(logEntry.message, logEntry.product_id, logEntry.user_id).order_by(logEntry.id).all() == [
+            ('still here', products[2], user_id), ('already gone', None, user_id)
+        ]
@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import DailySales, Invoice, Product
+from app.models import models
+from app.utils.inventory import apply_stock_adjustments, create_invoice, parse_adjustments
+
+
+def test_deleting_a_sold_product_is_a_conflict(app, client, auth_headers, user_id, products):
+    with app.app_context():
+        create_invoice(user_id, [(products[0], 1)])
+
+    response = client.delete(f'/products/{products[0]}', headers=auth_headers)
+    assert response.status_code == 409
+    assert 'cannot be deleted' in response.get_json()['message']
+    with app.app_context():
+        assert db.session.get(Product, products[0]) is not None
+
+    assert client.delete(f'/products/{products[1]}', headers=auth_headers).status_code == 200
+
+
+def stock_events(client, auth_headers, after=0):
+    response = client.get(f'/products/stock-events?after={after}', headers=auth_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    return [(event['type'], event['previous'], event['in_stock'], event['reorder_level'])
+            for event in body['events']], body['last_seq']
+
+
+def test_product_update_queues_one_event_for_stock_and_reorder_level(client, auth_headers, products):
+    def update(**fields):
+        assert client.put(f'/products/{products[0]}', headers=auth_headers, json=fields).status_code == 200
+
+    update(in_stock=3, reorder_level=5)
+    events, last_seq = stock_events(client, auth_headers)
+    assert events == [('low_stock', 1000, 3, 5)]
+
+    # Lowering the level alone would restock it; emptying it at the same time must not
+    update(in_stock=0, reorder_level=0)
+    events, _ = stock_events(client, auth_headers, last_seq)
+    assert events == [('out_of_stock', 3, 0, 0)]
+
+
+
+def test_stock_events_are_published_only_when_the_change_commits(app, products):
+    queue = app.extensions['stock_events']
+    with app.app_context():
+        apply_stock_adjustments(parse_adjustments([{'product_id': products[0], 'count': 0}]))
+        assert queue.poll()[0] == []  # Not committed yet
+        db.session.rollback()
+        assert queue.poll()[0] == []
+
+        apply_stock_adjustments(parse_adjustments([{'product_id': products[0], 'count': 0}]))
+        db.session.commit()
+    events, _, missed = queue.poll()
+    assert [(event['type'], event['product_id'], event['previous']) for event in events] == [
+        ('out_of_stock', products[0], 1000)
+    ]
+    assert not missed
+
+@pytest.mark.parametrize('field', ['in_stock', 'reorder_level'])
+@pytest.mark.parametrize('value', [-1, 2.5, '7', True, None])
+def test_stock_fields_must_be_non_negative_integers(client, auth_headers, products, field, value):
+    response = client.put(f'/products/{products[0]}', headers=auth_headers, json={field: value})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == f'{field} must be a non-negative integer'
+
+    response = client.post('/products/add', headers=auth_headers, json={
+        'name': 'New wine', 'price': 12, 'category_id': 1, 'bottle_size': 750, 'in_stock': 6, field: value,
+    })
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == f'{field} must be a non-negative integer'
+
+
+def test_invoice_total_is_the_sum_of_its_lines(app, client, auth_headers, products):
+    response = client.post('/invoices/checkout', headers=auth_headers, json={
+        'items': [{'item': {'id': products[0]}, 'number_sold': 2}, {'item': {'id': products[1]}, 'number_sold': 1}],
+        'total_amount': 1,
+    })
+    assert response.status_code == 201
+    with app.app_context():
+        assert db.session.get(Invoice, response.get_json()['invoice_id']).total_amount == Decimal('31')
+
+
+def test_revenue_covers_the_last_30_times_24_hours(app, client, auth_headers, user_id, products):
+    now = datetime.utcnow()
+    ages = [timedelta(days=30, hours=1), timedelta(days=30) - timedelta(hours=1), timedelta(days=15), timedelta()]
+    with app.app_context():
+        for quantity, age in enumerate(ages, start=1):
+            invoice = create_invoice(user_id, [(products[0], quantity)])
+            invoice.created_at = now - age
+        db.session.commit()
+        DailySales.rebuild(None)
+        db.session.commit()
+
+    response = client.get('/products/revenue', headers=auth_headers)
+    assert response.status_code == 200
+    # Only the invoice from just over 30 days ago (1 bottle at 10) is left out
+    assert Decimal(str(response.get_json()['revenue'])) == Decimal('90')
+
+
+def test_compare_sales_reads_both_periods_in_one_query(app, client, auth_headers, user_id, products):
+    now = datetime.utcnow()
+    with app.app_context():
+        # 10 and 20 in the last 30 days, 10 in the 30 before, 30 outside both
+        for quantity, days_ago in [(1, 0), (2, 5), (1, 40), (3, 70)]:
+            invoice = create_invoice(user_id, [(products[0], quantity)])
+            invoice.created_at = now - timedelta(days=days_ago)
+        db.session.commit()
+        DailySales.rebuild(None)
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    response = client.get('/products/compare-sales', headers=auth_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (Decimal(body['current_month_sales']), Decimal(body['previous_month_sales'])) == (30, 10)
+    assert (float(body['growth_factor']), float(body['percentage_change'])) == (3, 200)
+    assert len([statement for statement in statements if 'FROM daily_sales' in statement]) == 1
+
+
+def test_sales_series_returns_one_total_per_period(app, client, auth_headers, user_id, products):
+    now = datetime.utcnow()
+    with app.app_context():
+        for quantity, days_ago in [(1, 0), (2, 1), (4, 8)]:
+            invoice = create_invoice(user_id, [(products[0], quantity)])
+            invoice.created_at = now - timedelta(days=days_ago)
+        db.session.commit()
+        DailySales.rebuild(None)
+
+    response = client.get('/products/sales-series?interval=week&periods=3', headers=auth_headers)
+    assert response.status_code == 200
+    series = response.get_json()['series']
+    assert [Decimal(str(period['revenue'])) for period in series] == [Decimal('0'), Decimal('40'), Decimal('30')]
+    assert series[-1]['end'] == now.strftime('%Y-%m-%d')
+
+
+def search(client, auth_headers, query_string):
+    response = client.get(f'/products/search?{query_string}', headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_search_filters_sorts_and_pages_with_a_cursor(client, auth_headers, products):
+    first = search(client, auth_headers, 'q=wine&min_price=11&sort=price&order=desc&limit=2')
+    assert [product['name'] for product in first['products']] == ['Wine 3', 'Wine 2']
+    second = search(client, auth_headers, f"q=wine&min_price=11&sort=price&order=desc&limit=2&cursor={first['next_cursor']}")
+    assert [product['name'] for product in second['products']] == ['Wine 1']
+    assert second['next_cursor'] is None
+
+    assert search(client, auth_headers, 'q=Wine%202&match=prefix')['products'][0]['id'] == products[2]
+    assert search(client, auth_headers, 'q=ine%202&match=prefix')['products'] == []
+
+
+@pytest.mark.parametrize('fts', [True, False])
+def test_search_by_name_with_and_without_the_fts_index(app, client, auth_headers, products, monkeypatch, fts):
+    if not fts:
+        monkeypatch.setattr(models, 'has_product_name_fts', lambda: False)
+    with app.app_context():
+        db.session.get(Product, products[3]).name = 'Rosé Spritz'
+        db.session.commit()
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    assert [product['id'] for product in search(client, auth_headers, 'q=spritz')['products']] == [products[3]]
+    assert search(client, auth_headers, 'q=Wine%203')['products'] == []
+    assert any('products_fts' in statement for statement in statements) == fts
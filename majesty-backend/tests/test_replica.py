@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.utils.replica import REPLICA_BIND, sync_sqlite_replica
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    yield {'SQLALCHEMY_REPLICA_URI': f"sqlite:///{tmp_path / 'replica.db'}"}
+    # db outlives the app: drop the bind's metadata so the next app does not look for it
+    db.metadatas.pop(REPLICA_BIND, None)
+
+
+def checkout(client, auth_headers, product_id, quantity):
+    response = client.post('/invoices/checkout', headers=auth_headers, json={
+        'items': [{'item': {'id': product_id}, 'number_sold': quantity}],
+    })
+    assert response.status_code == 201
+
+
+def test_reports_read_the_replica_until_it_falls_behind(app, client, auth_headers, products):
+    checkout(client, auth_headers, products[0], 1)
+    with app.app_context():
+        sync_sqlite_replica()
+        replica_reads = []
+        event.listen(db.engines[REPLICA_BIND], 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: replica_reads.append(statement))
+
+    def revenue():
+        replica_reads.clear()
+        response = client.get('/products/revenue', headers=auth_headers)
+        assert response.status_code == 200
+        return Decimal(str(response.get_json()['revenue']))
+
+    assert revenue() == Decimal('10')
+    assert any('FROM daily_sales' in statement for statement in replica_reads)
+
+    # The replica has not seen this checkout yet, so the report reads the primary
+    checkout(client, auth_headers, products[0], 2)
+    assert revenue() == Decimal('30')
+    assert not any('FROM daily_sales' in statement for statement in replica_reads)
+
+    with app.app_context():
+        sync_sqlite_replica()
+    assert revenue() == Decimal('30')
+    assert any('FROM daily_sales' in statement for statement in replica_reads)
+
+
+def test_writes_stay_on_the_primary(app, client, auth_headers, products):
+    with app.app_context():
+        sync_sqlite_replica()
+    checkout(client, auth_headers, products[1], 1)
+    with app.app_context():
+        with db.engines[REPLICA_BIND].connect() as conn:
+            assert conn.exec_driver_sql('SELECT COUNT(*) FROM invoices').scalar() == 0
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT COUNT(*) FROM invoices').scalar() == 1
@@ -0,0 +1,123 @@
+import multiprocessing
+import runpy
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from app import db
+from app.utils.db_pool import engine_options
+
+GUNICORN_CONF = str(Path(__file__).resolve().parent.parent / 'gunicorn.conf.py')
+
+
+def load_gunicorn_conf(monkeypatch, **environ):
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    return runpy.run_path(GUNICORN_CONF)
+
+
+def test_gunicorn_defaults_scale_with_cores_and_preload(monkeypatch):
+    conf = load_gunicorn_conf(monkeypatch)
+    assert conf['workers'] == multiprocessing.cpu_count() * 2 + 1
+    assert (conf['worker_class'], conf['threads'], conf['preload_app']) == ('gthread', 4, True)
+
+    # gevent has to patch the standard library before the app is imported
+    conf = load_gunicorn_conf(monkeypatch, GUNICORN_WORKER_CLASS='gevent', GUNICORN_WORKERS='3')
+    assert (conf['workers'], conf['threads'], conf['preload_app']) == (3, 1, False)
+
+
+@pytest.mark.parametrize('preload', [True, False])
+def test_post_fork_gives_a_preloaded_worker_its_own_pool(app, client, auth_headers, monkeypatch, preload):
+    assert client.get('/products/all', headers=auth_headers).status_code == 200
+    with app.app_context():
+        parent_pool = db.engine.pool
+    assert app.extensions['pool_stats'].checkouts > 0
+
+    monkeypatch.setitem(sys.modules, 'wsgi', SimpleNamespace(app=app))
+    conf = load_gunicorn_conf(monkeypatch)
+    conf['post_fork'](SimpleNamespace(cfg=SimpleNamespace(preload_app=preload)), worker=None)
+
+    with app.app_context():
+        assert (db.engine.pool is not parent_pool) == preload
+    assert (app.extensions['pool_stats'].checkouts == 0) == preload
+
+
+def test_postgres_pool_options_and_statement_timeout():
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql+psycopg://pos@db/majesty',
+        'DB_POOL_SIZE': 3,
+        'DB_MAX_OVERFLOW': 2,
+        'DB_STATEMENT_TIMEOUT_MS': 2000,
+    })
+    assert (options['pool_size'], options['max_overflow'], options['pool_pre_ping']) == (3, 2, True)
+    assert options['connect_args'] == {'options': '-c statement_timeout=2000'}
+
+    # PgBouncer transaction pooling: no prepared statements, no session options
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql+psycopg://pos@pgbouncer/majesty',
+        'DB_PGBOUNCER': True,
+        'DB_STATEMENT_TIMEOUT_MS': 2000,
+    })
+    assert options['connect_args'] == {'prepare_threshold': None}
+
+
+def test_sqlite_connections_get_the_tuning_pragmas(app):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert conn.exec_driver_sql('PRAGMA foreign_keys').scalar() == 1
+            assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+
+
+def test_pool_metrics_count_checkouts(client, auth_headers):
+    response = client.get('/metrics/pool', headers=auth_headers)
+    assert response.status_code == 200
+    pool = response.get_json()
+    assert pool['checkouts'] > 0
+    assert pool['pool_size'] == 5
+    assert pool['checked_out'] >= 1  # This request's own connection
+    assert sum(bucket['count'] for bucket in pool['wait_buckets']) == pool['checkouts']
+
+
+def scrape(client, headers):
+    """{(name, endpoint, status): value} for the samples served by /metrics."""
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        labels = dict(label.split('=', 1) for label in labels.rstrip('}').split(',') if label)
+        samples[(name, labels.get('endpoint', '').strip('"'), labels.get('status', '').strip('"'))] = float(value)
+    return samples
+
+
+def test_metrics_count_requests_and_their_sql(client, auth_headers, products, query_counter):
+    query_counter.reset()
+    for _ in range(2):
+        assert client.get('/products/all', headers=auth_headers).status_code == 200
+    queries = query_counter.count
+
+    samples = scrape(client, auth_headers)
+    assert samples[('wss_http_requests_total', '/products/all', '200')] == 2
+    assert samples[('wss_http_request_duration_seconds_count', '/products/all', '')] == 2
+    assert samples[('wss_db_queries_per_request_sum', '/products/all', '')] == queries
+    assert samples[('wss_http_response_bytes_total', '/products/all', '')] > 0
+
+
+def test_metrics_need_an_access_token_without_metrics_token(client, auth_headers):
+    assert client.get('/metrics').status_code == 401
+    assert client.post('/auth/logout', headers=auth_headers).status_code == 200
+    assert client.get('/metrics', headers=auth_headers).status_code == 401
+
+
+@pytest.mark.parametrize('app_config', [{'METRICS_TOKEN': 'scrape-secret'}])
+def test_metrics_token_is_the_only_way_in_when_set(client, auth_headers):
+    assert client.get('/metrics', headers=auth_headers).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert ('wss_audit_queue_length', '', '') in scrape(client, {'Authorization': 'Bearer scrape-secret'})
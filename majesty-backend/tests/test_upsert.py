@@ -0,0 +1,47 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import DailySales, Product
+from app.utils.upsert import _upsert_portable, upsert
+
+
+def add_sales(table, excluded):
+    return {'quantity': table.c.quantity + excluded.quantity, 'revenue': table.c.revenue + excluded.revenue,
+            'invoice_count': table.c.invoice_count + excluded.invoice_count}
+
+
+def sales_row(product_id, user_id, quantity, revenue):
+    return {'day': date(2026, 10, 1), 'product_id': product_id, 'user_id': user_id,
+            'quantity': quantity, 'revenue': revenue, 'invoice_count': 1}
+
+
+@pytest.mark.parametrize('write', [upsert, _upsert_portable], ids=['native', 'portable'])
+def test_upsert_adds_to_existing_rows_and_inserts_new_ones(app, user_id, products, write):
+    with app.app_context():
+        write(db.session, DailySales.__table__, [sales_row(products[0], user_id, 2, Decimal('20'))],
+              ['day', 'product_id', 'user_id'], add_sales)
+        write(db.session, DailySales.__table__, [
+            sales_row(products[0], user_id, 3, Decimal('30')),
+            sales_row(products[1], user_id, 1, Decimal('11')),
+        ], ['day', 'product_id', 'user_id'], add_sales)
+        db.session.commit()
+
+        rows = db.session.query(DailySales.product_id, DailySales.quantity, DailySales.revenue,
+                                DailySales.invoice_count).order_by(DailySales.product_id).all()
+    assert [tuple(row) for row in rows] == [(products[0], 5, Decimal('50'), 2), (products[1], 1, Decimal('11'), 1)]
+
+
+def test_portable_upsert_overwrites_only_the_given_columns(app, products):
+    with app.app_context():
+        product = db.session.get(Product, products[0])
+        row = {'name': product.name, 'price': Decimal('99'), 'category_id': product.category_id,
+               'bottle_size': 750, 'added_by': product.added_by}
+        _upsert_portable(db.session, Product.__table__, [row], ['name'],
+                         lambda table, excluded: {'price': excluded.price})
+        db.session.commit()
+        product = db.session.get(Product, products[0])
+        assert (product.price, product.in_stock) == (Decimal('99'), 1000)
+        assert Product.query.count() == len(products)
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers. Run from the majesty-backend directory:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The configuration is chosen by FLASK_ENV as for `flask run` (set it to production).
+"""
+from app import create_app
+
+app = create_app()